@@ -0,0 +1,97 @@
+'''
+Login throughput and latency for each password hashing work factor.
+
+For every cost a user is registered with that QBAY_PASSWORD_ITERATIONS
+value and logged in repeatedly from --threads threads against a scratch
+SQLite database (or db_string, if set).
+
+    python -m benchmarks.bench_login [--costs 10000,100000,260000]
+                                     [--logins 200] [--threads 4]
+                                     [--slo-ms 250]
+
+With --slo-ms the strongest cost whose p99 fits the SLO is reported.
+'''
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault('db_string',
+                      'sqlite:///%s/bench_login.sqlite' % _tmp.name)
+
+from qbay import app  # noqa: E402
+from qbay.models import db, register, login  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def bench_cost(cost, logins, threads):
+    '''
+    Returns (logins per second, p50 ms, p99 ms) for one work factor.
+    '''
+    app.config['QBAY_PASSWORD_ITERATIONS'] = cost
+    email = 'bench%d@bench.com' % cost
+    register('bench user', email, '123aBc!')
+    if not login(email, '123aBc!'):
+        raise SystemExit('login failed, is email validation offline?')
+
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(count):
+        mine = []
+        try:
+            for _ in range(count):
+                start = time.perf_counter()
+                login(email, '123aBc!')
+                mine.append((time.perf_counter() - start) * 1000)
+        finally:
+            db.session.remove()
+        with lock:
+            latencies.extend(mine)
+
+    per_thread = max(1, logins // threads)
+    workers = [threading.Thread(target=worker, args=(per_thread,))
+               for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return (len(latencies) / elapsed, percentile(latencies, 50),
+            percentile(latencies, 99))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--costs', default='10000,100000,260000,600000')
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--slo-ms', type=float)
+    args = parser.parse_args(argv)
+
+    print('%10s %12s %10s %10s' % ('iterations', 'logins/s', 'p50 ms',
+                                   'p99 ms'))
+    fits = None
+    for cost in map(int, args.costs.split(',')):
+        rate, p50, p99 = bench_cost(cost, args.logins, args.threads)
+        print('%10d %12.1f %10.2f %10.2f' % (cost, rate, p50, p99))
+        if args.slo_ms is not None and p99 <= args.slo_ms:
+            fits = cost if fits is None else max(fits, cost)
+
+    if args.slo_ms is not None:
+        if fits is None:
+            print('no cost fits a p99 of %.1f ms' % args.slo_ms)
+        else:
+            print('strongest cost within a p99 of %.1f ms: %d'
+                  % (args.slo_ms, fits))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''
+Write and read throughput of each SQLite profile (QBAY_SQLITE_PROFILE).
+
+Every profile gets a fresh interpreter and a scratch database, seeded with
+a seller, a buyer and --products products. Then --threads threads run for
+--seconds each:
+
+    writes  purchase_product, one transaction per order
+    reads   the first page of browse_products for a random price range
+
+    python -m benchmarks.bench_sqlite [--profiles default,tuned]
+                                      [--threads 8] [--seconds 3]
+
+Errors are operations that raised, e.g. "database is locked".
+'''
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def measure(threads, seconds, products):
+    '''
+    Runs in the child interpreter; prints the results as JSON.
+    '''
+    from qbay.models import db, User, register, create_product, \
+        purchase_product, browse_products
+
+    register('bench seller', 'seller@bench.com', '123aBc!')
+    register('bench buyer', 'buyer@bench.com', '123aBc!')
+    User.query.update({User.balance: 10 ** 9})
+    db.session.commit()
+    for i in range(products):
+        create_product('bench product %d' % i, 'a product to benchmark',
+                       11 + i % 1000, '2024-01-01', 'seller@bench.com')
+    db.session.remove()
+
+    def write(rng):
+        purchase_product('bench product %d' % rng.randrange(products),
+                         'buyer@bench.com')
+
+    def read(rng):
+        low = rng.randrange(11, 1000)
+        next(browse_products(min_price=low, max_price=low + 50), None)
+
+    results = {}
+    for name, operation in (('writes', write), ('reads', read)):
+        counts = []
+        deadline = time.perf_counter() + seconds
+
+        def worker(n):
+            rng = random.Random(n)
+            done = errors = 0
+            while time.perf_counter() < deadline:
+                try:
+                    operation(rng)
+                    done += 1
+                except Exception:
+                    db.session.rollback()
+                    errors += 1
+            db.session.remove()
+            counts.append((done, errors))
+
+        workers = [threading.Thread(target=worker, args=(n,))
+                   for n in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        results[name] = {'ops_per_s': sum(d for d, _ in counts) / seconds,
+                         'errors': sum(e for _, e in counts)}
+    print(json.dumps(results))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profiles', default='default,tuned')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        measure(args.threads, args.seconds, args.products)
+        return 0
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    print('%-10s %12s %8s %12s %8s' % ('profile', 'writes/s', 'errors',
+                                       'reads/s', 'errors'))
+    for profile in args.profiles.split(','):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, PYTHONPATH=root,
+                       QBAY_SQLITE_PROFILE=profile,
+                       db_string='sqlite:///%s/bench.sqlite' % tmp)
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_sqlite', '--child',
+                 '--threads', str(args.threads),
+                 '--seconds', str(args.seconds),
+                 '--products', str(args.products)],
+                env=env, check=True, stdout=subprocess.PIPE).stdout
+        r = json.loads(output.splitlines()[-1])
+        print('%-10s %12.1f %8d %12.1f %8d' % (
+            profile, r['writes']['ops_per_s'], r['writes']['errors'],
+            r['reads']['ops_per_s'], r['reads']['errors']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+'''
+Import-time and cold-start benchmark for python -m qbay.
+
+Each sample is a fresh interpreter against a scratch SQLite database:
+
+    import      import qbay.__main__ (everything the menu needs)
+    cold start  import plus the first query, which creates the schema
+    warm start  import plus the first query on an initialized database
+
+    python -m benchmarks.bench_startup [--runs N] [--budget-ms MS]
+
+With --budget-ms the exit status is 1 when the median warm start is over
+budget, so it can be used as a CI gate.
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+IMPORT = 'import qbay.__main__'
+FIRST_QUERY = IMPORT + '; from qbay.models import User; User.query.first()'
+
+
+def sample(code, env):
+    '''
+    Wall time of one fresh interpreter running code, in milliseconds.
+    '''
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - start) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float)
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {'baseline': [], 'import': [], 'cold start': [],
+               'warm start': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, PYTHONPATH=root)
+        for i in range(args.runs):
+            env['db_string'] = 'sqlite:///%s/bench%d.sqlite' % (tmp, i)
+            results['baseline'].append(sample('pass', env))
+            results['import'].append(sample(IMPORT, env))
+            results['cold start'].append(sample(FIRST_QUERY, env))
+            results['warm start'].append(sample(FIRST_QUERY, env))
+
+    print('%-12s %10s %10s' % ('', 'median ms', 'max ms'))
+    for name, times in results.items():
+        print('%-12s %10.1f %10.1f' % (name, statistics.median(times),
+                                       max(times)))
+
+    warm = statistics.median(results['warm start'])
+    if args.budget_ms is not None and warm > args.budget_ms:
+        print('warm start %.1f ms is over the %.1f ms budget'
+              % (warm, args.budget_ms))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+'''
+Micro-benchmark of the input rules: the per-call inline checks the model
+functions used to run versus qbay.validation.validate_batch.
+
+    python -m benchmarks.bench_validation [records]
+'''
+import re
+import sys
+import timeit
+from datetime import datetime
+
+from qbay.validation import validate_batch
+
+
+def legacy_registration(name, email, password):
+    '''
+    The R1 checks as they were written inline in register.
+    '''
+    specialChar = ['!', '@', '#', '$', '%', '&', '*', '?']
+    email_regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+    if not email or not password:
+        return False
+    if (re.fullmatch(email_regex, email)) is None:
+        return False
+    if (len(password) < 6 or password.lower() == password or password.upper()
+            == password or password.isalpha() or
+            not any(i in specialChar for i in password) or
+            not any(i.isdigit() for i in password)):
+        return False
+    if not name or not re.match(r"^[ \w]+$", name) or name.strip() != name:
+        return False
+    if len(name) <= 2 or len(name) > 20:
+        return False
+    return True
+
+
+def legacy_product(title, description, price, date):
+    '''
+    The R4 checks as they were written inline in create_product.
+    '''
+    if not title or not re.match(r"^[ \w]+$", title) or title.strip() != title:
+        return False
+    if len(title) > 80:
+        return False
+    if len(description) < 20 or len(description) > 2000:
+        return False
+    if len(title) >= len(description):
+        return False
+    if price <= 10 or price >= 10000:
+        return False
+    if type(date) is str:
+        year, month, day = map(int, date.split('-'))
+        date = datetime(year, month, day)
+    if date < datetime(2021, 1, 2) or date > datetime(2025, 1, 2):
+        return False
+    return True
+
+
+def per_record(func, records, number=5):
+    '''
+    Best time per record, in microseconds, over number runs.
+    '''
+    runs = timeit.repeat(lambda: func(records), number=1, repeat=number)
+    return min(runs) / len(records) * 1e6
+
+
+def main(n=20000):
+    users = [('user %d' % (i % 1000), 'user%d@test.com' % i,
+              ('123aBc!', 'abcdef1!', 'Ab1!')[i % 3]) for i in range(n)]
+    products = [('title %d' % i, 'description of product %d' % i,
+                 (20, 5, 50)[i % 3], '2022-03-%02d' % (i % 28 + 1))
+                for i in range(n)]
+
+    cases = [
+        ('register', users, legacy_registration),
+        ('product', products, legacy_product),
+    ]
+    print('%-10s %12s %12s %8s' % ('kind', 'before (us)', 'after (us)',
+                                   'speedup'))
+    for kind, records, legacy in cases:
+        before = per_record(lambda rs: [legacy(*r) for r in rs], records)
+        after = per_record(lambda rs: validate_batch(kind, rs), records)
+        print('%-10s %12.3f %12.3f %7.1fx'
+              % (kind, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -3,6 +3,8 @@ an init file is required for this folder to be considered as a module
 '''
 from flask import Flask
 import os
+from qbay.pool import TimedQueuePool
+from qbay.sqlite import check_profile
 app = Flask(__name__)
 db_string = os.getenv('db_string')
 if db_string:
@@ -10,3 +12,67 @@ if db_string:
 else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../db.sqlite'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Connection pool of server databases, and of SQLite with a tuned profile.
+# Keep QBAY_DB_POOL_RECYCLE (seconds) below MySQL's wait_timeout so idle
+# connections are replaced before the server closes them; pre-ping also
+# replaces any connection that died anyway. Statistics: qbay.pool.
+pool_options = {
+    'poolclass': TimedQueuePool,
+    'pool_size': int(os.getenv('QBAY_DB_POOL_SIZE', '10')),
+    'max_overflow': int(os.getenv('QBAY_DB_MAX_OVERFLOW', '10')),
+    'pool_timeout': float(os.getenv('QBAY_DB_POOL_TIMEOUT', '30')),
+}
+# SQLite pragmas (qbay.sqlite): 'default' or 'tuned' (WAL and friends)
+app.config['QBAY_SQLITE_PROFILE'] = check_profile(
+    os.getenv('QBAY_SQLITE_PROFILE', 'default'))
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+        pool_options,
+        pool_recycle=int(os.getenv('QBAY_DB_POOL_RECYCLE', '1800')),
+        pool_pre_ping=os.getenv('QBAY_DB_POOL_PRE_PING', 'on').lower()
+        not in ('0', 'off', 'false', 'no'))
+elif app.config['QBAY_SQLITE_PROFILE'] != 'default':
+    # pooled connections are handed from thread to thread
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+        pool_options, connect_args={'check_same_thread': False})
+
+# in-process product cache (qbay.models.product_cache); size 0 disables it
+app.config['QBAY_PRODUCT_CACHE_SIZE'] = int(
+    os.getenv('QBAY_PRODUCT_CACHE_SIZE', '10000'))
+product_cache_ttl = os.getenv('QBAY_PRODUCT_CACHE_TTL')
+app.config['QBAY_PRODUCT_CACHE_TTL'] = \
+    float(product_cache_ttl) if product_cache_ttl else None
+
+# PBKDF2 work factor for stored passwords (qbay.passwords); changing it
+# rehashes each user's password on their next login
+app.config['QBAY_PASSWORD_ITERATIONS'] = int(
+    os.getenv('QBAY_PASSWORD_ITERATIONS', '260000'))
+# threads hashing passwords for register_many (qbay.passwords), one per
+# core by default
+app.config['QBAY_PASSWORD_HASH_WORKERS'] = int(
+    os.getenv('QBAY_PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+
+# Email deliverability (DNS) checks: 'off' checks syntax only, 'sync' looks
+# the domain up before accepting, 'async' looks it up in the background and
+# rejects the address from then on if it is undeliverable
+app.config['QBAY_EMAIL_DELIVERABILITY'] = os.getenv(
+    'QBAY_EMAIL_DELIVERABILITY', 'off')
+app.config['QBAY_EMAIL_CACHE_SIZE'] = int(
+    os.getenv('QBAY_EMAIL_CACHE_SIZE', '10000'))
+
+# How long (seconds) purchase and create_product remember an idempotency
+# key and the result it produced (qbay.models.IdempotencyKeys)
+app.config['QBAY_IDEMPOTENCY_TTL'] = float(
+    os.getenv('QBAY_IDEMPOTENCY_TTL', '86400'))
+
+# Bloom filters in front of the email and title uniqueness lookups
+# (qbay.bloom): 'on' or 'off'. Each filter is sized for at least
+# QBAY_BLOOM_CAPACITY values at QBAY_BLOOM_ERROR_RATE false positives, and
+# is loaded from QBAY_BLOOM_SNAPSHOT_DIR when a snapshot is there
+app.config['QBAY_BLOOM_FILTERS'] = os.getenv('QBAY_BLOOM_FILTERS', 'off')
+app.config['QBAY_BLOOM_CAPACITY'] = int(
+    os.getenv('QBAY_BLOOM_CAPACITY', '100000'))
+app.config['QBAY_BLOOM_ERROR_RATE'] = float(
+    os.getenv('QBAY_BLOOM_ERROR_RATE', '0.01'))
+app.config['QBAY_BLOOM_SNAPSHOT_DIR'] = os.getenv('QBAY_BLOOM_SNAPSHOT_DIR')
@@ -1,12 +1,20 @@
 """
 main file to import all models
 """
+import argparse
+import json
+import os
+import sys
+
 from qbay import *
 from qbay.cli import login_page, register_page, create_product_page, \
-    update_product_page, update_user_page, place_order_page
+    update_product_page, update_user_page, place_order_page, search_page, \
+    browse_page, UserSession
 
 
-def main():
+def menu():
+    # the logged in user, shared by the pages until the process exits
+    session = None
     while True:
         print('\n' * 3)
         selection = input('''Welcome. Please make a selection. 
@@ -14,30 +22,289 @@ def main():
         2 : register
         3 : user profile update
         4 : user home page
-        5 : place order''')
+        5 : place order
+        6 : search products
+        7 : browse products''')
         selection = selection.strip()
         if selection == '1':
             user = login_page()
             if user:
-                print(f'welcome {user.username}')
-                break
+                session = UserSession(user)
+                print(f'welcome {session.username}')
             else:
                 print('login failed')
         elif selection == '2':
             register_page()
         elif selection == '3':
-            update_user_page()
+            update_user_page(session)
         elif selection == '4':
             print("Please choose an option:")
             print("  1. Create a product")
             print("  2. Update a product")
             select2 = input()
             if select2 == '1':
-                create_product_page()
+                create_product_page(session)
             elif select2 == '2':
                 update_product_page()
         elif selection == '5':
-            place_order_page()
+            place_order_page(session)
+        elif selection == '6':
+            search_page()
+        elif selection == '7':
+            browse_page()
+
+
+def migrate_indexes_command(args):
+    '''
+    python -m qbay migrate-indexes [--dry-run]
+    '''
+    from qbay.migrate import migrate_indexes
+    migrate_indexes(dry_run=args.dry_run)
+
+
+def batch_command(args):
+    '''
+    python -m qbay batch <file|-> [--chunk-size N] [--output FILE]
+    '''
+    from qbay.batch import run_batch
+    source = sys.stdin if args.file == '-' else open(args.file)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        stats = run_batch(source, out, chunk_size=args.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    print('%(operations)d operations, %(ok)d ok, %(failed)d failed' % stats,
+          file=sys.stderr)
+
+
+def export_command(args):
+    '''
+    python -m qbay export transactions --format csv|jsonl [--since DATE]
+        [--until DATE] [--output FILE] [--gzip] [--resume] [--after-id ID]
+    '''
+    from qbay.export import export_transactions, parse_time
+    stats = export_transactions(
+        output=args.output, fmt=args.format, since=parse_time(args.since),
+        until=parse_time(args.until), compress=args.gzip,
+        resume=args.resume, after_id=args.after_id,
+        chunk_size=args.chunk_size)
+    print('exported %(rows)d rows, last id %(last_id)d' % stats,
+          file=sys.stderr)
+
+
+def import_command(args):
+    '''
+    python -m qbay import products <file|-> [--format csv|jsonl]
+        [--rejects FILE] [--chunk-size N]
+    '''
+    from qbay.importer import import_products
+    fmt = args.format
+    if fmt is None:
+        fmt = 'jsonl' if args.file.endswith(('.jsonl', '.json')) else 'csv'
+    source = sys.stdin if args.file == '-' \
+        else open(args.file, newline='', encoding='utf-8')
+    rejects = None if args.rejects is None else open(args.rejects, 'w')
+    try:
+        stats = import_products(source, fmt=fmt, rejects=rejects,
+                                chunk_size=args.chunk_size)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if rejects is not None:
+            rejects.close()
+    print('%(rows)d rows, %(imported)d imported, %(rejected)d rejected'
+          % stats, file=sys.stderr)
+
+
+def rollups_command(args):
+    '''
+    python -m qbay rollups rebuild [--chunk-size N]
+    '''
+    from qbay.rollups import rebuild_rollups
+    counted = rebuild_rollups(
+        chunk_size=args.chunk_size,
+        out=lambda line: print(line, file=sys.stderr))
+    print('rebuilt sales rollups from %d transactions' % counted,
+          file=sys.stderr)
+
+
+def serve_command(args):
+    '''
+    python -m qbay serve [--host HOST] [--port PORT] [--workers N]
+        [--queue-size N] [--grace SECONDS]
+    '''
+    from qbay.server import serve
+    serve(host=args.host, port=args.port, workers=args.workers,
+          queue_size=args.queue_size, grace=args.grace)
+
+
+def orders_command(args):
+    '''
+    python -m qbay orders advance [--stage STAGE] [--chunk-size N]
+        [--follow] [--poll SECONDS]
+    '''
+    from qbay.orders import run_worker
+
+    def report(batch):
+        print('%-10s %6d orders %8.1f ms %10.1f orders/s' % (
+            batch.stage, batch.orders, batch.seconds * 1000,
+            batch.orders_per_s), file=sys.stderr)
+
+    totals = run_worker(stages=args.stage, chunk_size=args.chunk_size,
+                        follow=args.follow, poll=args.poll, out=report)
+    print(', '.join('%d %s' % (n, stage) for stage, n in totals.items()),
+          file=sys.stderr)
+
+
+def purge_keys_command(args):
+    '''
+    python -m qbay purge-keys [--chunk-size N]
+    '''
+    from qbay.models import purge_idempotency_keys
+    deleted = purge_idempotency_keys(chunk_size=args.chunk_size)
+    print('deleted %d expired idempotency keys' % deleted, file=sys.stderr)
+
+
+def bloom_command(args):
+    '''
+    python -m qbay bloom stats|snapshot [--dir DIR]
+    '''
+    from qbay.bloom import FILTERS, filter_stats
+    for existence_filter in FILTERS:
+        if args.action == 'snapshot':
+            path = None if args.dir is None else os.path.join(
+                args.dir, existence_filter.name + '.bloom')
+            print('wrote %s' % existence_filter.snapshot(path),
+                  file=sys.stderr)
+        else:
+            existence_filter.build()
+    if args.action == 'stats':
+        print(json.dumps(filter_stats(), indent=2))
+
+
+def build_parser():
+    '''
+    Command line options. With no command the interactive menu runs.
+    '''
+    parser = argparse.ArgumentParser(prog='python -m qbay')
+    parser.add_argument('--profile', action='store_true',
+                        help='time the model functions and count their SQL '
+                        'statements, reported on exit')
+    commands = parser.add_subparsers(dest='command')
+
+    migrate = commands.add_parser(
+        'migrate-indexes',
+        help='add missing indexes to an existing database')
+    migrate.add_argument('--dry-run', action='store_true',
+                         help='only list the indexes that would be created')
+    migrate.set_defaults(func=migrate_indexes_command)
+
+    batch = commands.add_parser(
+        'batch', help='run JSONL operations without the interactive menu')
+    batch.add_argument('file', help="JSONL operations, or - for stdin")
+    batch.add_argument('--chunk-size', type=int, default=100,
+                       help='operations per commit (default: 100)')
+    batch.add_argument('--output', default='-',
+                       help='where to write JSONL results (default: stdout)')
+    batch.set_defaults(func=batch_command)
+
+    export = commands.add_parser(
+        'export', help='stream a table to CSV or JSONL')
+    export.add_argument('table', choices=['transactions'])
+    export.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    export.add_argument('--since', help='first timestamp (ISO 8601)')
+    export.add_argument('--until', help='timestamp to stop before (ISO 8601)')
+    export.add_argument('--output', default='-',
+                        help='file to write (default: stdout)')
+    export.add_argument('--gzip', action='store_true',
+                        help='gzip the output')
+    export.add_argument('--resume', action='store_true',
+                        help='continue after the id in OUTPUT.checkpoint')
+    export.add_argument('--after-id', type=int, default=0,
+                        help='only export ids above this one')
+    export.add_argument('--chunk-size', type=int, default=1000,
+                        help='rows per query (default: 1000)')
+    export.set_defaults(func=export_command)
+
+    importer = commands.add_parser(
+        'import', help='bulk load products from CSV or JSONL')
+    importer.add_argument('table', choices=['products'])
+    importer.add_argument('file', help='CSV or JSONL file, or - for stdin')
+    importer.add_argument('--format', choices=['csv', 'jsonl'],
+                          help='default: from the file name, else csv')
+    importer.add_argument('--rejects',
+                          help='file to write rejected rows to (JSONL)')
+    importer.add_argument('--chunk-size', type=int, default=1000,
+                          help='rows per query and commit (default: 1000)')
+    importer.set_defaults(func=import_command)
+
+    rollups = commands.add_parser(
+        'rollups', help='recompute the sales totals from Transactions')
+    rollups.add_argument('action', choices=['rebuild'])
+    rollups.add_argument('--chunk-size', type=int, default=1000,
+                         help='transactions per query (default: 1000)')
+    rollups.set_defaults(func=rollups_command)
+
+    orders = commands.add_parser(
+        'orders', help='move orders through processed, shipped, delivered')
+    orders.add_argument('action', choices=['advance'])
+    orders.add_argument('--stage', action='append',
+                        choices=['processed', 'shipped', 'delivered'],
+                        help='only move orders into this status (may be '
+                        'repeated; default: all)')
+    orders.add_argument('--chunk-size', type=int, default=500,
+                        help='orders per batch (default: 500)')
+    orders.add_argument('--follow', action='store_true',
+                        help='keep polling for new orders')
+    orders.add_argument('--poll', type=float, default=1.0,
+                        help='seconds between polls with --follow')
+    orders.set_defaults(func=orders_command)
+
+    purge = commands.add_parser(
+        'purge-keys', help='delete expired idempotency keys')
+    purge.add_argument('--chunk-size', type=int, default=1000,
+                       help='keys per transaction (default: 1000)')
+    purge.set_defaults(func=purge_keys_command)
+
+    bloom = commands.add_parser(
+        'bloom', help='build, save or inspect the email and title Bloom '
+        'filters')
+    bloom.add_argument('action', choices=['stats', 'snapshot'])
+    bloom.add_argument('--dir', help='where to write snapshots (default: '
+                       'QBAY_BLOOM_SNAPSHOT_DIR)')
+    bloom.set_defaults(func=bloom_command)
+
+    server = commands.add_parser('serve', help='run the HTTP/JSON API')
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=8080)
+    server.add_argument('--workers', type=int, default=8,
+                        help='threads running database work (default: 8)')
+    server.add_argument('--queue-size', type=int, default=256,
+                        help='calls that may wait for a worker before '
+                        'requests get 503 (default: 256)')
+    server.add_argument('--grace', type=float, default=10,
+                        help='seconds to let requests finish on shutdown')
+    server.set_defaults(func=serve_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        from qbay import profiling
+        profiling.enable()
+    try:
+        if args.command is None:
+            menu()
+        else:
+            args.func(args)
+    finally:
+        if args.profile:
+            print(profiling.format_snapshot(), file=sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,136 @@
+'''
+Non-interactive batch mode: run JSONL operations through the model
+functions in one process.
+
+Each input line is a JSON object naming the operation and its keyword
+arguments, e.g.
+
+    {"op": "register", "args": {"name": "u0", "email": "a@b.com",
+                                "password": "123aBc!"}}
+
+and each operation produces one JSON result line,
+
+    {"line": 1, "op": "register", "ok": true, "result": true}
+
+Writes are committed every chunk_size operations. Results are written once
+their chunk is committed; if the commit fails, the operations of that chunk
+that had succeeded are reported as rolled back.
+'''
+import json
+
+from sqlalchemy import exc
+
+from qbay.models import db, deferred_commit, register, login, user_update, \
+    create_product, update_product, purchase_product, create_review, User
+
+OPERATIONS = {
+    'register': register,
+    'login': login,
+    'user_update': user_update,
+    'create_product': create_product,
+    'update_product': update_product,
+    'purchase': purchase_product,
+    'create_review': create_review,
+}
+
+
+def to_json(value):
+    '''
+    Turn a model function's return value into something JSON can hold.
+    '''
+    if isinstance(value, User):
+        return {'email': value.email, 'username': value.username,
+                'balance': value.balance}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def run_operation(line, record):
+    '''
+    Run one JSONL operation, filling in its result record. Database errors
+    are raised to the caller, which has to roll the session back.
+    '''
+    try:
+        request = json.loads(line)
+        record['op'] = request['op']
+        func = OPERATIONS[request['op']]
+        result = func(**request.get('args', {}))
+    except exc.SQLAlchemyError:
+        raise
+    except Exception as e:
+        # bad JSON, unknown op, wrong arguments or a missing row: the
+        # model functions validate before writing, so nothing was changed
+        record.update(ok=False, error='%s: %s' % (type(e).__name__, e))
+        return record
+    if isinstance(result, exc.SQLAlchemyError):
+        raise result
+    # the model functions return True/a user on success, False/None or an
+    # error message otherwise
+    record['ok'] = result is not None and result is not False \
+        and not isinstance(result, str)
+    record['result'] = to_json(result)
+    return record
+
+
+def _finish_chunk(pending, out, stats, error=None):
+    '''
+    Write the results of a chunk and count them, marking its writes as
+    rolled back when error is set.
+    '''
+    for record in pending:
+        if error is not None and record.get('ok'):
+            record.update(ok=False, error='rolled back: %s' % error)
+            record.pop('result', None)
+        stats['ok' if record['ok'] else 'failed'] += 1
+        out.write(json.dumps(record) + '\n')
+    pending.clear()
+
+
+def run_batch(lines, out, chunk_size=100):
+    '''
+    Run JSONL operations through the model functions
+      Parameters:
+        lines (iterable):  JSONL operations, one per item; blank lines
+                           are skipped
+        out (file):        where the JSONL results are written
+        chunk_size (int):  operations per commit
+      Returns:
+        A dict with the number of operations run, succeeded and failed
+    '''
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1')
+
+    stats = {'operations': 0, 'ok': 0, 'failed': 0}
+    pending = []
+
+    def commit():
+        try:
+            db.session.commit()
+        except exc.SQLAlchemyError as e:
+            db.session.rollback()
+            _finish_chunk(pending, out, stats, type(e).__name__)
+        else:
+            _finish_chunk(pending, out, stats)
+
+    with deferred_commit():
+        for line_no, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            stats['operations'] += 1
+            record = {'line': line_no}
+            pending.append(record)
+            try:
+                run_operation(line, record)
+            except exc.SQLAlchemyError as e:
+                # the session is unusable until rolled back, which also
+                # discards the earlier writes of this chunk
+                db.session.rollback()
+                record.update(ok=False, error=type(e).__name__)
+                _finish_chunk(pending, out, stats, type(e).__name__)
+                continue
+            if len(pending) >= chunk_size:
+                commit()
+        commit()
+
+    return stats
@@ -0,0 +1,279 @@
+'''
+Load generator for the model operations.
+
+    python -m qbay.bench [--mix login=40,purchase=20,...] [--ops 200]
+                         [--threads 4] [--processes 1] [--users 100]
+                         [--products 100] [--db URI] [--output FILE]
+
+Every worker thread of every worker process runs --ops operations picked
+at random, by weight, from the mix of register, login, user_update,
+create_product, update_product and purchase. The database is --db, else
+db_string, else a scratch SQLite file; it is seeded with --users users and
+--products products first. Worker processes are fresh interpreters, so the
+database choice reaches them through db_string.
+
+The report is JSON: for each operation the number run, how many succeeded,
+operations per second over the whole run, and p50/p95/p99 latency in
+milliseconds, plus the totals and the configuration, e.g. for comparing
+commits with
+
+    python -m qbay.bench --output before.json
+
+Logins and registrations are dominated by password hashing, so set
+QBAY_PASSWORD_ITERATIONS to compare runs with a different work factor.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from sqlalchemy import exc
+
+from qbay import app
+from qbay.models import db, User, register_many, create_product, \
+    get_product, login, register, user_update, update_product, \
+    purchase_product
+
+DEFAULT_MIX = {'register': 10, 'login': 30, 'user_update': 10,
+               'create_product': 10, 'update_product': 10, 'purchase': 30}
+PASSWORD = '123aBc!'
+DESCRIPTION = 'a product made by the load generator'
+# seed users can buy as many products as the run asks for
+SEED_BALANCE = 10 ** 9
+
+
+def parse_mix(text):
+    '''
+    'login=3,purchase=1' -> {'login': 3, 'purchase': 1}
+    '''
+    mix = {}
+    for item in text.split(','):
+        op, _, weight = item.partition('=')
+        op = op.strip()
+        if op not in DEFAULT_MIX:
+            raise ValueError('unknown operation: %r' % op)
+        mix[op] = float(weight or 1)
+    return mix
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _seed_user(run, i):
+    return 'b%s u%d' % (run, i), 'bench-%s-%d@bench.com' % (run, i)
+
+
+def _seed_title(run, i):
+    return 'bench %s product %d' % (run, i)
+
+
+def seed(config):
+    '''
+    Create the users and products the operations work on. Returns the
+    product ids.
+    '''
+    run = config['run']
+    users = [_seed_user(run, i) for i in range(config['users'])]
+    register_many([(name, email, PASSWORD) for name, email in users])
+    User.query.filter(User.email.in_([email for _, email in users])) \
+        .update({User.balance: SEED_BALANCE}, synchronize_session=False)
+    db.session.commit()
+
+    product_ids = []
+    for i in range(config['products']):
+        title = _seed_title(run, i)
+        # sellers are the first half of the users, buyers the second
+        owner = users[i % max(1, len(users) // 2)][1]
+        create_product(title, DESCRIPTION, 11, '2024-01-01', owner)
+        product_ids.append(get_product(title=title).id)
+    db.session.remove()
+    return product_ids
+
+
+def _operation(op, config, rng, tag):
+    '''
+    The model function and arguments of one operation.
+    '''
+    run = config['run']
+    users = config['users']
+    if op == 'register':
+        return register, ('b%s %s' % (run, tag[-12:]),
+                          'bench-%s-%s@bench.com' % (run, tag), PASSWORD)
+    if op == 'login':
+        return login, (_seed_user(run, rng.randrange(users))[1], PASSWORD)
+    if op == 'user_update':
+        name = _seed_user(run, rng.randrange(users))[0]
+        return user_update, (name,), {
+            'new_username': name, 'new_shipping_address': '1 Bench Street',
+            'new_postal_code': 'K7L 3N6'}
+    if op == 'create_product':
+        return create_product, ('bench %s new %s' % (run, tag), DESCRIPTION,
+                                11, '2024-01-01', _seed_user(run, 0)[1])
+    i = rng.randrange(config['products'])
+    if op == 'update_product':
+        return update_product, (config['product_ids'][i],), {
+            'newTitle': _seed_title(run, i), 'newDesc': DESCRIPTION,
+            'newPrice': 11}
+    # buyers are the second half of the users
+    buyer = _seed_user(run, users // 2 + rng.randrange(users - users // 2))
+    return purchase_product, (_seed_title(run, i), buyer[1])
+
+
+def _run_thread(config, worker, samples):
+    rng = random.Random('%s-%s' % (config['seed'], worker))
+    ops = list(config['mix'])
+    weights = [config['mix'][op] for op in ops]
+    mine = {op: [] for op in ops}
+    try:
+        for n in range(config['ops']):
+            op = rng.choices(ops, weights)[0]
+            func, args, *kwargs = _operation(op, config, rng,
+                                             '%sn%d' % (worker, n))
+            start = time.perf_counter()
+            try:
+                result = func(*args, **(kwargs[0] if kwargs else {}))
+                ok = result is not None and result is not False \
+                    and not isinstance(result, (str, Exception))
+            except exc.SQLAlchemyError:
+                db.session.rollback()
+                ok = False
+            mine[op].append(((time.perf_counter() - start) * 1000, ok))
+    finally:
+        db.session.remove()
+    samples.append(mine)
+
+
+def run_process(config, process_no):
+    '''
+    One worker process: config['threads'] threads running operations.
+    Returns (start time, end time, [{op: [(latency ms, ok)]}]).
+    '''
+    samples = []
+    threads = [threading.Thread(target=_run_thread,
+                                args=(config, 'p%dt%d' % (process_no, t),
+                                      samples))
+               for t in range(config['threads'])]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return start, time.time(), samples
+
+
+def report(config, runs):
+    '''
+    Combine the samples of all workers into the JSON report.
+    '''
+    elapsed = max(end for _, end, _ in runs) - min(s for s, _, _ in runs)
+    merged = {}
+    for _, _, samples in runs:
+        for thread in samples:
+            for op, values in thread.items():
+                merged.setdefault(op, []).extend(values)
+
+    operations = {}
+    for op, values in sorted(merged.items()):
+        if not values:
+            continue
+        latencies = sorted(latency for latency, _ in values)
+        operations[op] = {
+            'count': len(values),
+            'ok': sum(ok for _, ok in values),
+            'ops_per_s': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+        }
+    total = sum(op['count'] for op in operations.values())
+    return {
+        'config': {key: config[key] for key in
+                   ('mix', 'ops', 'threads', 'processes', 'users',
+                    'products', 'seed', 'database')},
+        'elapsed_s': round(elapsed, 3),
+        'total': {'count': total, 'ops_per_s': round(total / elapsed, 2)},
+        'operations': operations,
+    }
+
+
+def _spawn_worker(args):
+    return run_process(*args)
+
+
+def run(config):
+    '''
+    Seed the database, run the workers and return the report. Worker
+    processes use the database named by the db_string environment variable,
+    which must match the one this process uses.
+    '''
+    config['product_ids'] = seed(config)
+    if config['processes'] == 1:
+        runs = [run_process(config, 0)]
+    else:
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(config['processes']) as pool:
+            runs = pool.map(_spawn_worker, [(config, p) for p in
+                                            range(config['processes'])])
+    return report(config, runs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m qbay.bench')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='op=weight,... (default: %s)' % ','.join(
+                            '%s=%d' % item for item in DEFAULT_MIX.items()))
+    parser.add_argument('--ops', type=int, default=200,
+                        help='operations per thread (default: 200)')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='database URI (default: db_string, '
+                        'else a scratch SQLite file)')
+    parser.add_argument('--output', default='-',
+                        help='file to write the JSON report to')
+    args = parser.parse_args(argv)
+    if args.users < 2 or args.products < 1:
+        parser.error('need at least 2 users and 1 product')
+
+    scratch = None
+    database = args.db or os.getenv('db_string')
+    if database is None:
+        scratch = tempfile.TemporaryDirectory()
+        database = 'sqlite:///%s/bench.sqlite' % scratch.name
+    if database != app.config['SQLALCHEMY_DATABASE_URI']:
+        # qbay was configured when this module was imported: run again in
+        # a fresh interpreter with db_string set, as the workers are
+        env = dict(os.environ, db_string=database)
+        argv = sys.argv[1:] if argv is None else argv
+        try:
+            return subprocess.run([sys.executable, '-m', 'qbay.bench']
+                                  + list(argv), env=env).returncode
+        finally:
+            if scratch is not None:
+                scratch.cleanup()
+
+    # the report names the database without its credentials
+    config = dict(vars(args), database=database.split('@')[-1],
+                  run=uuid.uuid4().hex[:6])
+    del config['db'], config['output']
+    result = json.dumps(run(config), indent=2)
+    if args.output == '-':
+        print(result)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(result + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,349 @@
+'''
+Bloom filters in front of the User.email and Product.title uniqueness
+lookups.
+
+Most registrations are for new emails and most new products have new
+titles, yet each one used to pay a query to find that out. With
+QBAY_BLOOM_FILTERS=on the model functions ask email_filter or
+title_filter first: "no" is certain and skips the query, "maybe" falls
+back to the database. Values are added as they are inserted, so a filter
+never forgets a value this process wrote; rows written by other
+processes are caught by the unique constraints as before.
+
+A filter is built on first use by scanning its column in chunks, or
+loaded from QBAY_BLOOM_SNAPSHOT_DIR when a snapshot is there
+(python -m qbay bloom snapshot) and brought up to date from the database.
+stats() reports the memory used, the false-positive rate expected from
+the fill of the bit array, and the rate actually seen.
+'''
+import hashlib
+import json
+import math
+import os
+import threading
+
+from sqlalchemy import func, select
+
+from qbay import app
+
+
+class BloomFilter:
+    """
+    A set that can say "certainly not in" or "probably in".
+    .........
+    Atributes
+    ---------
+    capacity : Integer
+        Values it was sized for
+    error_rate : Float
+        False-positive rate at capacity
+    size : Integer
+        Bits in the array
+    hashes : Integer
+        Bits set per value
+    items : Integer
+        Values added
+    """
+
+    def __init__(self, capacity, error_rate, size=None, hashes=None,
+                 items=0, bits=None):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = size or max(8, math.ceil(
+            -self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(
+            self.size / self.capacity * math.log(2)))
+        self.items = items
+        self.bits = bits if bits is not None \
+            else bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # double hashing: two 64 bit halves of one digest give every probe
+        digest = hashlib.blake2b(value.encode('utf-8'),
+                                 digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for p in self._positions(value):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.items += 1
+
+    def __contains__(self, value):
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7))
+                   for p in self._positions(value))
+
+    def fill_ratio(self):
+        return int.from_bytes(self.bits, 'little').bit_count() / self.size
+
+    def save(self, f, **extra):
+        '''
+        Write the filter to a binary file: one JSON header line, then the
+        bit array.
+        '''
+        header = dict(extra, capacity=self.capacity,
+                      error_rate=self.error_rate, size=self.size,
+                      hashes=self.hashes, items=self.items)
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        f.write(self.bits)
+
+    @classmethod
+    def load(cls, f):
+        '''
+        Read a filter written by save. Returns (filter, header).
+        '''
+        header = json.loads(f.readline())
+        bits = bytearray(f.read())
+        if len(bits) != (header['size'] + 7) // 8:
+            raise ValueError('truncated bloom filter snapshot')
+        return cls(header['capacity'], header['error_rate'], header['size'],
+                   header['hashes'], header['items'], bits), header
+
+
+class ExistenceFilter:
+    """
+    A BloomFilter of the values of one unique column, kept in step with
+    the inserts made through the model functions.
+    .........
+    Atributes
+    ---------
+    name : String
+        Name of the filter and of its snapshot file
+    model : String
+        Name of the model in qbay.models
+    column : String
+        The unique column
+    id_column : String
+        An increasing id column for catching up from a snapshot, or None to
+        rebuild whenever the row count changed since the snapshot
+    """
+
+    def __init__(self, name, model, column, id_column=None):
+        self.name = name
+        self.model = model
+        self.column = column
+        self.id_column = id_column
+        self._lock = threading.RLock()
+        self._bloom = None
+        self._last_id = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            # lookups skipped, lookups made, lookups that found nothing
+            self.negatives = self.positives = self.false_positives = 0
+
+    def enabled(self):
+        return app.config['QBAY_BLOOM_FILTERS'] == 'on'
+
+    def _table(self):
+        # imported here because qbay.models imports this module
+        from qbay import models
+        return getattr(models, self.model).__table__
+
+    def _snapshot_path(self):
+        directory = app.config['QBAY_BLOOM_SNAPSHOT_DIR']
+        return directory and os.path.join(directory, self.name + '.bloom')
+
+    def _rows(self, query):
+        # imported here because qbay.models imports this module
+        from qbay.models import db
+        return db.session.execute(query).fetchall()
+
+    def _count(self, table):
+        return self._rows(select(func.count()).select_from(table))[0][0]
+
+    def _load_snapshot(self, table, rows, chunk_size):
+        '''
+        Use the snapshot file if there is one that still describes the
+        column. Returns whether it was used.
+        '''
+        path = self._snapshot_path()
+        if not path or not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            bloom, header = BloomFilter.load(f)
+        if header.get('column') != self.column or bloom.capacity < rows:
+            return False
+        if self.id_column is not None:
+            # only the rows inserted since the snapshot are missing
+            self._bloom = bloom
+            self._last_id = header['last_id']
+            self._scan(table, chunk_size)
+            return True
+        # users are never deleted, so the same count means the same rows
+        if header['rows'] != rows:
+            return False
+        self._bloom = bloom
+        return True
+
+    def build(self, chunk_size=10000, use_snapshot=True):
+        '''
+        Fill the filter from the snapshot and the database, or from the
+        database alone, sized for twice the current rows.
+        '''
+        with self._lock:
+            table = self._table()
+            rows = self._count(table)
+            if use_snapshot and self._load_snapshot(table, rows, chunk_size):
+                return
+
+            self._bloom = BloomFilter(
+                max(2 * rows, app.config['QBAY_BLOOM_CAPACITY']),
+                app.config['QBAY_BLOOM_ERROR_RATE'])
+            self._last_id = 0
+            if self.id_column is not None:
+                self._scan(table, chunk_size)
+                return
+            # no id to order by: seek through the unique column itself
+            column = table.c[self.column]
+            last = None
+            while True:
+                query = select(column).order_by(column).limit(chunk_size)
+                if last is not None:
+                    query = query.where(column > last)
+                values = [value for value, in self._rows(query)]
+                for value in values:
+                    self._bloom.add(value)
+                if len(values) < chunk_size:
+                    return
+                last = values[-1]
+
+    def _scan(self, table, chunk_size):
+        '''
+        Add the rows with an id above _last_id.
+        '''
+        id_column = table.c[self.id_column]
+        while True:
+            rows = self._rows(select(
+                id_column, table.c[self.column])
+                .where(id_column > self._last_id)
+                .order_by(id_column).limit(chunk_size))
+            for _, value in rows:
+                self._bloom.add(value)
+            if rows:
+                self._last_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                return
+
+    def snapshot(self, path=None):
+        '''
+        Rebuild the filter from the database and save it to path, by default
+        <QBAY_BLOOM_SNAPSHOT_DIR>/<name>.bloom.
+        '''
+        path = path or self._snapshot_path()
+        if not path:
+            raise ValueError('no snapshot path: set QBAY_BLOOM_SNAPSHOT_DIR')
+        with self._lock:
+            self.build(use_snapshot=False)
+            tmp = path + '.tmp'
+            # write then rename, so readers never see half a snapshot
+            with open(tmp, 'wb') as f:
+                self._bloom.save(f, name=self.name, model=self.model,
+                                 column=self.column, last_id=self._last_id,
+                                 rows=self._count(self._table()))
+            os.replace(tmp, path)
+        return path
+
+    def _ready(self):
+        if self._bloom is None:
+            self.build()
+        return self._bloom
+
+    def add(self, value):
+        '''
+        Note a value that was just inserted. A filter that has grown past
+        its capacity is rebuilt, larger, on next use.
+        '''
+        with self._lock:
+            if self._bloom is None:
+                return
+            self._bloom.add(value)
+            if self._bloom.items > self._bloom.capacity:
+                self._bloom = None
+
+    def exists(self, value, lookup):
+        '''
+        Whether value is in the column
+          Parameters:
+            value (string):     the value
+            lookup (callable):  lookup(value) asks the database; called
+                                unless the filter rules value out
+        '''
+        if not self.enabled():
+            return lookup(value)
+        with self._lock:
+            if value not in self._ready():
+                self.negatives += 1
+                return False
+        found = lookup(value)
+        with self._lock:
+            self.positives += 1
+            self.false_positives += not found
+        return found
+
+    def existing(self, values, lookup):
+        '''
+        The subset of values in the column
+          Parameters:
+            values (set):       the values
+            lookup (callable):  lookup(values) returns the subset of values
+                                in the database; called only with those the
+                                filter cannot rule out, and not at all when
+                                it rules out every value
+        '''
+        if not self.enabled():
+            return lookup(values) if values else set()
+        with self._lock:
+            bloom = self._ready()
+            maybe = {value for value in values if value in bloom}
+            self.negatives += len(values) - len(maybe)
+        if not maybe:
+            return set()
+        found = lookup(maybe)
+        with self._lock:
+            self.positives += len(maybe)
+            self.false_positives += len(maybe) - len(found)
+        return found
+
+    def stats(self):
+        '''
+        A dict of the filter's size and hit counts: items, capacity,
+        memory_bytes, hashes, fill_ratio, expected_fp_rate (from the fill
+        of the bit array), lookups_skipped, lookups, false_positives and
+        observed_fp_rate (false positives among the values that were not
+        there). Sizes are None until the filter is built.
+        '''
+        with self._lock:
+            bloom = self._bloom
+            absent = self.negatives + self.false_positives
+            stats = {
+                'items': None, 'capacity': None, 'memory_bytes': None,
+                'hashes': None, 'fill_ratio': None, 'expected_fp_rate': None,
+                'lookups_skipped': self.negatives,
+                'lookups': self.positives,
+                'false_positives': self.false_positives,
+                'observed_fp_rate':
+                    self.false_positives / absent if absent else 0.0,
+            }
+            if bloom is not None:
+                fill = bloom.fill_ratio()
+                stats.update(items=bloom.items, capacity=bloom.capacity,
+                             memory_bytes=len(bloom.bits),
+                             hashes=bloom.hashes, fill_ratio=fill,
+                             expected_fp_rate=fill ** bloom.hashes)
+            return stats
+
+
+email_filter = ExistenceFilter('email', 'User', 'email')
+title_filter = ExistenceFilter('title', 'Product', 'title', id_column='id')
+FILTERS = (email_filter, title_filter)
+
+
+def filter_stats():
+    '''
+    stats() of every filter, by name.
+    '''
+    return {f.name: f.stats() for f in FILTERS}
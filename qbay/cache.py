@@ -0,0 +1,81 @@
+'''
+A small thread-safe LRU cache with an optional time-to-live, used to keep
+hot rows in process.
+'''
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A bounded mapping that evicts the least recently used entry when full.
+    .........
+    Attributes
+    ---------
+    maxsize : Integer
+        The most entries kept; 0 disables the cache
+    ttl : Float
+        Seconds an entry stays valid after it is stored, None for no expiry
+    hits : Integer
+        Number of get calls that found a live entry
+    misses : Integer
+        Number of get calls that found nothing or an expired entry
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = None if self.ttl is None else self._clock() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        '''
+        Remove an entry without counting a hit or a miss. Returns its value,
+        even if expired, or default.
+        '''
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        '''
+        Returns a dict of the hit and miss counters and the current size.
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._data), 'maxsize': self.maxsize,
+                    'ttl': self.ttl}
+
+    def __len__(self):
+        return len(self._data)
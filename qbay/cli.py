@@ -1,5 +1,61 @@
-from qbay.models import login, Product, register, create_product, \
-    update_product, User, user_update
+from qbay.models import login, register, create_product, \
+    update_product, User, user_update_by_email, get_product, \
+    purchase_product, browse_products
+
+
+class UserSession:
+    """
+    The user logged in to the CLI, resolved once so the pages don't have
+    to look the user up again.
+    .........
+    Atributes
+    ---------
+    email : String
+        The user's email, which identifies them
+    username : String
+        The user's current display name
+    balance : Integer
+        The user's balance when the session was last refreshed
+    shipping_addr : String
+        The user's shipping address
+    postal_code : String
+        The user's postal code
+    """
+
+    def __init__(self, user):
+        self._load(user)
+
+    def _load(self, user):
+        self.email = user.email
+        self.username = user.username
+        self.balance = user.balance
+        self.shipping_addr = user.shipping_addr
+        self.postal_code = user.postal_code
+
+    def refresh(self):
+        '''
+        Reload the user after a write changed it (one primary key lookup).
+        '''
+        self._load(User.query.filter_by(email=self.email).first())
+
+
+def _ask_for_user(prompt, retry_prompt, allow_exit=False):
+    '''
+    Ask for a username until one exists, with one query per attempt.
+    Returns a UserSession for that user.
+    '''
+    current_name = input(prompt)
+    current_user = User.query.filter_by(username=current_name).first()
+
+    # loop until valid username is inputted
+    while current_user is None:
+        print("User does not exist.")
+        current_name = input(retry_prompt)
+        current_user = User.query.filter_by(username=current_name).first()
+        if allow_exit and current_name == "exit":
+            exit()
+
+    return UserSession(current_user)
 
 
 def login_page():
@@ -29,44 +85,25 @@ def register_page():
         print('Failed - input does not meet one of the requirements.')
 
 
-def update_user_page():
+def update_user_page(session=None):
     '''
-    update_user_page takes 0 parameters.
+    update_user_page takes the logged in UserSession, if any.
     This provides functionality for the CLI
     to provide the ability to update a user's
-    information.
+    information. Without a session it asks for the username.
     '''
     # Test case:
     # register('u0 r3 1', 'testr3-1@test.com', '123aBc!')
 
-    current_name = input(
-        """Please enter the username of the user you want to update: """)
-
-    # set current_user to the user with username = current_name
-    current_user = User.query.filter_by(username=current_name).first()
-
-    # set not_existing to a boolean whether User exists or not
-    not_existing = User.query.filter_by(username=current_name).first() is None
-
-    # loop until valid username is inputted
-    while (not_existing):
-        print("User does not exist.")
-        current_name = input(
-            """Please enter the username of the user you want to update: """)
-        current_user = User.query.filter_by(username=current_name).first()
-        not_existing = User.query.filter_by(username=current_name)\
-            .first() is None
+    if session is None:
+        prompt = "Please enter the username of the user you want to update: "
+        session = _ask_for_user(prompt, prompt)
+    current_name = session.username
 
     # to avoid any errors with our user_update function,
-    # set placeholders if they're empty.
-    if not(current_user.shipping_addr):
-        current_user.shipping_addr = "104 Park St"
-
-    if not(current_user.postal_code):
-        current_user.postal_code = "K7K 1M9"
-
-    current_shipp_addr = current_user.shipping_addr
-    current_postal_code = current_user.postal_code
+    # use placeholders if they're empty.
+    current_shipp_addr = session.shipping_addr or "104 Park St"
+    current_postal_code = session.postal_code or "K7K 1M9"
 
     print("""
     1. Update username
@@ -80,15 +117,16 @@ def update_user_page():
     """)
 
     flag = int(input("What option would you like to choose: "))
+    result = None
 
     if flag == 1:
         # Update username option
         updated_username = input("Please enter your new username: ")
 
-        # Print user_update function incase of any failures.
-        print(user_update(current_name, new_username=updated_username,
-                          new_shipping_address=current_shipp_addr,
-                          new_postal_code=current_postal_code))
+        result = user_update_by_email(
+            session.email, new_username=updated_username,
+            new_shipping_address=current_shipp_addr,
+            new_postal_code=current_postal_code)
 
     elif flag == 2:
         # Update shipping address
@@ -96,17 +134,19 @@ def update_user_page():
         Please enter your new shipping address:
         """)
 
-        print(user_update(current_name, new_username=current_name,
-                          new_shipping_address=updated_shipping_addr,
-                          new_postal_code=current_postal_code))
+        result = user_update_by_email(
+            session.email, new_username=current_name,
+            new_shipping_address=updated_shipping_addr,
+            new_postal_code=current_postal_code)
 
     elif flag == 3:
         # Update postal code
         updated_postal_code = input("Please enter your new postal code: ")
 
-        print(user_update(current_name, new_username=current_name,
-                          new_shipping_address=current_shipp_addr,
-                          new_postal_code=updated_postal_code))
+        result = user_update_by_email(
+            session.email, new_username=current_name,
+            new_shipping_address=current_shipp_addr,
+            new_postal_code=updated_postal_code)
 
     elif flag == 4:
         # Update username & shipping address
@@ -115,18 +155,20 @@ def update_user_page():
         Please enter your new shipping address:
         """)
 
-        print(user_update(current_name, new_username=updated_username,
-                          new_shipping_address=updated_shipping_addr,
-                          new_postal_code=current_postal_code))
+        result = user_update_by_email(
+            session.email, new_username=updated_username,
+            new_shipping_address=updated_shipping_addr,
+            new_postal_code=current_postal_code)
 
     elif flag == 5:
         # Update username & postal code
         updated_username = input("Please enter your new username: ")
         updated_postal_code = input("Please enter your new postal code: ")
 
-        print(user_update(current_name, new_username=updated_username,
-                          new_shipping_address=current_shipp_addr,
-                          new_postal_code=updated_postal_code))
+        result = user_update_by_email(
+            session.email, new_username=updated_username,
+            new_shipping_address=current_shipp_addr,
+            new_postal_code=updated_postal_code)
 
     elif flag == 6:
         # Update shipping & postal
@@ -135,9 +177,10 @@ def update_user_page():
         """)
         updated_postal_code = input("Please enter your new postal code: ")
 
-        print(user_update(current_name, new_username=current_name,
-                          new_shipping_address=updated_shipping_addr,
-                          new_postal_code=updated_postal_code))
+        result = user_update_by_email(
+            session.email, new_username=current_name,
+            new_shipping_address=updated_shipping_addr,
+            new_postal_code=updated_postal_code)
 
     elif flag == 7:
         # Update username & shipping address & postal code
@@ -147,26 +190,37 @@ def update_user_page():
         """)
         updated_postal_code = input("Please enter your new postal code: ")
 
-        print(user_update(current_name, new_username=updated_username,
-                          new_shipping_address=updated_shipping_addr,
-                          new_postal_code=updated_postal_code))
+        result = user_update_by_email(
+            session.email, new_username=updated_username,
+            new_shipping_address=updated_shipping_addr,
+            new_postal_code=updated_postal_code)
 
     elif flag == 8:
         exit()
 
+    # Print user_update result incase of any failures.
+    if result is not None:
+        print(result)
+    if result is True:
+        session.refresh()
+
 
-def create_product_page():
+def create_product_page(session=None):
     '''
     This function provides the CLI interface
     to create a product in the database.
     The user has the ability to insert a title,
-    description, and price
+    description, and price. The logged in user owns the product; without
+    a session the owner's email is asked for.
     '''
     title = input('Please input title: ')
     desc = input('Please input description: ')
     price = int(input('Please enter price: '))
     date = input('Please input date: ')
-    email = input('Please input email: ')
+    if session is None:
+        email = input('Please input email: ')
+    else:
+        email = session.email
 
     if create_product(title, desc, price, date, email):
         print('Product succesfully created')
@@ -185,7 +239,7 @@ def update_product_page():
     id = int(input('Please input the id of the product you want to update: '))
 
     # store the current product in variable
-    currentProduct = Product.query.filter_by(id=id).first()
+    currentProduct = get_product(product_id=id)
 
     # current product information
     currentPrice = currentProduct.price
@@ -259,38 +313,25 @@ def update_product_page():
             exit()
 
 
-def place_order_page():
+def place_order_page(session=None):
     '''
     This function provides the CLI interface
     to order a product.
     The user has the option to order any order given the id.
+    Orders are placed for the logged in user; without a session the
+    username is asked for.
     '''
 
-    current_name = input(
-        """Enter your username to purchase a product: """)
-
-    # set current_user to the user with username = current_name
-    current_user = User.query.filter_by(username=current_name).first()
-    user_email = current_user.email
-
-    # set not_existing to a boolean whether User exists or not
-    not_existing = User.query.filter_by(username=current_name).first() is None
-
-    # loop until valid username is inputted
-    while (not_existing):
-        print("User does not exist.")
-        current_name = input(
-            """Enter your username to purchase a product or exit to leave: """)
-        current_user = User.query.filter_by(username=current_name).first()
-        not_existing = User.query.filter_by(username=current_name)\
-            .first() is None
-        if current_name == "exit":
-            exit()
+    if session is None:
+        session = _ask_for_user(
+            """Enter your username to purchase a product: """,
+            """Enter your username to purchase a product or exit to leave: """,
+            allow_exit=True)
 
     title = input(
         'Please input the title of the product you want to purchase: ')
-    currentProduct = Product.query.filter_by(title=title).first()
-    not_existing = Product.query.filter_by(title=title).first() is None
+    currentProduct = get_product(title=title)
+    not_existing = currentProduct is None
 
     if (not_existing):  # checks if product with title=title exists
         print('Product does not exist')
@@ -300,7 +341,6 @@ def place_order_page():
     currentPrice = currentProduct.price
     currentTitle = currentProduct.title
     currentDesc = currentProduct.desc
-    user_email = current_user.email
 
     flag = True
     while flag:
@@ -313,14 +353,55 @@ def place_order_page():
 
         flag = input("What would you like to do: ")
 
-        if flag == 1:
-            # purchaseProduct(user_email, currentTitle)
-            print("Product purchased.")
+        if flag == "1":
+            result = purchase_product(currentTitle, session.email)
+            if result is True:
+                session.refresh()
+                print("Product purchased.")
+                print('Your balance is now: ', session.balance)
+            else:
+                print(result or 'Purchase failed')
 
-        elif flag == 2:
+        elif flag == "2":
             print('The title of the product is: ', currentTitle)
             print('The price of the product is: ', currentPrice)
             print('The description of the product is: ', currentDesc)
 
-        elif flag == 3:
+        elif flag == "3":
             exit()
+
+
+def search_page():
+    '''
+    This function provides the CLI interface
+    to search products by words in their title or description.
+    '''
+    from qbay.search import search_products
+
+    query = input('Please input search words: ')
+    hits = search_products(query)
+    if not hits:
+        print('No products found')
+    for hit in hits:
+        print('%d: %s' % (hit.id, hit.title))
+
+
+def browse_page():
+    '''
+    This function provides the CLI interface
+    to list products one page at a time, optionally filtered by price
+    range and seller. Pages are only loaded when asked for.
+    '''
+    min_price = input('Minimum price (blank for any): ').strip()
+    max_price = input('Maximum price (blank for any): ').strip()
+    owner = input('Seller email (blank for any): ').strip()
+
+    pages = browse_products(min_price=float(min_price) if min_price else None,
+                            max_price=float(max_price) if max_price else None,
+                            owner_email=owner or None)
+    for page in pages:
+        for product in page:
+            print('%d: %s (%s)' % (product.id, product.title, product.price))
+        if input('Enter n for the next page: ').strip() != 'n':
+            return
+    print('No more products')
@@ -0,0 +1,213 @@
+'''
+Streaming export of the Transactions table to CSV or JSONL.
+
+Rows are read in id order, chunk_size at a time, with plain (non-ORM)
+queries that each seek past the last exported id. Memory use is bounded
+by one chunk however large the table is, and an interrupted export can
+resume from its checkpoint file. The checkpoint records the last id
+written and the size of the output at that point; resuming cuts off
+anything written after it, and a gzipped output ends a gzip member at
+every checkpoint, so the file stays readable and holds no row twice.
+'''
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import select
+
+from qbay.models import db, Transactions
+
+COLUMNS = ['id', 'price', 'buyer', 'seller', 'product_id', 'status',
+           'timestamp']
+BUFFER_SIZE = 1 << 20
+
+
+def parse_time(value):
+    '''
+    'YYYY-MM-DD' or an ISO 8601 date and time, None stays None.
+    '''
+    return None if value is None else datetime.fromisoformat(value)
+
+
+def iter_transactions(since=None, until=None, after_id=0, chunk_size=1000):
+    '''
+    Yield lists of up to chunk_size Transactions rows (as tuples in COLUMNS
+    order), with since <= timestamp < until, in id order after after_id.
+    '''
+    table = Transactions.__table__
+    query = select(*[table.c[name] for name in COLUMNS]) \
+        .order_by(table.c.id).limit(chunk_size)
+    if since is not None:
+        query = query.where(table.c.timestamp >= since)
+    if until is not None:
+        query = query.where(table.c.timestamp < until)
+
+    last_id = after_id
+    while True:
+        rows = db.session.execute(
+            query.where(table.c.id > last_id)).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def _format_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def read_checkpoint(path):
+    '''
+    The last exported id and the size of the output at that point, stored
+    in a checkpoint file; (0, 0) if there is none. The size is None for a
+    checkpoint that only recorded the id.
+    '''
+    try:
+        with open(path) as f:
+            fields = f.read().split()
+    except FileNotFoundError:
+        return 0, 0
+    if not fields:
+        return 0, 0
+    return int(fields[0]), int(fields[1]) if len(fields) > 1 else None
+
+
+def _write_checkpoint(path, last_id, offset):
+    # write then rename, so a crash never leaves a half written checkpoint
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('%d %d' % (last_id, offset))
+    os.replace(tmp, path)
+
+
+class _Output:
+    """
+    The file an export writes text to, optionally gzipped.
+    .........
+    Atributes
+    ---------
+    raw : file
+        The binary file underneath
+    compress : Boolean
+        Whether the text is gzipped
+    """
+
+    def __init__(self, raw, compress):
+        self.raw = raw
+        self.compress = compress
+        self._member = None
+        self._text = None
+
+    def text(self):
+        '''
+        The text stream to write to, starting a new gzip member if needed.
+        '''
+        if self._text is None:
+            target = self.raw
+            if self.compress:
+                self._member = target = gzip.GzipFile(fileobj=self.raw,
+                                                      mode='wb')
+            self._text = io.TextIOWrapper(target, encoding='utf-8',
+                                          newline='')
+        return self._text
+
+    def end(self):
+        '''
+        Push everything written to the file, closing the gzip member so the
+        file is complete up to here. Returns nothing; raw.tell() is then
+        the offset a resumed export truncates to.
+        '''
+        if self._text is not None:
+            self._text.flush()
+            self._text.detach()
+            self._text = None
+        if self._member is not None:
+            # a gzip file may hold several members, read back as one stream
+            self._member.close()
+            self._member = None
+        self.raw.flush()
+
+
+def export_transactions(output='-', fmt='csv', since=None, until=None,
+                        compress=False, resume=False, after_id=0,
+                        chunk_size=1000):
+    '''
+    Export transactions to a file
+      Parameters:
+        output (string):   path to write, or - for stdout
+        fmt (string):      'csv' or 'jsonl'
+        since (datetime):  only transactions at or after this time
+        until (datetime):  only transactions before this time
+        compress (bool):   gzip the output
+        resume (bool):     continue after the id in <output>.checkpoint,
+                           first cutting output back to its size when
+                           that checkpoint was written
+        after_id (int):    only transactions with a larger id
+        chunk_size (int):  rows per query
+      Returns:
+        A dict with the number of rows written and the last id exported
+    '''
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError('fmt must be csv or jsonl')
+    checkpoint = None if output == '-' else output + '.checkpoint'
+    offset = None
+    if resume:
+        if checkpoint is None:
+            raise ValueError('resume needs an output file')
+        checkpoint_id, checkpoint_offset = read_checkpoint(checkpoint)
+        # the output size only describes the file when resuming from that
+        # checkpoint; after an --after-id past it (or with no checkpoint)
+        # the output is appended to as it is
+        if checkpoint_id and checkpoint_id >= after_id:
+            after_id = checkpoint_id
+            offset = checkpoint_offset
+    appending = resume and after_id > 0
+
+    if output == '-':
+        # text already printed must come out before this
+        sys.stdout.flush()
+        raw = sys.stdout.buffer
+    elif appending:
+        raw = open(output, 'r+b', buffering=BUFFER_SIZE)
+        # drop whatever a crashed run wrote after its last checkpoint; a
+        # checkpoint without the size (older exports), or none, appends at
+        # the end
+        if offset is None:
+            raw.seek(0, os.SEEK_END)
+        else:
+            raw.truncate(offset)
+            raw.seek(offset)
+    else:
+        raw = open(output, 'wb', buffering=BUFFER_SIZE)
+    out = _Output(raw, compress)
+
+    rows_written = 0
+    last_id = after_id
+    try:
+        if fmt == 'csv' and not appending:
+            csv.writer(out.text()).writerow(COLUMNS)
+        for rows in iter_transactions(since, until, after_id, chunk_size):
+            text = out.text()
+            writer = csv.writer(text) if fmt == 'csv' else None
+            for row in rows:
+                values = [_format_value(v) for v in row]
+                if writer is not None:
+                    writer.writerow(values)
+                else:
+                    text.write(json.dumps(dict(zip(COLUMNS, values))) + '\n')
+            rows_written += len(rows)
+            last_id = rows[-1][0]
+            if checkpoint is not None:
+                out.end()
+                _write_checkpoint(checkpoint, last_id, raw.tell())
+    finally:
+        out.end()
+        if raw is not sys.stdout.buffer:
+            raw.close()
+    return {'rows': rows_written, 'last_id': last_id}
@@ -0,0 +1,238 @@
+'''
+Streaming bulk import of products from CSV or JSONL.
+
+    python -m qbay import products catalog.csv [--rejects rejects.jsonl]
+
+create_product looks the owner and the title up and commits once per
+product, three round trips a row. Here the file is read chunk_size rows at
+a time, and each chunk costs one IN query for the owners not seen before,
+one IN query for its titles (only those qbay.bloom's title filter cannot
+rule out, when it is on), one executemany INSERT and one commit.
+Owners found so far and the titles of the file are kept in memory, so a
+title repeated further down the file is caught without asking the
+database again.
+
+Rows are checked like create_product: R4-1 to R4-6 with validate_product,
+R4-7 against the owners and R4-8 against the database and the earlier
+rows of the file. Rows that fail are written to the rejects file as JSONL,
+{"line": ..., "reason": ..., "record": ...}, where reason is the id of the
+requirement that failed, 'duplicate' for a title used on an earlier line
+of the file, or 'malformed' for a line that is not a product record
+(in JSONL, also one whose values have the wrong types).
+
+CSV files need a header row with title, description, price and
+owner_email, and optionally date ('YYYY-MM-DD', today when empty). JSONL
+lines are objects with the same keys.
+'''
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import exc, select
+
+from qbay.bloom import title_filter
+from qbay.models import db, Product, ProductInfo, User
+from qbay.validation import parse_date, validate_product
+
+FIELDS = ('title', 'description', 'price', 'owner_email')
+
+
+def read_csv(lines):
+    '''
+    Yield (line number, record) for the rows of a CSV file; record is the
+    row as a string when it cannot be a product.
+    '''
+    reader = csv.DictReader(lines)
+    for row in reader:
+        if None in row or any(row.get(name) is None for name in FIELDS):
+            yield reader.line_num, ','.join(
+                str(value) for value in row.values() if value is not None)
+            continue
+        # CSV has no numbers: '20' is 20 and '20.5' is 20.5
+        price = row['price'].strip()
+        try:
+            row['price'] = float(price) if '.' in price else int(price)
+        except ValueError:
+            pass
+        yield reader.line_num, row
+
+
+def _well_typed(record):
+    '''
+    Whether a JSONL record's values have the types validate_product and the
+    owner lookup expect: strings, a number for price, and a string (or
+    nothing) for date.
+    '''
+    price = record['price']
+    return all(isinstance(record[name], str)
+               for name in ('title', 'description', 'owner_email')) \
+        and isinstance(price, (int, float)) and not isinstance(price, bool) \
+        and isinstance(record.get('date'), (str, type(None)))
+
+
+def read_jsonl(lines):
+    '''
+    Yield (line number, record) for the non-blank lines of a JSONL file;
+    record is the line itself when it is not a product object, or has a
+    value of the wrong type.
+    '''
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict) \
+                or any(name not in record for name in FIELDS) \
+                or not _well_typed(record):
+            record = line.rstrip('\n')
+        yield line_no, record
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+class _Importer:
+    """
+    State of one import.
+    .........
+    Atributes
+    ---------
+    owners : set
+        Emails known to belong to a user (R4-7)
+    strangers : set
+        Emails known not to
+    titles : set
+        Titles of the rows accepted so far (R4-8 within the file)
+    """
+
+    def __init__(self, rejects):
+        self.rejects = rejects
+        self.owners = set()
+        self.strangers = set()
+        self.titles = set()
+        self.stats = {'rows': 0, 'imported': 0, 'rejected': 0}
+
+    def reject(self, line_no, reason, record):
+        self.stats['rejected'] += 1
+        if self.rejects is not None:
+            self.rejects.write(json.dumps(
+                {'line': line_no, 'reason': reason, 'record': record},
+                default=str) + '\n')
+
+    def _prefetch_owners(self, emails):
+        unknown = emails - self.owners - self.strangers
+        if not unknown:
+            return
+        found = {email for email, in db.session.query(User.email)
+                 .filter(User.email.in_(unknown))}
+        self.owners |= found
+        self.strangers |= unknown - found
+
+    def import_chunk(self, chunk):
+        '''
+        Check and insert one chunk of (line number, record).
+        '''
+        self.stats['rows'] += len(chunk)
+        checked = []
+        for line_no, record in chunk:
+            if not isinstance(record, dict):
+                self.reject(line_no, 'malformed', record)
+                continue
+            date = record.get('date') or datetime.today()
+            reason = validate_product(record['title'], record['description'],
+                                      record['price'], date)
+            if reason is not None:
+                self.reject(line_no, reason, record)
+                continue
+            checked.append((line_no, record, parse_date(date)))
+
+        self._prefetch_owners({r['owner_email'] for _, r, _ in checked})
+        taken = title_filter.existing(
+            {r['title'] for _, r, _ in checked},
+            lambda maybe: {title for title, in db.session.query(Product.title)
+                           .filter(Product.title.in_(maybe))})
+
+        rows = []
+        accepted = []
+        for line_no, record, date in checked:
+            title = record['title']
+            # R4-7: the owner must exist
+            if record['owner_email'] not in self.owners:
+                self.reject(line_no, 'R4-7', record)
+            # R4-8: the title must not be in use, here or earlier in the file
+            elif title in taken:
+                self.reject(line_no, 'R4-8', record)
+            elif title in self.titles:
+                self.reject(line_no, 'duplicate', record)
+            else:
+                self.titles.add(title)
+                accepted.append((line_no, record))
+                rows.append({'title': title, 'desc': record['description'],
+                             'price': record['price'],
+                             'last_modified_date': date,
+                             'owner_email': record['owner_email']})
+        if not rows:
+            return
+
+        try:
+            # one executemany INSERT and one commit for the chunk
+            db.session.execute(Product.__table__.insert(), rows)
+            self._written([row['title'] for row in rows])
+            db.session.commit()
+            self.stats['imported'] += len(rows)
+        except exc.IntegrityError:
+            # another writer took one of the titles after our check, redo
+            # this chunk row by row so only the clashing rows fail
+            db.session.rollback()
+            for (line_no, record), row in zip(accepted, rows):
+                try:
+                    db.session.execute(Product.__table__.insert(), [row])
+                    self._written([row['title']])
+                    db.session.commit()
+                    self.stats['imported'] += 1
+                except exc.IntegrityError:
+                    db.session.rollback()
+                    self.reject(line_no, 'R4-8', record)
+
+    @staticmethod
+    def _written(titles):
+        '''
+        Hand the new products to product_listeners, which hear about them
+        when the chunk commits, as they do for create_product.
+        '''
+        table = Product.__table__
+        written = db.session.info.setdefault('qbay_products', {})
+        for row in db.session.execute(
+                select(*[table.c[name] for name in ProductInfo._fields])
+                .where(table.c.title.in_(titles))):
+            written[row.id] = ProductInfo(*row)
+            title_filter.add(row.title)
+
+
+def import_products(source, fmt='csv', rejects=None, chunk_size=1000):
+    '''
+    Import products from a file
+      Parameters:
+        source (iterable):  lines of the file
+        fmt (string):       'csv' or 'jsonl'
+        rejects (file):     where rejected rows are written as JSONL, or
+                            None
+        chunk_size (int):   rows per query and commit
+      Returns:
+        A dict with the number of rows read, imported and rejected
+    '''
+    if fmt not in READERS:
+        raise ValueError('fmt must be csv or jsonl')
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1')
+
+    importer = _Importer(rejects)
+    records = READERS[fmt](source)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return importer.stats
+        importer.import_chunk(chunk)
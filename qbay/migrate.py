@@ -0,0 +1,111 @@
+'''
+Bring the columns and indexes of an existing database in line with the
+models, without dropping or rebuilding any table.
+'''
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from qbay.models import db
+
+
+def missing_indexes(engine):
+    '''
+    Find the indexes declared on the models that the database lacks
+      Parameters:
+        engine: SQLAlchemy engine of the database to inspect
+      Returns:
+        A list of sqlalchemy Index objects
+    '''
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    missing = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue  # create_all will build the table with its indexes
+        present = {i['name'] for i in inspector.get_indexes(table.name)}
+        missing.extend(index for index in sorted(table.indexes,
+                                                 key=lambda i: i.name)
+                       if index.name not in present)
+    return missing
+
+
+def add_missing_columns(connection, out=None):
+    '''
+    Add the columns declared on the models that existing tables lack. Only
+    nullable columns without defaults can be added this way; init_db calls
+    this whenever SCHEMA_VERSION changes.
+      Parameters:
+        connection:      connection to run the ALTER TABLE statements on
+        out (callable):  where progress lines are written, if anywhere
+      Returns:
+        The added columns as 'table.column' strings
+    '''
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    preparer = connection.dialect.identifier_preparer
+    added = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            if not column.nullable or column.server_default is not None:
+                raise RuntimeError('cannot add %s.%s to an existing table'
+                                   % (table.name, column.name))
+            if out is not None:
+                out('adding column %s.%s' % (table.name, column.name))
+            connection.execute(text('ALTER TABLE %s ADD COLUMN %s' % (
+                preparer.format_table(table),
+                CreateColumn(column).compile(dialect=connection.dialect))))
+            added.append('%s.%s' % (table.name, column.name))
+    return added
+
+
+def _create_index(connection, index):
+    '''
+    Add one index. MySQL builds it in place without blocking reads or
+    writes, SQLite builds it in a single CREATE INDEX.
+    '''
+    if connection.dialect.name == 'mysql':
+        preparer = connection.dialect.identifier_preparer
+        columns = ', '.join(preparer.quote(c.name) for c in index.columns)
+        connection.execute(text(
+            'ALTER TABLE %s ADD %sINDEX %s (%s), ALGORITHM=INPLACE, LOCK=NONE'
+            % (preparer.format_table(index.table),
+               'UNIQUE ' if index.unique else '',
+               preparer.quote(index.name), columns)))
+    else:
+        index.create(bind=connection)
+
+
+def migrate_indexes(engine=None, dry_run=False, out=print):
+    '''
+    Add every index declared on the models that is missing from the
+    database. Running it again is a no-op.
+      Parameters:
+        engine:          engine to migrate, defaults to the app's engine
+        dry_run (bool):  only report what would be created
+        out (callable):  where progress lines are written
+      Returns:
+        The names of the indexes created (or that would be created)
+    '''
+    if engine is None:
+        engine = db.engine
+    if not dry_run:
+        # new indexes may be on columns older databases do not have yet
+        with engine.begin() as connection:
+            add_missing_columns(connection, out)
+    names = []
+    for index in missing_indexes(engine):
+        out('%s index %s on %s(%s)' % (
+            'would create' if dry_run else 'creating', index.name,
+            index.table.name, ', '.join(c.name for c in index.columns)))
+        if not dry_run:
+            with engine.begin() as connection:
+                _create_index(connection, index)
+        names.append(index.name)
+    if not names:
+        out('all indexes are present')
+    return names
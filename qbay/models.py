@@ -1,15 +1,32 @@
-from flask import Flask, sessions
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import Column, TIMESTAMP
-from email_validator import validate_email, EmailNotValidError
-import re
-from datetime import datetime
-from sqlalchemy import exc
+from collections import namedtuple
+from contextlib import contextmanager
+import hashlib
+import json
+from datetime import datetime, timedelta
+import threading
+from sqlalchemy import and_, bindparam, event, exc, or_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.sql.elements import Null
+from qbay import app
+from qbay.bloom import email_filter, title_filter
+from qbay.cache import LRUCache
+from qbay.profiling import profiled
+from qbay.sqlite import apply_profile
+from qbay.passwords import hash_password, hash_passwords, \
+    verify_password, needs_rehash, burn_verify
+from qbay.validation import validate_registration, validate_login, \
+    validate_user_update, validate_product, validate_review, parse_date
 
-app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite'
 db = SQLAlchemy(app)
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite') \
+        and app.config['QBAY_SQLITE_PROFILE'] != 'default':
+    apply_profile(db.engine, app.config['QBAY_SQLITE_PROFILE'])
+
+# Bump whenever a model change needs create_all to run on existing databases
+SCHEMA_VERSION = 6
 
 
 class User(db.Model):
@@ -31,7 +48,8 @@ class User(db.Model):
     """
     email = db.Column(db.String(120), unique=True,
                       primary_key=True, nullable=False)
-    username = db.Column(db.String(80), unique=False, nullable=False)
+    username = db.Column(db.String(80), unique=False, nullable=False,
+                         index=True)
     password = db.Column(db.String(80), unique=False, nullable=False)
     balance = db.Column(db.Integer, unique=False, nullable=False)
     shipping_addr = db.Column(db.String(120), unique=False, nullable=False)
@@ -57,12 +75,27 @@ class Reviews(db.Model):
         A string to represent the user who posted the review
     timestamp: TIMESTAMP
         Time that the review was posted
+    product_id: Integer
+        The id of the product reviewed
+    rating: Integer
+        The score given to the product, 1 to 5
     """
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(255), nullable=False)
     subject = db.Column(db.String(100), nullable=False)
     poster = db.Column(db.String(100), nullable=False)
     timestamp = db.Column(TIMESTAMP)
+    # nullable so the columns can be added to existing tables
+    product_id = db.Column(db.Integer)
+    rating = db.Column(db.Integer)
+
+    # newest first listings by product and by poster
+    __table_args__ = (
+        db.Index('ix_reviews_product_id_timestamp_id',
+                 'product_id', 'timestamp', 'id'),
+        db.Index('ix_reviews_poster_timestamp_id',
+                 'poster', 'timestamp', 'id'),
+    )
 
     def __repr__(self):
         return f"<Review {self.subject}>"
@@ -92,16 +125,44 @@ class Transactions(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     price = db.Column(db.Integer, unique=False, nullable=False)
-    buyer = db.Column(db.String(80), unique=False, nullable=False)
-    seller = db.Column(db.String(80), unique=False, nullable=False)
-    product_id = db.Column(db.Integer, unique=False, nullable=False)
+    buyer = db.Column(db.String(80), unique=False, nullable=False,
+                      index=True)
+    seller = db.Column(db.String(80), unique=False, nullable=False,
+                       index=True)
+    product_id = db.Column(db.Integer, unique=False, nullable=False,
+                           index=True)
     status = db.Column(db.String(50), unique=False, nullable=False)
     timestamp = db.Column(TIMESTAMP)
 
+    # the order status worker claims the oldest orders of a status
+    __table_args__ = (db.Index('ix_transactions_status_id', 'status', 'id'),)
+
     def __repr__(self):
         return f"<Transaction {self.ID}>"
 
 
+class OrderTransitions(db.Model):
+    """
+    When an order reached each status, written by the order status worker
+    (qbay.orders).
+    .........
+    Atributes
+    ---------
+    id : Integer
+        A unique integer for the database
+    transaction_id : Integer
+        The id of the order (Transactions row)
+    status : String
+        The status the order moved to
+    timestamp : TIMESTAMP
+        When it moved
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(50), nullable=False)
+    timestamp = db.Column(TIMESTAMP, nullable=False)
+
+
 class Product(db.Model):
     """
     A class to represent the products on the platform.
@@ -125,16 +186,531 @@ class Product(db.Model):
     desc = db.Column(db.String(2000), unique=False, nullable=False)
     title = db.Column(db.String(80), unique=True, nullable=False)
     price = db.Column(db.Float, unique=False, nullable=False)
-    owner_email = db.Column(db.String(80), unique=False, nullable=False)
+    owner_email = db.Column(db.String(80), unique=False, nullable=False,
+                            index=True)
     last_modified_date = db.Column(TIMESTAMP)
 
+    # keyset pagination by date in browse_products
+    __table_args__ = (db.Index('ix_product_last_modified_date_id',
+                               'last_modified_date', 'id'),)
+
     def __repr__(self):
         return f"<Product {self.id}>"
 
 
-db.create_all()  # Create all tables
+class SellerTotals(db.Model):
+    """
+    Running sales totals of one seller, kept current by purchase_product.
+    .........
+    Atributes
+    ---------
+    seller : String
+        The seller's email
+    units : Integer
+        Number of orders placed on the seller's products
+    revenue : Integer
+        Sum of the prices of those orders
+    """
+    seller = db.Column(db.String(80), primary_key=True)
+    units = db.Column(db.Integer, nullable=False)
+    revenue = db.Column(db.Integer, nullable=False)
+
+
+class ProductTotals(db.Model):
+    """
+    Running sales totals of one product, kept current by purchase_product.
+    .........
+    Atributes
+    ---------
+    product_id : Integer
+        The product's id
+    units : Integer
+        Number of orders placed on the product
+    revenue : Integer
+        Sum of the prices of those orders
+    """
+    product_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, nullable=False)
+    revenue = db.Column(db.Integer, nullable=False)
+
+
+class DailySales(db.Model):
+    """
+    Running sales totals of one calendar day, kept current by
+    purchase_product.
+    .........
+    Atributes
+    ---------
+    day : Date
+        The day the orders were placed
+    units : Integer
+        Number of orders placed that day
+    revenue : Integer
+        Sum of the prices of those orders
+    """
+    day = db.Column(db.Date, primary_key=True)
+    units = db.Column(db.Integer, nullable=False)
+    revenue = db.Column(db.Integer, nullable=False)
+
+
+class ProductRatings(db.Model):
+    """
+    Review count and rating sum of one product, kept current by
+    create_review so the average never needs the reviews themselves.
+    .........
+    Atributes
+    ---------
+    product_id : Integer
+        The product's id
+    count : Integer
+        Number of reviews of the product
+    total : Integer
+        Sum of their ratings
+    """
+    product_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Integer, nullable=False)
+
+
+class IdempotencyKeys(db.Model):
+    """
+    Results of operations made with an idempotency key, so a retried call
+    returns the first call's result instead of repeating it.
+    .........
+    Atributes
+    ---------
+    operation : String
+        The model function, e.g. 'purchase_product'
+    key : String
+        The key chosen by the client
+    result : String
+        JSON of what the first call returned
+    request : String
+        SHA-256 of the first call's arguments; a call with the same key
+        and other arguments is refused
+    expires : TIMESTAMP
+        When the key may be forgotten
+    """
+    operation = db.Column(db.String(30), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    result = db.Column(db.String(255), nullable=False)
+    request = db.Column(db.String(64))
+    expires = db.Column(TIMESTAMP, nullable=False, index=True)
+
+
+class SchemaInfo(db.Model):
+    """
+    A single row recording which SCHEMA_VERSION the database was created
+    with, so later processes can skip create_all.
+    """
+    __tablename__ = 'qbay_schema'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+
 
+_schema_lock = threading.Lock()
+_schema_ready = False
 
+
+def init_db():
+    '''
+    Create the tables if this database has not been initialized with the
+    current SCHEMA_VERSION. Runs automatically before the first database
+    transaction of the process; later calls return immediately.
+    '''
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with db.engine.connect() as connection:
+            try:
+                version = connection.execute(
+                    SchemaInfo.__table__.select()).fetchone()
+            except exc.DBAPIError:
+                # marker table missing, i.e. a new or pre-marker database
+                version = None
+        if version is None or version.version != SCHEMA_VERSION:
+            # imported here because qbay.migrate imports this module
+            from qbay.migrate import add_missing_columns
+            with db.engine.begin() as connection:
+                db.metadata.create_all(bind=connection)
+                add_missing_columns(connection)
+                connection.execute(SchemaInfo.__table__.delete())
+                connection.execute(SchemaInfo.__table__.insert(),
+                                   {'id': 1, 'version': SCHEMA_VERSION})
+        _schema_ready = True
+
+
+@event.listens_for(db.session, 'after_begin')
+def _init_db_on_first_use(session, transaction, connection):
+    '''
+    Lazily create the schema on the first real use of the database.
+    '''
+    if not _schema_ready:
+        init_db()
+
+
+_local = threading.local()
+
+
+@contextmanager
+def deferred_commit():
+    '''
+    Inside this block the model functions flush their changes instead of
+    committing them, so the caller can commit many operations at once with
+    db.session.commit().
+    '''
+    previous = getattr(_local, 'defer_commit', False)
+    _local.defer_commit = True
+    try:
+        yield
+    finally:
+        _local.defer_commit = previous
+
+
+def _commit():
+    '''
+    Commit the session, or only flush it inside deferred_commit().
+    '''
+    if getattr(_local, 'defer_commit', False):
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+# Read-only snapshot of a product row, safe to share between sessions
+ProductInfo = namedtuple('ProductInfo', ['id', 'title', 'desc', 'price',
+                                         'owner_email', 'last_modified_date'])
+
+# Products by ('id', id) and ('title', title), see get_product
+product_cache = LRUCache(maxsize=app.config['QBAY_PRODUCT_CACHE_SIZE'],
+                         ttl=app.config['QBAY_PRODUCT_CACHE_TTL'])
+
+# Called with a {product id: ProductInfo} dict after each commit that
+# created or changed products, e.g. to keep qbay.search's index current
+product_listeners = []
+
+
+def _product_info(product):
+    return ProductInfo(product.id, product.title, product.desc,
+                       product.price, product.owner_email,
+                       product.last_modified_date)
+
+
+@profiled
+def get_product(product_id=None, title=None):
+    '''
+    Look up a product by id or by title, going to the database only when
+    product_cache does not have it
+      Parameters:
+        product_id (int):  product id
+        title (string):    product title, used when product_id is None
+      Returns:
+        A ProductInfo, or None if there is no such product
+    '''
+    key = ('id', product_id) if product_id is not None else ('title', title)
+    info = product_cache.get(key)
+    if info is not None:
+        return info
+
+    product = Product.query.filter_by(**{key[0]: key[1]}).first()
+    if product is None:
+        return None
+    info = _product_info(product)
+    product_cache.put(('id', info.id), info)
+    product_cache.put(('title', info.title), info)
+    return info
+
+
+def browse_products(page_size=20, order_by='id', min_price=None,
+                    max_price=None, owner_email=None, after=None):
+    '''
+    List products page by page with keyset pagination: each page is one
+    indexed query that starts after the previous page's last product, so
+    the cost of a page does not grow with how deep it is.
+      Parameters:
+        page_size (int):      products per page
+        order_by (string):    'id' or 'last_modified_date' (ties broken
+                              by id)
+        min_price (float):    only products costing at least this
+        max_price (float):    only products costing at most this
+        owner_email (string): only this seller's products
+        after (ProductInfo):  resume after this product
+      Returns:
+        A generator of pages, each a non-empty list of ProductInfo
+    '''
+    if order_by not in ('id', 'last_modified_date'):
+        raise ValueError('order_by must be id or last_modified_date')
+    if page_size < 1:
+        raise ValueError('page_size must be at least 1')
+
+    query = Product.query
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    if owner_email is not None:
+        query = query.filter(Product.owner_email == owner_email)
+    if order_by == 'id':
+        query = query.order_by(Product.id)
+    else:
+        query = query.order_by(Product.last_modified_date, Product.id)
+
+    while True:
+        page_query = query
+        if after is not None and order_by == 'id':
+            page_query = page_query.filter(Product.id > after.id)
+        elif after is not None:
+            page_query = page_query.filter(or_(
+                Product.last_modified_date > after.last_modified_date,
+                and_(Product.last_modified_date == after.last_modified_date,
+                     Product.id > after.id)))
+        page = [_product_info(p) for p in page_query.limit(page_size)]
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after = page[-1]
+
+
+def invalidate_product(product_id=None, title=None):
+    '''
+    Drop a product from product_cache under both of its keys.
+    '''
+    for key in (('id', product_id), ('title', title)):
+        # pop, not get: invalidating is neither a hit nor a miss
+        info = product_cache.pop(key)
+        if info is not None:
+            product_cache.pop(('id', info.id))
+            product_cache.pop(('title', info.title))
+
+
+def _product_written(product, old_title=None):
+    '''
+    Note a flushed but uncommitted product write: its cache entries (and
+    those of old_title, a title it no longer has) are dropped now and again
+    once it commits, since another thread may have cached the committed
+    row in between; product_listeners hear about it after the commit.
+    '''
+    info = _product_info(product)
+    invalidate_product(product_id=info.id)
+    invalidate_product(title=info.title)
+    title_filter.add(info.title)
+    db.session.info.setdefault('qbay_products', {})[info.id] = info
+    if old_title is not None:
+        invalidate_product(title=old_title)
+        db.session.info.setdefault('qbay_old_titles', set()).add(old_title)
+
+
+def _drop_written(session):
+    '''
+    Drop the cache entries of the products written in session's
+    transaction. Returns them as a {product id: ProductInfo} dict.
+    '''
+    written = session.info.pop('qbay_products', {})
+    for info in written.values():
+        invalidate_product(product_id=info.id)
+        invalidate_product(title=info.title)
+    for title in session.info.pop('qbay_old_titles', ()):
+        invalidate_product(title=title)
+    return written
+
+
+def _title_taken(title):
+    return get_product(title=title) is not None
+
+
+@event.listens_for(db.session, 'after_commit')
+def _products_committed(session):
+    written = _drop_written(session)
+    if written:
+        for listener in product_listeners:
+            listener(written)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _products_rolled_back(session, previous_transaction):
+    '''
+    Rows read inside the rolled back transaction may have been cached.
+    '''
+    _drop_written(session)
+
+
+def increment_totals(model, key, **amounts):
+    '''
+    Add amounts (column name -> number) to the counter row of model
+    identified by key, a dict of its primary key, creating the row if
+    needed. Used for the sales rollups and ProductRatings. Runs in the
+    current transaction.
+    '''
+    table = model.__table__
+    values = dict(key, **amounts)
+    dialect = db.engine.dialect.name
+    # a single upsert statement where the database has one, so two first
+    # writes of the same key cannot both try to insert it
+    if dialect == 'sqlite':
+        stmt = sqlite_insert(table).values(values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={name: table.c[name] + stmt.excluded[name]
+                  for name in amounts})
+        db.session.execute(stmt)
+    elif dialect == 'mysql':
+        stmt = mysql_insert(table).values(values)
+        stmt = stmt.on_duplicate_key_update(
+            **{name: table.c[name] + stmt.inserted[name]
+               for name in amounts})
+        db.session.execute(stmt)
+    else:
+        where = and_(*[table.c[name] == value for name, value in key.items()])
+        updated = db.session.execute(
+            table.update().where(where).values(
+                **{name: table.c[name] + amount
+                   for name, amount in amounts.items()})).rowcount
+        if not updated:
+            db.session.execute(table.insert().values(values))
+
+
+def _record_sale(seller, product_id, price, timestamp):
+    '''
+    Count one order in the sales rollups.
+    '''
+    increment_totals(SellerTotals, {'seller': seller}, units=1,
+                     revenue=price)
+    increment_totals(ProductTotals, {'product_id': product_id}, units=1,
+                     revenue=price)
+    increment_totals(DailySales, {'day': timestamp.date()}, units=1,
+                     revenue=price)
+
+
+def _abort():
+    '''
+    End the transaction of an operation that failed before writing
+    anything. Inside deferred_commit() the transaction belongs to the
+    caller and is left open.
+    '''
+    if not getattr(_local, 'defer_commit', False):
+        db.session.rollback()
+
+
+_NO_RESULT = object()
+
+KEY_REUSED = 'Idempotency key already used for a different request'
+
+
+def _request_hash(*args):
+    '''
+    SHA-256 hex digest of an operation's arguments, stored with its
+    idempotency key.
+    '''
+    return hashlib.sha256(
+        json.dumps(args, default=str).encode('utf-8')).hexdigest()
+
+
+def _stored_result(operation, key, request):
+    '''
+    The result recorded for an idempotency key, or _NO_RESULT. An expired
+    key counts as unused; _commit_with_key replaces it. KEY_REUSED when
+    the key was recorded with other arguments than request.
+    '''
+    row = db.session.get(IdempotencyKeys, (operation, key))
+    if row is None or row.expires < datetime.now():
+        return _NO_RESULT
+    # keys recorded before the request column existed have no hash
+    if row.request is not None and row.request != request:
+        return KEY_REUSED
+    return json.loads(row.result)
+
+
+def _commit_with_key(operation, key, request, result):
+    '''
+    _commit() an operation's writes together with its idempotency key (when
+    key is set) and the hash of its arguments, so the writes happen at most
+    once per key.
+      Returns:
+        result, or the result of the first call if a concurrent call with
+        the same key committed first (KEY_REUSED if its arguments were
+        different); this call's writes are then rolled back
+      Raises:
+        IntegrityError if the commit failed for any other reason, or
+        inside deferred_commit()
+    '''
+    if key is not None:
+        now = datetime.now()
+        ttl = timedelta(seconds=app.config['QBAY_IDEMPOTENCY_TTL'])
+        # an expired key is deleted here, in the transaction that reuses it,
+        # and only while still expired: a concurrent call that reused it
+        # first leaves a live row, and our insert then clashes with it
+        stale = db.session.identity_map.get(
+            db.session.identity_key(IdempotencyKeys, (operation, key)))
+        if stale is not None:
+            db.session.expunge(stale)
+        table = IdempotencyKeys.__table__
+        db.session.execute(table.delete().where(
+            table.c.operation == operation, table.c.key == key,
+            table.c.expires < now))
+        db.session.add(IdempotencyKeys(
+            operation=operation, key=key, result=json.dumps(result),
+            request=request, expires=now + ttl))
+    try:
+        _commit()
+    except exc.IntegrityError:
+        if key is None or getattr(_local, 'defer_commit', False):
+            raise
+        db.session.rollback()
+        stored = _stored_result(operation, key, request)
+        if stored is _NO_RESULT:
+            raise
+        return stored
+    return result
+
+
+def purge_idempotency_keys(chunk_size=1000):
+    '''
+    Delete expired idempotency keys, chunk_size per transaction
+      Returns:
+        The number of keys deleted
+    '''
+    table = IdempotencyKeys.__table__
+    deleted = 0
+    while True:
+        now = datetime.now()
+        expired = db.session.query(table.c.operation, table.c.key) \
+            .filter(table.c.expires < now).limit(chunk_size).all()
+        if expired:
+            # one executemany DELETE per chunk
+            db.session.execute(table.delete().where(
+                table.c.operation == bindparam('op'),
+                table.c.key == bindparam('k'), table.c.expires < now),
+                [{'op': op, 'k': key} for op, key in expired])
+        db.session.commit()
+        deleted += len(expired)
+        if len(expired) < chunk_size:
+            return deleted
+
+
+def _new_user_row(name, email, password_hash):
+    '''
+    Build the column values of a freshly registered user
+    '''
+    return {
+        'username': name,
+        'email': email,
+        'password': password_hash,
+        # R1-8: Shipping address is empty at the time of registration.
+        'shipping_addr': '',
+        # R1-9: Postal code is empty at the time of registration.
+        'postal_code': '',
+        # R1-10: Balance should be initialized as 100 at the time of
+        # registration.
+        'balance': 100,
+    }
+
+
+@profiled
 def register(name, email, password):
     '''
     Register a new user
@@ -146,55 +722,149 @@ def register(name, email, password):
         True if registration succeeded otherwise False
     '''
 
-    specialChar = ['!', '@', '#', '$', '%', '&', '*', '?']
-    email_regex = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-
-    # R1-1: Both the email and password cannot be empty
-    if not email or not password:  # Both should be strings, falsy when empty
+    # R1-1, R1-3 to R1-6 are checked before touching the database
+    if validate_registration(name, email, password) is not None:
         return False
 
     # R1-2/R1-7: Emails are unique / if the email is used, operation fails
-    existing_users = User.query.filter_by(email=email).all()
-    if len(existing_users) > 0:
+    if email_filter.exists(email, _email_taken):
         return False
 
-    # R1-3: The email has to follow addr-spec defined in RFC 5322
-    if (re.fullmatch(email_regex, email)) is None:
-        return False
+    # create a new user (R1-8 to R1-10 are set by _new_user_row)
+    newuser = User(**_new_user_row(name, email, hash_password(password)))
 
-    # R1-4: Password has to meet the required complexity
-    if (len(password) < 6 or password.lower() == password or password.upper()
-            == password or password.isalpha() or
-            not any(i in specialChar for i in password) or
-            not any(i.isdigit() for i in password)):
+    # add it to the current database session
+    db.session.add(newuser)
+    try:
+        db.session.flush()
+    except exc.IntegrityError:
+        # R1-7: another writer registered the email since the check above
+        if getattr(_local, 'defer_commit', False):
+            raise
+        db.session.rollback()
         return False
+    email_filter.add(email)
+    # actually save the user object
+    _commit()
 
-    # R1-5: User name rules
-    if not name or not re.match(r"^[ \w]+$", name) or name.strip() != name:
-        return False
+    return True
 
-    # R1-6: User name size
-    if len(name) <= 2 or len(name) > 20:
-        return False
 
-    # create a new user
-    newuser = User(username=name, email=email, password=password)
+def _email_taken(email):
+    return db.session.query(User.email).filter_by(email=email).first() \
+        is not None
 
-    # R1-8: Shipping address is empty at the time of registration.
-    newuser.shipping_addr = ""
-    # R1-9: Postal code is empty at the time of registration.
-    newuser.postal_code = ""
-    # R1-10: Balance should be initialized as 100 at the time of registration.
-    newuser.balance = 100
 
-    # add it to the current database session
-    db.session.add(newuser)
-    # actually save the user object
-    db.session.commit()
+# Outcome of one row passed to register_many. reason is 'ok' when the user
+# was created, otherwise the id of the rule that rejected the row.
+RegisterResult = namedtuple('RegisterResult', ['index', 'email', 'reason'])
 
-    return True
 
+@profiled
+def register_many(users, chunk_size=500, iterations=None):
+    '''
+    Register many users at once
+      Parameters:
+        users (iterable):  (name, email, password) tuples or dicts with
+                           'name', 'email' and 'password' keys
+        chunk_size (int):  rows per existing-email query, bulk insert
+                           and commit
+        iterations (int):  PBKDF2 work factor for these users, defaults to
+                           QBAY_PASSWORD_ITERATIONS
+      Returns:
+        A list of RegisterResult, one per input row and in input order
+
+    Hashing dominates: at the default work factor each password costs
+    about 0.1 s of CPU. A chunk's passwords are hashed in parallel on
+    QBAY_PASSWORD_HASH_WORKERS threads, so a large import takes roughly
+    users * 0.1 s / cores. A lower iterations makes a bulk onboarding
+    cheaper at the price of weaker hashes until each user next logs in,
+    when login rehashes the password at the configured work factor.
+    '''
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1')
+
+    results = []
+    # emails accepted so far in this call, to catch duplicates in the input
+    seen = set()
+    chunk = []
+
+    for index, row in enumerate(users):
+        if isinstance(row, dict):
+            name, email, password = row.get('name'), row.get('email'), \
+                row.get('password')
+        else:
+            name, email, password = row
+        chunk.append((index, name, email, password))
+        if len(chunk) >= chunk_size:
+            results.extend(_register_chunk(chunk, seen, iterations))
+            chunk = []
+    if chunk:
+        results.extend(_register_chunk(chunk, seen, iterations))
+
+    return results
+
+
+def _register_chunk(chunk, seen, iterations):
+    '''
+    Validate, insert and commit one chunk of register_many rows
+    '''
+    results = []
+    candidates = []
+    for index, name, email, password in chunk:
+        reason = validate_registration(name, email, password)
+        results.append(RegisterResult(index, email, reason))
+        if reason is None:
+            candidates.append(len(results) - 1)
+
+    # R1-2/R1-7: a single IN (...) query for the whole chunk, asking only
+    # about the emails the Bloom filter cannot rule out
+    emails = {results[i].email for i in candidates}
+    existing = email_filter.existing(emails, lambda maybe: {
+        email for (email,) in db.session.query(User.email)
+        .filter(User.email.in_(maybe))})
+
+    inserted = []
+    for i in candidates:
+        index, name, email, password = chunk[i]
+        if email in existing or email in seen:
+            results[i] = results[i]._replace(reason='R1-7')
+            continue
+        seen.add(email)
+        inserted.append(i)
+        results[i] = results[i]._replace(reason='ok')
+
+    # the chunk's passwords are hashed in parallel
+    hashes = hash_passwords([chunk[i][3] for i in inserted], iterations)
+    rows = [_new_user_row(chunk[i][1], chunk[i][2], password_hash)
+            for i, password_hash in zip(inserted, hashes)]
+
+    if not rows:
+        return results
 
+    try:
+        # one executemany INSERT and one commit for the chunk
+        db.session.execute(User.__table__.insert(), rows)
+        for row in rows:
+            email_filter.add(row['email'])
+        db.session.commit()
+    except exc.IntegrityError:
+        # another writer registered one of the emails after our check,
+        # redo this chunk row by row so only the clashing rows fail
+        db.session.rollback()
+        for i, row in zip(inserted, rows):
+            try:
+                db.session.execute(User.__table__.insert(), [row])
+                email_filter.add(row['email'])
+                db.session.commit()
+            except exc.IntegrityError:
+                db.session.rollback()
+                results[i] = results[i]._replace(reason='R1-7')
+
+    return results
+
+
+@profiled
 def login(email, password):
     '''
     Check login information
@@ -204,49 +874,35 @@ def login(email, password):
       Returns:
         The user object if login succeeded otherwise None
     '''
-    specialChar = ['!', '@', '#', '$', '%', '&', '*', '?']
-
-    # R1-1: email is not empty
-    if email == '':
+    # R1-1, R1-3 and R1-4 on the email and password
+    if validate_login(email, password) is not None:
         return False
 
-    # R1-3: email follows addr-spec define in RFC 5322
-    try:
-        validate_email(email)
-    except EmailNotValidError as e:
-        return False
-
-    # R1-1: password is not empty
-    if password == '':
-        return False
-
-    # R1-4: password is at least 6 letters
-    if len(str(password)) < 6:
-        return False
-
-    # R1-4: password has a number
-    if not any(i.isdigit() for i in password):
-        return False
-
-    # R1-4: password has an uppercase letter
-    if not any(i.isupper() for i in password):
-        return False
+    # look the user up by email only, then check the password hash
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        burn_verify(password)
+        return None
+    if not verify_password(password, user.password):
+        return None
 
-    # R1-4: password has a lowercase letter
-    if not any(i.islower() for i in password):
-        return False
+    # upgrade plaintext and old work factor hashes while we have the
+    # password
+    if needs_rehash(user.password):
+        user.password = hash_password(password)
+        _commit()
+    return user
 
-    # R1-4: password has a special character
-    if not any(i in specialChar for i in password):
-        return False
 
-    # look in the database and return the user
-    valids = User.query.filter_by(email=email, password=password).all()
-    if len(valids) != 1:
-        return None
-    return valids[0]
+_USER_UPDATE_ERRORS = {
+    'R3-2': "Shipping address incorrect",
+    'R3-3': "Postal code incorrect",
+    'R3-4': "Username requirement failure.",
+    'R1-6': "Length of username failure",
+}
 
 
+@profiled
 def user_update(current_username, **kwargs):
     '''
     Check update information
@@ -255,42 +911,35 @@ def user_update(current_username, **kwargs):
         shipping_address (string): user's address
         postal_code (string): user's postal
     Make use of regex.
+    Usernames are not unique: the first user with current_username is
+    updated. Use user_update_by_email to update a particular user.
     '''
-    current_user = User.query.filter_by(username=current_username).first()
+    return _update_user(User.username == current_username, kwargs)
 
+
+@profiled
+def user_update_by_email(email, **kwargs):
+    '''
+    user_update for the user with the given email (the primary key), e.g.
+    the one logged in
+    '''
+    return _update_user(User.email == email, kwargs)
+
+
+def _update_user(which, kwargs):
     # R3-1 Only specified tables can be updated.
     if not (all(k in kwargs for k in
             ("new_username", "new_shipping_address", "new_postal_code"))
             and len(kwargs) == 3):
         return False
-        print("Incorrect Table")
-
-    # R3-2 Shipping address should be alphanumeric-only,
-    # and no special characters
-    if (any(not c.isalnum() and not c.isspace()
-            for c in kwargs['new_shipping_address'])
-            or not(kwargs['new_shipping_address'])):
-        print("Shipping address incorrect")
-        return False
-
-    # R3-3 Ensure it's a valid Canadian Postal Code
-    regex = '[A-Za-z][0-9][A-Za-z] [0-9][A-Za-z][0-9]'
-    postal_pattern = re.match(regex, kwargs['new_postal_code'])
-    if not(postal_pattern is not None and len(kwargs['new_postal_code']) == 7):
-        print("Postal code incorrect")
-        return False
-
-    # R3-4 - Username Requirement
-    if (not kwargs['new_username'] or
-        not re.match(r"^[ \w]+$", kwargs['new_username'])
-            or kwargs['new_username'].strip() != kwargs['new_username']):
-        print("Username requirement failure.")
-        return False
 
-    if len(kwargs['new_username']) <= 2 or len(kwargs['new_username']) > 20:
-        print("Length of username failure")
+    # R3-2 to R3-4
+    reason = validate_user_update(**kwargs)
+    if reason is not None:
+        print(_USER_UPDATE_ERRORS[reason])
         return False
 
+    current_user = User.query.filter(which).first()
     if current_user is None:    # No such user exists
         print("User doesn't exist")
         return False
@@ -302,13 +951,15 @@ def user_update(current_username, **kwargs):
     current_user.postal_code = kwargs['new_postal_code']
 
     try:
-        db.session.commit()
+        _commit()
         return True
     except exc.SQLAlchemyError as e:
         return e
 
 
-def create_product(title, description, price, date, owner_email):
+@profiled
+def create_product(title, description, price, date, owner_email,
+                   idempotency_key=None):
     '''
     Create a new product for listing
       Parameters:
@@ -317,52 +968,37 @@ def create_product(title, description, price, date, owner_email):
         price (int):             product price
         date (int):              product last modified date
         owner_email(string):     product contact email
+        idempotency_key(string): optional; a retried call with the same
+                                 key returns the first call's result, a
+                                 call with the same key and other
+                                 arguments returns KEY_REUSED
     '''
+    request = None
+    if idempotency_key is not None:
+        request = _request_hash(title, description, price, date, owner_email)
+        stored = _stored_result('create_product', idempotency_key, request)
+        if stored is not _NO_RESULT:
+            return stored
+
     if not date:
         date = datetime.today()
-    # R4-1: The title of the product has to be alphanumeric-only, and space
-    # allowed only if it is not as prefix and suffix.
-    if not title or not re.match(r"^[ \w]+$", title) or title.strip() != title:
-        return False
-
-    # R4-2: The title of the product is no longer than 80 characters.
-    # (Requirement of not empty is covered above by "if not title")
-    if len(title) > 80:
-        return False
-
-    # R4-3: The description of the product can be arbitrary characters
-    # with a minimum length of 20 characters and a maximum of 2000 characters.
-    if len(description) < 20 or len(description) > 2000:
-        return False
-
-    # R4-4: Description has to be longer than the product's title.
-    if len(title) >= len(description):
-        return False
-
-    # R4-5: Price has to be of range [10, 10000].
-    if price <= 10 or price >= 10000:  # inclusive
-        return False
 
-    # R4-6: last_modified_date must be after 2021-01-02 and before 2025-01-02.
-    if type(date) is str:
-        year, month, day = map(int, date.split('-'))
-        date = datetime(year, month, day)
-    minDate = datetime(2021, 1, 2)  # assigns parameters to compare to date
-    maxDate = datetime(2025, 1, 2)
-    if date < minDate or date > maxDate:
+    # R4-1 to R4-6
+    if validate_product(title, description, price, date) is not None:
         return False
+    date = parse_date(date)
 
     # R4-7: owner_email cannot be empty. The owner of the corresponding
     # product must exist in the database.
     if (owner_email == ''
-            or len(User.query.filter_by(email=owner_email).all()) == 0):
+            or not db.session.query(User.email)
+            .filter_by(email=owner_email).first()):
         return False
 
     # R4-8: A user cannot create products that have the same title
     # duplicatieTitleExists return True if there is a product with the same
     # title, otherwise it returns False.
-    duplicateTitleExists = db.session.query(
-        Product).filter_by(title=title).first() is not None
+    duplicateTitleExists = title_filter.exists(title, _title_taken)
 
     # check if duplicate title exists in the database
     if (duplicateTitleExists):
@@ -381,12 +1017,30 @@ def create_product(title, description, price, date, owner_email):
     # actually save the product object
 
     try:
-        db.session.commit()
-        return True
+        db.session.flush()
+    except exc.IntegrityError:
+        # R4-8: another writer took the title since the check above
+        if getattr(_local, 'defer_commit', False):
+            raise
+        db.session.rollback()
+        if idempotency_key is not None:
+            # ... possibly a retry of this very call
+            stored = _stored_result('create_product', idempotency_key,
+                                    request)
+            if stored is not _NO_RESULT:
+                return stored
+        return False
+    except exc.SQLAlchemyError as e:
+        return e
+    _product_written(newProduct)
+    try:
+        return _commit_with_key('create_product', idempotency_key, request,
+                                True)
     except exc.SQLAlchemyError as e:
         return e
 
 
+@profiled
 def update_product(_id, **kwargs):
     '''
      Update a product in the database:
@@ -411,37 +1065,17 @@ def update_product(_id, **kwargs):
         return False
 
     # R5-4: When updating an attribute, one has to make sure that it follows
-    # the same requirements as above.
-
-    # R4-1: The title of the product has to be alphanumeric-only, and space
-    # allowed only if it is not as prefix and suffix.
-    if (not re.match(r"^[ \w]+$", kwargs["newTitle"])
-            or kwargs["newTitle"].strip() != kwargs["newTitle"]):
-        return False
-
-    # R4-2: The title of the product is no longer than 80 characters and not
-    # empty.
-    if len(kwargs["newTitle"]) > 80 or not kwargs["newTitle"]:
-        return False
-
-    # R4-3: The description of the product can be arbitrary characters
-    # with a minimum length of 20 characters and a maximum of 2000 characters.
-    if len(kwargs["newDesc"]) < 20 or len(kwargs["newDesc"]) > 2000:
-        return False
-
-    # R4-4: Description has to be longer than the product's title.
-    if len(kwargs["newTitle"]) >= len(kwargs["newDesc"]):
-        return False
-
-    # R4-5: Price has to be of range [10, 10000].
-    if kwargs["newPrice"] <= 10 or kwargs["newPrice"] >= 10000:  # inclusive
+    # the same requirements as above (R4-1 to R4-5).
+    if validate_product(kwargs["newTitle"], kwargs["newDesc"],
+                        kwargs["newPrice"]) is not None:
         return False
 
     # R4-8: A user cannot create products that have the same title
-    if (db.session.query(Product).filter_by(title=kwargs["newTitle"]).first()
-            is not None and currentProduct.title != kwargs["newTitle"]):
+    if (currentProduct.title != kwargs["newTitle"]
+            and title_filter.exists(kwargs["newTitle"], _title_taken)):
         return False
 
+    old_title = currentProduct.title
     currentProduct.price = kwargs["newPrice"]
     currentProduct.title = kwargs["newTitle"]
     currentProduct.desc = kwargs["newDesc"]
@@ -451,43 +1085,222 @@ def update_product(_id, **kwargs):
     currentProduct.last_modified_date = datetime.today()
 
     try:
-        db.session.commit()
-        return True
+        db.session.flush()
+    except exc.IntegrityError:
+        # R4-8: another writer took the new title since the check above
+        if getattr(_local, 'defer_commit', False):
+            raise
+        db.session.rollback()
+        return False
     except exc.SQLAlchemyError as e:
         return e
+    _product_written(currentProduct, old_title)
+    try:
+        _commit()
+    except exc.SQLAlchemyError as e:
+        return e
+    return True
 
 
-def purchase_product(productTitle, email):
+@profiled
+def purchase_product(productTitle, email, idempotency_key=None):
     '''
     this function is the backend for making orders on products.
     to make a purchase:
         1. productTitle: title of the product
         2. email: user email address
+        3. idempotency_key: optional; a retried call with the same key
+           returns the first call's result instead of ordering again,
+           and a call with the same key for another product or buyer
+           returns KEY_REUSED
+    The buyer is debited, the seller credited and the transaction recorded
+    in one database transaction.
+      Returns:
+        True if the order was placed, False if the product or buyer does
+        not exist, otherwise a message saying why the order was refused
     '''
+    # only orders that were placed are remembered: a refused order
+    # changed nothing and may be retried
+    request = None
+    if idempotency_key is not None:
+        request = _request_hash(productTitle, email)
+        stored = _stored_result('purchase_product', idempotency_key, request)
+        if stored is not _NO_RESULT:
+            return stored
 
     # get product that wants to be purchased
-    product = Product.query.filter_by(title=productTitle).first()
-    user = User.query.filter_by(email=email).first()
+    product = get_product(title=productTitle)
+    if product is None:
+        return False
 
     # owner of the product can't purchase his own product
-    if (user.email == product.owner_email):
+    if (email == product.owner_email):
         return "Cannot make an order on your own products"
 
+    # The cached product may be stale: lock the product row and charge
+    # the price it has now, so an update cannot change it under the order.
+    price = db.session.query(Product.price).filter_by(id=product.id) \
+        .with_for_update().scalar()
+    if price is None:
+        _abort()
+        return False
+
+    # Lock the buyer and seller rows in primary key order, so concurrent
+    # orders between the same two users cannot deadlock (no-op on SQLite).
+    users = User.query.filter(User.email.in_([email, product.owner_email])) \
+        .order_by(User.email).with_for_update().all()
+    if email not in {u.email for u in users}:
+        # release the locks taken above
+        _abort()
+        return False
+
     # A user cannot place an order that costs more than his/her balance.
-    if (user.balance < product.price):
+    # The check and the debit are one statement, so concurrent orders can
+    # never spend the same balance twice.
+    debited = User.query.filter(User.email == email,
+                                User.balance >= price) \
+        .update({User.balance: User.balance - price},
+                synchronize_session=False)
+    if debited != 1:
+        _abort()
         return "You don't have enough balance to purchase this item"
 
+    User.query.filter(User.email == product.owner_email) \
+        .update({User.balance: User.balance + price},
+                synchronize_session=False)
+
     # create transaction
-    newTransaction = Transactions(price=product.price,
-                                  buyer=user.email,
+    now = datetime.now()
+    newTransaction = Transactions(price=price,
+                                  buyer=email,
                                   seller=product.owner_email,
-                                  product_id=product.id)
+                                  product_id=product.id,
+                                  timestamp=now)
 
     newTransaction.status = ""  # initialized as an empty string
 
     # add it to the current database session
     db.session.add(newTransaction)
-    # actually save the transaction object
-    db.session.commit()
+    # keep the sales rollups in step, in the same database transaction
+    _record_sale(product.owner_email, product.id, price, now)
+    # actually save the transaction object, with the key if there is one
+    result = _commit_with_key('purchase_product', idempotency_key, request,
+                              True)
+
+    # balances were changed behind the session's back
+    for user in users:
+        db.session.expire(user, ['balance'])
 
+    return result
+
+
+# Read-only snapshot of a review row
+ReviewInfo = namedtuple('ReviewInfo', ['id', 'product_id', 'poster',
+                                       'rating', 'subject', 'content',
+                                       'timestamp'])
+# average is None while a product has no reviews
+RatingInfo = namedtuple('RatingInfo', ['count', 'average'])
+
+
+@profiled
+def create_review(product_id, poster, rating, subject, content):
+    '''
+    Post a review of a product
+      Parameters:
+        product_id (int):  id of the product reviewed
+        poster (string):   email of the user posting the review
+        rating (int):      1 to 5
+        subject (string):  review title
+        content (string):  review text
+      Returns:
+        True if the review was posted otherwise False
+    '''
+    # R6-1 to R6-3
+    if validate_review(rating, subject, content) is not None:
+        return False
+
+    # R6-4: the product and the poster must exist
+    if get_product(product_id=product_id) is None \
+            or not db.session.query(User.email) \
+            .filter_by(email=poster).first():
+        return False
+
+    db.session.add(Reviews(product_id=product_id, poster=poster,
+                           rating=rating, subject=subject, content=content,
+                           timestamp=datetime.now()))
+    # the product's rating changes in the same transaction
+    increment_totals(ProductRatings, {'product_id': product_id}, count=1,
+                     total=rating)
+    _commit()
     return True
+
+
+def _review_info(review):
+    return ReviewInfo(review.id, review.product_id, review.poster,
+                      review.rating, review.subject, review.content,
+                      review.timestamp)
+
+
+def _review_pages(query, page_size, before):
+    '''
+    Pages of reviews newest first, with keyset pagination on
+    (timestamp, id) as in browse_products.
+    '''
+    if page_size < 1:
+        raise ValueError('page_size must be at least 1')
+    query = query.order_by(Reviews.timestamp.desc(), Reviews.id.desc())
+    while True:
+        page_query = query
+        if before is not None:
+            page_query = page_query.filter(or_(
+                Reviews.timestamp < before.timestamp,
+                and_(Reviews.timestamp == before.timestamp,
+                     Reviews.id < before.id)))
+        page = [_review_info(r) for r in page_query.limit(page_size)]
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        before = page[-1]
+
+
+def product_reviews(product_id, page_size=20, before=None):
+    '''
+    List the reviews of a product, newest first
+      Parameters:
+        product_id (int):     the product's id
+        page_size (int):      reviews per page
+        before (ReviewInfo):  resume after this review
+      Returns:
+        A generator of pages, each a non-empty list of ReviewInfo
+    '''
+    return _review_pages(Reviews.query.filter_by(product_id=product_id),
+                         page_size, before)
+
+
+def poster_reviews(poster, page_size=20, before=None):
+    '''
+    List the reviews a user posted, newest first
+      Parameters:
+        poster (string):      the user's email
+        page_size (int):      reviews per page
+        before (ReviewInfo):  resume after this review
+      Returns:
+        A generator of pages, each a non-empty list of ReviewInfo
+    '''
+    return _review_pages(Reviews.query.filter_by(poster=poster),
+                         page_size, before)
+
+
+def product_rating(product_id):
+    '''
+    Number of reviews and average rating of a product, read from
+    ProductRatings
+      Returns:
+        A RatingInfo (count, average)
+    '''
+    row = db.session.get(ProductRatings, product_id)
+    if row is None or not row.count:
+        return RatingInfo(0, None)
+    return RatingInfo(row.count, row.total / row.count)
@@ -0,0 +1,158 @@
+'''
+Order status worker: moves Transactions through the order pipeline
+
+    '' (pending) -> processed -> shipped -> delivered
+
+A batch claims up to chunk_size of the oldest orders in one status, moves
+them all to the next with a single UPDATE, records the transition times in
+OrderTransitions with one multi-row INSERT and commits.
+
+On MySQL 8 (and MariaDB 10.6+) the claim is SELECT ... FOR UPDATE SKIP
+LOCKED, so several workers take disjoint batches in parallel. Elsewhere the
+claim locks (MySQL 5.7) or relies on the database's single writer
+(SQLite). In every case the UPDATE only moves orders still in the claimed
+status, and a batch that lost any order to another worker is rolled back
+and claimed again, so no order is moved twice.
+'''
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import exc, select
+
+from qbay.models import db, Transactions, OrderTransitions
+
+PENDING = ''
+# status -> the status it moves to
+NEXT_STATUS = {PENDING: 'processed', 'processed': 'shipped',
+               'shipped': 'delivered'}
+STAGES = list(NEXT_STATUS.values())
+# failed batches in a row before run_worker gives up
+MAX_RETRIES = 10
+
+# Figures of one committed batch
+BatchStats = namedtuple('BatchStats', ['stage', 'orders', 'seconds',
+                                       'orders_per_s'])
+
+
+class ClaimConflict(Exception):
+    '''
+    Another worker moved some of the claimed orders first.
+    '''
+
+
+def _skip_locked(engine):
+    '''
+    Whether the database supports FOR UPDATE SKIP LOCKED.
+    '''
+    dialect = engine.dialect
+    if dialect.name != 'mysql':
+        return False
+    version = dialect.server_version_info or ()
+    if getattr(dialect, 'is_mariadb', False):
+        return version >= (10, 6)
+    return version >= (8, 0, 1)
+
+
+def advance_batch(stage, chunk_size=500):
+    '''
+    Move up to chunk_size orders into stage from the status before it
+      Parameters:
+        stage (string):    'processed', 'shipped' or 'delivered'
+        chunk_size (int):  most orders to move
+      Returns:
+        The number of orders moved, 0 when none were waiting
+      Raises:
+        ClaimConflict if another worker moved a claimed order first; the
+        batch is rolled back
+    '''
+    previous = {to: status for status, to in NEXT_STATUS.items()}[stage]
+    table = Transactions.__table__
+    claim = select(table.c.id).where(table.c.status == previous) \
+        .order_by(table.c.id).limit(chunk_size)
+    if db.engine.dialect.name == 'mysql':
+        claim = claim.with_for_update(skip_locked=_skip_locked(db.engine))
+
+    try:
+        ids = [row[0] for row in db.session.execute(claim)]
+        if not ids:
+            db.session.rollback()
+            return 0
+        moved = db.session.execute(
+            table.update()
+            .where(table.c.id.in_(ids), table.c.status == previous)
+            .values(status=stage)).rowcount
+        if moved != len(ids):
+            raise ClaimConflict(stage)
+        now = datetime.now()
+        db.session.execute(OrderTransitions.__table__.insert(), [
+            {'transaction_id': i, 'status': stage, 'timestamp': now}
+            for i in ids])
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    return len(ids)
+
+
+def run_worker(stages=None, chunk_size=500, follow=False, poll=1.0,
+               out=None):
+    '''
+    Advance orders batch by batch
+      Parameters:
+        stages (list):     stages to work on, all of STAGES by default
+        chunk_size (int):  orders per batch
+        follow (bool):     keep polling for new orders instead of
+                           returning once no stage has any waiting
+        poll (float):      seconds to sleep between polls when idle
+        out (callable):    called with the BatchStats of every batch
+      Returns:
+        A dict of stage to the number of orders moved into it
+    '''
+    stages = STAGES if stages is None else stages
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError('unknown stage: %r' % (stage,))
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1')
+
+    totals = dict.fromkeys(stages, 0)
+    failures = 0
+    while True:
+        idle = True
+        # later stages first, so an order moves one step per pass
+        for stage in reversed(stages):
+            start = time.perf_counter()
+            try:
+                moved = advance_batch(stage, chunk_size)
+            except (ClaimConflict, exc.OperationalError):
+                # lost a race or timed out on a lock: claim a fresh batch,
+                # unless the database keeps failing
+                failures += 1
+                if failures > MAX_RETRIES:
+                    raise
+                idle = False
+                continue
+            failures = 0
+            if not moved:
+                continue
+            idle = False
+            totals[stage] += moved
+            if out is not None:
+                seconds = time.perf_counter() - start
+                out(BatchStats(stage, moved, seconds, moved / seconds))
+        if idle:
+            if not follow:
+                return totals
+            time.sleep(poll)
+
+
+def order_history(transaction_id):
+    '''
+    The transitions of one order, oldest first
+      Returns:
+        A list of (status, timestamp)
+    '''
+    return [(t.status, t.timestamp) for t in OrderTransitions.query
+            .filter_by(transaction_id=transaction_id)
+            .order_by(OrderTransitions.id)]
@@ -0,0 +1,125 @@
+'''
+Password hashing with PBKDF2-HMAC-SHA256.
+
+Stored hashes look like pbkdf2$<iterations>$<salt>$<hash>, with a 12 byte
+salt and the 32 byte hash in unpadded urlsafe base64. That is at most 75
+characters, so it fits the existing User.password column (80) and live
+databases need no column change.
+
+The work factor is QBAY_PASSWORD_ITERATIONS (see qbay/__init__.py). Hashes
+made with a different work factor, and plaintext passwords stored before
+hashing was introduced, still verify and are reported by needs_rehash so
+login can upgrade them.
+
+hash_passwords hashes many passwords on a thread pool of
+QBAY_PASSWORD_HASH_WORKERS threads; pbkdf2_hmac releases the GIL, so this
+scales with the CPU cores.
+'''
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from qbay import app
+
+ALGORITHM = 'pbkdf2'
+SALT_BYTES = 12
+
+
+def _b64(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _derive(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt,
+                               iterations)
+
+
+def hash_password(password, iterations=None):
+    '''
+    Hash a password for storage
+      Parameters:
+        password (string):  the plaintext password
+        iterations (int):   work factor, defaults to the configured one
+      Returns:
+        The encoded hash
+    '''
+    if iterations is None:
+        iterations = app.config['QBAY_PASSWORD_ITERATIONS']
+    salt = os.urandom(SALT_BYTES)
+    return '%s$%d$%s$%s' % (ALGORITHM, iterations, _b64(salt),
+                            _b64(_derive(password, salt, iterations)))
+
+
+_hash_pool = None
+
+
+def hash_passwords(passwords, iterations=None):
+    '''
+    hash_password for many passwords at once, in parallel
+      Parameters:
+        passwords (list):   the plaintext passwords
+        iterations (int):   work factor, defaults to the configured one
+      Returns:
+        The encoded hashes, in the order of passwords
+    '''
+    global _hash_pool
+    workers = app.config['QBAY_PASSWORD_HASH_WORKERS']
+    if workers <= 1 or len(passwords) <= 1:
+        return [hash_password(p, iterations) for p in passwords]
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix='qbay-hash')
+    return list(_hash_pool.map(hash_password, passwords,
+                               [iterations] * len(passwords)))
+
+
+def _parse(stored):
+    '''
+    Split an encoded hash into (iterations, salt, hash), or None if stored
+    is a legacy plaintext password.
+    '''
+    parts = stored.split('$')
+    if len(parts) != 4 or parts[0] != ALGORITHM or not parts[1].isdigit():
+        return None
+    return int(parts[1]), _unb64(parts[2]), _unb64(parts[3])
+
+
+def verify_password(password, stored):
+    '''
+    Check a password against a stored hash (or legacy plaintext) with a
+    constant time comparison.
+    '''
+    parsed = _parse(stored)
+    if parsed is None:
+        return hmac.compare_digest(password.encode('utf-8'),
+                                   stored.encode('utf-8'))
+    iterations, salt, expected = parsed
+    return hmac.compare_digest(_derive(password, salt, iterations), expected)
+
+
+def needs_rehash(stored):
+    '''
+    True if stored is plaintext or was hashed with a different work factor
+    than the configured one.
+    '''
+    parsed = _parse(stored)
+    return parsed is None \
+        or parsed[0] != app.config['QBAY_PASSWORD_ITERATIONS']
+
+
+# verified against when the email is unknown, so a failed login costs the
+# same whether or not the account exists
+_DUMMY_SALT = os.urandom(SALT_BYTES)
+
+
+def burn_verify(password):
+    '''
+    Spend the time of one verify_password without a stored hash.
+    '''
+    _derive(password, _DUMMY_SALT, app.config['QBAY_PASSWORD_ITERATIONS'])
@@ -0,0 +1,124 @@
+'''
+Database connection pool with checkout statistics.
+
+TimedQueuePool is the QueuePool used for server databases (see the
+QBAY_DB_POOL_* settings in qbay/__init__.py). Besides handing out
+connections it counts checkouts, new connections, invalidated (e.g. stale)
+connections and timeouts, and measures how long each checkout waited for a
+connection, in the process wide pool_stats.
+'''
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """
+    Counters of a connection pool, safe to update from many threads.
+    .........
+    Atributes
+    ---------
+    checkouts : Integer
+        Connections handed out
+    connects : Integer
+        New database connections opened
+    invalidations : Integer
+        Connections discarded as broken or stale
+    timeouts : Integer
+        Checkouts that gave up after the pool timeout
+    wait_time : Float
+        Seconds spent waiting for a connection, over all checkouts
+    max_wait : Float
+        Longest single wait in seconds
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.timeouts = 0
+            self.wait_time = 0.0
+            self.max_wait = 0.0
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def waited(self, seconds):
+        with self._lock:
+            self.wait_time += seconds
+            self.max_wait = max(self.max_wait, seconds)
+
+    def snapshot(self, pool=None):
+        '''
+        The counters as a dict, plus the current size, checked out and
+        overflow connections of pool if it is a QueuePool.
+        '''
+        with self._lock:
+            stats = {
+                'checkouts': self.checkouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_time': self.wait_time,
+                'avg_wait': self.wait_time / self.checkouts
+                if self.checkouts else 0.0,
+                'max_wait': self.max_wait,
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(),
+                         overflow=pool.overflow())
+        return stats
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """
+    A QueuePool that records in pool_stats how long every checkout waited.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.count('timeouts')
+            raise
+        finally:
+            pool_stats.waited(time.perf_counter() - start)
+
+
+@event.listens_for(TimedQueuePool, 'checkout')
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_stats.count('checkouts')
+
+
+@event.listens_for(TimedQueuePool, 'connect')
+def _connect(dbapi_connection, connection_record):
+    pool_stats.count('connects')
+
+
+@event.listens_for(TimedQueuePool, 'invalidate')
+def _invalidate(dbapi_connection, connection_record, exception):
+    pool_stats.count('invalidations')
+
+
+def pool_status():
+    '''
+    Checkout and wait statistics of the application's connection pool
+      Returns:
+        A dict of the pool_stats counters, with the pool's current size,
+        checked out and overflow connections when it is a QueuePool
+    '''
+    # imported here because qbay/__init__.py imports this module
+    from qbay.models import db
+    return pool_stats.snapshot(db.engine.pool)
@@ -0,0 +1,178 @@
+'''
+Opt-in profiling of the model functions.
+
+Model functions decorated with @profiled are timed, and while profiling is
+enabled SQLAlchemy engine events count the statements each one executes,
+the rows they touch and the time spent in the database. Statements are
+counted for every profiled function on the calling thread's stack, so
+create_product's figures include the get_product lookup it makes.
+
+Rows are the rows a write affected plus the ORM objects loaded; drivers
+such as sqlite3 do not report how many rows a SELECT returned.
+
+When profiling is off the decorator costs one flag check per call and no
+engine events are registered.
+
+    enable()            start collecting (python -m qbay --profile)
+    snapshot()          the figures so far, per function
+    disable(), reset()
+'''
+import functools
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_engine = None
+# function name -> [calls, seconds, max seconds, statements, rows,
+#                   sql seconds]
+_stats = {}
+# statements executed outside any profiled function
+OUTSIDE = '(no operation)'
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _row(name):
+    row = _stats.get(name)
+    if row is None:
+        row = _stats[name] = [0, 0.0, 0.0, 0, 0, 0.0]
+    return row
+
+
+def profiled(func):
+    '''
+    Time func while profiling is enabled, and attribute the SQL it runs to
+    it.
+    '''
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        stack = _stack()
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with _lock:
+                row = _row(name)
+                row[0] += 1
+                row[1] += elapsed
+                row[2] = max(row[2], elapsed)
+    return wrapper
+
+
+def _add_sql(statements, rows, seconds):
+    names = set(_stack()) or (OUTSIDE,)
+    with _lock:
+        for name in names:
+            row = _row(name)
+            row[3] += statements
+            row[4] += rows
+            row[5] += seconds
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('qbay_profile_start', []).append(
+        time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info['qbay_profile_start'].pop()
+    rows = cursor.rowcount if context.isinsert or context.isupdate \
+        or context.isdelete else 0
+    _add_sql(1, max(rows, 0), elapsed)
+
+
+def _on_load(target, context):
+    _add_sql(0, 1, 0.0)
+
+
+def enable(engine=None):
+    '''
+    Start profiling the statements run on engine, by default the app's.
+    '''
+    global _enabled, _engine
+    if _enabled:
+        return
+    if engine is None:
+        # imported here because qbay.models imports this module
+        from qbay.models import db
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Mapper, 'load', _on_load)
+    _engine = engine
+    _enabled = True
+
+
+def disable():
+    '''
+    Stop profiling and remove the engine event hooks. The figures collected
+    so far are kept.
+    '''
+    global _enabled, _engine
+    if not _enabled:
+        return
+    _enabled = False
+    event.remove(_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.remove(_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.remove(Mapper, 'load', _on_load)
+    _engine = None
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def snapshot():
+    '''
+    The figures collected so far
+      Returns:
+        A dict of function name to a dict of calls, total_ms, avg_ms,
+        max_ms, statements, rows and sql_ms
+    '''
+    with _lock:
+        rows = {name: list(row) for name, row in _stats.items()}
+    return {name: {
+        'calls': calls,
+        'total_ms': seconds * 1000,
+        'avg_ms': seconds * 1000 / calls if calls else 0.0,
+        'max_ms': longest * 1000,
+        'statements': statements,
+        'rows': loaded,
+        'sql_ms': sql_seconds * 1000,
+    } for name, (calls, seconds, longest, statements, loaded,
+                 sql_seconds) in rows.items()}
+
+
+def format_snapshot(stats=None):
+    '''
+    A snapshot as a text table, slowest function first.
+    '''
+    stats = snapshot() if stats is None else stats
+    lines = ['%-20s %7s %10s %9s %9s %6s %7s %9s' % (
+        'function', 'calls', 'total ms', 'avg ms', 'max ms', 'sql',
+        'rows', 'sql ms')]
+    for name, s in sorted(stats.items(), key=lambda i: -i[1]['total_ms']):
+        lines.append('%-20s %7d %10.2f %9.3f %9.3f %6d %7d %9.2f' % (
+            name, s['calls'], s['total_ms'], s['avg_ms'], s['max_ms'],
+            s['statements'], s['rows'], s['sql_ms']))
+    return '\n'.join(lines)
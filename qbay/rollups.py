@@ -0,0 +1,149 @@
+'''
+Sales totals per seller, per product and per day.
+
+purchase_product adds every order to the SellerTotals, ProductTotals and
+DailySales tables in the transaction that records it, so the read functions
+here are a single primary key lookup instead of a GROUP BY over
+Transactions. rebuild_rollups recomputes the tables from Transactions, e.g.
+after they were added to a database that already had orders.
+'''
+from collections import Counter, namedtuple
+from datetime import timedelta
+
+from sqlalchemy import select
+
+from qbay.models import db, Transactions, SellerTotals, ProductTotals, \
+    DailySales, increment_totals
+from qbay.validation import parse_date
+
+# units: number of orders, revenue: sum of their prices
+SalesTotals = namedtuple('SalesTotals', ['units', 'revenue'])
+
+_NO_SALES = SalesTotals(0, 0)
+
+
+def _day(value):
+    value = parse_date(value)
+    return value.date() if hasattr(value, 'date') else value
+
+
+def _totals(model, key):
+    row = db.session.get(model, key)
+    return _NO_SALES if row is None else SalesTotals(row.units, row.revenue)
+
+
+def seller_totals(email):
+    '''
+    Orders placed on a seller's products
+      Parameters:
+        email (string): the seller's email
+      Returns:
+        SalesTotals (units, revenue), zero if the seller has sold nothing
+    '''
+    return _totals(SellerTotals, email)
+
+
+def product_totals(product_id):
+    '''
+    Orders placed on a product
+      Parameters:
+        product_id (int): the product's id
+      Returns:
+        SalesTotals (units, revenue), zero if it has never been sold
+    '''
+    return _totals(ProductTotals, product_id)
+
+
+def daily_sales(day):
+    '''
+    Orders placed on one day
+      Parameters:
+        day (date):  a date, datetime or 'YYYY-MM-DD' string
+      Returns:
+        SalesTotals (units, revenue), zero if nothing was sold that day
+    '''
+    return _totals(DailySales, _day(day))
+
+
+def sales_between(first, last):
+    '''
+    Orders per day from first to last, both included
+      Parameters:
+        first (date): first day, as in daily_sales
+        last (date):  last day, as in daily_sales
+      Returns:
+        A list of (day, SalesTotals), one per day, days without sales
+        included as zero
+    '''
+    first, last = _day(first), _day(last)
+    rows = DailySales.query.filter(DailySales.day >= first,
+                                   DailySales.day <= last).all()
+    found = {row.day: SalesTotals(row.units, row.revenue) for row in rows}
+    days = []
+    day = first
+    while day <= last:
+        days.append((day, found.get(day, _NO_SALES)))
+        day += timedelta(days=1)
+    return days
+
+
+def rebuild_rollups(chunk_size=1000, out=None):
+    '''
+    Recompute every rollup table from Transactions. Transactions are read
+    chunk_size rows at a time in id order and each chunk is added to the
+    tables as one increment per seller, product and day. Everything happens
+    in one database transaction, so readers see either the old or the new
+    totals.
+      Parameters:
+        chunk_size (int):  transactions read per query
+        out (callable):    where progress lines are written, if anywhere
+      Returns:
+        The number of transactions counted
+    '''
+    table = Transactions.__table__
+    query = select(table.c.id, table.c.seller, table.c.product_id,
+                   table.c.price, table.c.timestamp) \
+        .order_by(table.c.id).limit(chunk_size)
+
+    counted = 0
+    last_id = 0
+    try:
+        for model in (SellerTotals, ProductTotals, DailySales):
+            db.session.execute(model.__table__.delete())
+        while True:
+            rows = db.session.execute(
+                query.where(table.c.id > last_id)).fetchall()
+            if not rows:
+                break
+            sellers, products, days = Counter(), Counter(), Counter()
+            units = Counter()
+            for _id, seller, product_id, price, timestamp in rows:
+                sellers[seller] += price
+                units['s', seller] += 1
+                products[product_id] += price
+                units['p', product_id] += 1
+                # orders recorded before timestamps were set have no day
+                if timestamp is not None:
+                    days[timestamp.date()] += price
+                    units['d', timestamp.date()] += 1
+            for seller, revenue in sellers.items():
+                increment_totals(SellerTotals, {'seller': seller},
+                                 units=units['s', seller], revenue=revenue)
+            for product_id, revenue in products.items():
+                increment_totals(ProductTotals, {'product_id': product_id},
+                                 units=units['p', product_id],
+                                 revenue=revenue)
+            for day, revenue in days.items():
+                increment_totals(DailySales, {'day': day},
+                                 units=units['d', day], revenue=revenue)
+            counted += len(rows)
+            last_id = rows[-1][0]
+            if out is not None:
+                out('%d transactions counted' % counted)
+            if len(rows) < chunk_size:
+                break
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return counted
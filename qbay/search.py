@@ -0,0 +1,174 @@
+'''
+Ranked full-text search over product titles and descriptions.
+
+An in-memory inverted index maps each token to the products containing it.
+It is built from the database on the first search, in chunks, and kept
+current afterwards through qbay.models.product_listeners, so created and
+updated products are searchable as soon as they are committed.
+
+Queries match products containing every query token and rank them with
+BM25, counting title tokens TITLE_WEIGHT times.
+'''
+import heapq
+import math
+import re
+import threading
+from collections import Counter, namedtuple
+
+from qbay.models import Product, product_listeners
+
+TOKEN_RE = re.compile(r'\w+')
+TITLE_WEIGHT = 3
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+SearchHit = namedtuple('SearchHit', ['id', 'title', 'score'])
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """
+    An inverted index of products.
+    .........
+    Atributes
+    ---------
+    built : Boolean
+        Whether the index has been loaded from the database yet
+    """
+
+    def __init__(self):
+        self.built = False
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        # token -> {product id: weighted term frequency}
+        self._postings = {}
+        # product id -> (title, {token: weighted term frequency}, length)
+        self._docs = {}
+        self._total_length = 0
+
+    def add(self, product_id, title, desc):
+        '''
+        Index a product, replacing what was indexed for it before.
+        '''
+        terms = Counter(tokenize(desc))
+        for token in tokenize(title):
+            terms[token] += TITLE_WEIGHT
+        length = sum(terms.values())
+        with self._lock:
+            self._remove(product_id)
+            for token, tf in terms.items():
+                self._postings.setdefault(token, {})[product_id] = tf
+            self._docs[product_id] = (title, terms, length)
+            self._total_length += length
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+
+    def _remove(self, product_id):
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return
+        title, terms, length = doc
+        self._total_length -= length
+        for token in terms:
+            postings = self._postings[token]
+            del postings[product_id]
+            if not postings:
+                del self._postings[token]
+
+    def build(self, chunk_size=1000):
+        '''
+        (Re)load the whole index from the Product table, reading chunk_size
+        rows at a time.
+        '''
+        with self._lock:
+            self._clear()
+            last_id = 0
+            while True:
+                rows = Product.query.with_entities(
+                    Product.id, Product.title, Product.desc) \
+                    .filter(Product.id > last_id).order_by(Product.id) \
+                    .limit(chunk_size).all()
+                for product_id, title, desc in rows:
+                    self.add(product_id, title, desc)
+                if len(rows) < chunk_size:
+                    break
+                last_id = rows[-1][0]
+            self.built = True
+
+    def on_products_committed(self, written):
+        '''
+        product_listeners hook: reindex committed products. Until the index
+        is built there is nothing to update; build will read them.
+        '''
+        if not self.built:
+            return
+        for info in written.values():
+            self.add(info.id, info.title, info.desc)
+
+    def search(self, query, limit=10):
+        '''
+        Products containing every token of query, best match first
+          Parameters:
+            query (string): words to look for
+            limit (int):    most hits to return
+          Returns:
+            A list of SearchHit
+        '''
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        with self._lock:
+            if not self.built:
+                self.build()
+            postings = [self._postings.get(token) for token in tokens]
+            if not all(postings):
+                return []
+            # intersect starting from the rarest token
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for other in postings[1:]:
+                candidates.intersection_update(other)
+                if not candidates:
+                    return []
+
+            n = len(self._docs)
+            avg_length = self._total_length / n
+            idfs = [math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+                    for p in postings]
+
+            def score(product_id):
+                length = self._docs[product_id][2]
+                norm = K1 * (1 - B + B * length / avg_length)
+                return sum(idf * p[product_id] * (K1 + 1)
+                           / (p[product_id] + norm)
+                           for idf, p in zip(idfs, postings))
+
+            best = heapq.nlargest(limit, ((score(i), i) for i in candidates))
+            return [SearchHit(i, self._docs[i][0], s) for s, i in best]
+
+    def __len__(self):
+        return len(self._docs)
+
+
+product_index = SearchIndex()
+product_listeners.append(product_index.on_products_committed)
+
+
+def search_products(query, limit=10):
+    '''
+    Search product titles and descriptions
+      Parameters:
+        query (string): words to look for
+        limit (int):    most hits to return
+      Returns:
+        A list of SearchHit (id, title, score), best match first
+    '''
+    return product_index.search(query, limit)
@@ -0,0 +1,406 @@
+'''
+HTTP/JSON API over the model functions, for many concurrent clients.
+
+    POST /register        {"name", "email", "password"}
+    POST /login           {"email", "password"}
+    POST /logout          (authenticated)
+    POST /products        {"title", "description", "price", "date"}
+                          (authenticated)
+    PUT  /products/<id>   {"newTitle", "newDesc", "newPrice"}
+                          (authenticated, own products only)
+    GET  /products        ?page_size=&order_by=&min_price=&max_price=
+                           &owner_email=&after_id=&after_date=
+    POST /purchase        {"productTitle"} (authenticated)
+
+Request bodies hold the keyword arguments of the matching model function,
+as in qbay.batch. A successful login returns a "token"; the writes above
+need it in an "Authorization: Bearer <token>" header and act as the user
+who logged in: the owner of a new product and the buyer of a purchase are
+that user (an "owner_email" or "email" in the body must match it), and
+only the owner may update a product. Tokens live in the server's memory
+for token_ttl seconds, or until logout or restart. They are bearer
+secrets, so serve the API over TLS (e.g. behind a reverse proxy) when it
+is reachable by anyone but the local machine.
+
+POST /products and POST /purchase take an optional Idempotency-Key header
+(or "idempotency_key" field), so a client can retry them after a timeout
+without creating or ordering twice. Every response is {"ok": ...,
+"result": ...}; failures the model functions report (invalid input,
+unknown user, ...) are 422, a missing or expired token is 401 and acting
+for another user is 403.
+
+Connections are served by one asyncio event loop. The model functions are
+blocking SQLAlchemy code, so each call runs on a bounded thread pool with
+its own scoped session, removed after the call. When every worker is busy
+and queue_size calls are already waiting, new calls are refused with 503
+and Retry-After instead of queueing without limit. On SIGINT/SIGTERM the
+server stops accepting connections, closes idle keep-alive connections,
+lets the calls in progress finish (for up to grace seconds) and then exits.
+'''
+import asyncio
+import json
+import secrets
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs
+
+from sqlalchemy import exc
+
+from qbay.batch import to_json
+from qbay.models import db, register, login, create_product, \
+    update_product, purchase_product, browse_products, get_product, \
+    ProductInfo
+
+MAX_BODY = 1 << 20
+
+ROUTES = {
+    ('POST', '/register'): register,
+    ('POST', '/login'): login,
+    ('POST', '/products'): create_product,
+    ('POST', '/purchase'): purchase_product,
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _product_json(info):
+    product = info._asdict()
+    if product['last_modified_date'] is not None:
+        product['last_modified_date'] = \
+            product['last_modified_date'].isoformat()
+    return product
+
+
+def browse(page_size='20', order_by='id', min_price=None, max_price=None,
+           owner_email=None, after_id=None, after_date=None):
+    '''
+    GET /products: one page of browse_products, at most 100 products. The
+    query string values arrive as strings; the response's "next" holds the
+    after_id and after_date of the following page, or null on the last
+    page.
+    '''
+    page_size = min(int(page_size), 100)
+    after = None
+    if after_id is not None:
+        after = ProductInfo(int(after_id), None, None, None, None,
+                            after_date and datetime.fromisoformat(after_date))
+    pages = browse_products(
+        page_size=page_size, order_by=order_by,
+        min_price=None if min_price is None else float(min_price),
+        max_price=None if max_price is None else float(max_price),
+        owner_email=owner_email, after=after)
+    page = [_product_json(p) for p in next(pages, [])]
+    following = None
+    if len(page) == page_size:
+        following = {'after_id': page[-1]['id']}
+        if order_by == 'last_modified_date':
+            following['after_date'] = page[-1]['last_modified_date']
+    return {'products': page, 'next': following}
+
+
+def update_own_product(_owner, _id, **kwargs):
+    '''
+    PUT /products/<id>: update_product, for the product's owner only.
+    '''
+    product = get_product(product_id=_id)
+    if product is None:
+        raise HTTPError(404, 'no such product')
+    if product.owner_email != _owner:
+        raise HTTPError(403, 'not your product')
+    return update_product(_id, **kwargs)
+
+
+def _call(func, kwargs):
+    '''
+    Run one model function on a worker thread. Returns (ok, result) with
+    result already turned into JSON, since ORM objects cannot leave the
+    thread's session.
+    '''
+    try:
+        result = func(**kwargs)
+        if isinstance(result, exc.SQLAlchemyError):
+            raise result
+        if func is browse:
+            return True, result
+        ok = result is not None and result is not False \
+            and not isinstance(result, str)
+        return ok, to_json(result)
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.remove()
+
+
+class QbayServer:
+    """
+    The API server.
+    .........
+    Atributes
+    ---------
+    host : String
+        Address to listen on
+    port : Integer
+        Port to listen on, 0 picks a free one (see start)
+    workers : Integer
+        Threads running model functions
+    queue_size : Integer
+        Calls allowed to wait for a worker before new ones get 503
+    token_ttl : Float
+        Seconds a login token stays valid
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, workers=8,
+                 queue_size=256, backlog=1024, token_ttl=3600):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.backlog = backlog
+        self.token_ttl = token_ttl
+        # login token -> (email, expiry as time.monotonic())
+        self._tokens = {}
+        self._executor = None
+        self._server = None
+        self._pending = 0
+        self._closing = False
+        # connection task -> True while it waits for the next request
+        self._connections = {}
+
+    async def start(self):
+        '''
+        Start listening. Returns the port, useful when port was 0.
+        '''
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='qbay-api')
+        self._server = await asyncio.start_server(
+            self._serve_connection, self.host, self.port,
+            backlog=self.backlog)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def shutdown(self, grace=10):
+        '''
+        Stop accepting, close idle connections and wait up to grace seconds
+        for requests in progress before closing the rest.
+        '''
+        self._closing = True
+        self._server.close()
+        for task, idle in list(self._connections.items()):
+            if idle:
+                task.cancel()
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=grace)
+        for task in list(self._connections):
+            task.cancel()
+        # calls already on a worker cannot be interrupted, let them commit
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._executor.shutdown)
+
+    async def _serve_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = True
+        try:
+            while not self._closing:
+                self._connections[task] = True
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, HTTPStatus(431), {
+                        'ok': False, 'error': 'headers too large'}, False)
+                    break
+                self._connections[task] = False
+                keep_alive = await self._serve_request(head, reader, writer)
+                if not keep_alive:
+                    break
+        except asyncio.CancelledError:
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+    async def _serve_request(self, head, reader, writer):
+        '''
+        Answer one request. Returns whether the connection stays open.
+        '''
+        try:
+            request_line, *header_lines = \
+                head.decode('latin-1').split('\r\n')
+            method, target, version = request_line.split(' ')
+            headers = {}
+            for line in header_lines:
+                if line:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            await self._respond(writer, HTTPStatus.BAD_REQUEST, {
+                'ok': False, 'error': 'malformed request'}, False)
+            return False
+        if length > MAX_BODY:
+            await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                {'ok': False, 'error': 'body too large'},
+                                False)
+            return False
+        try:
+            body = await reader.readexactly(length)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return False
+
+        keep_alive = not self._closing and (
+            headers.get('connection', '').lower() != 'close'
+            if version == 'HTTP/1.1'
+            else headers.get('connection', '').lower() == 'keep-alive')
+        try:
+            status, payload = await self._dispatch(method, target, body,
+                                                   headers)
+        except HTTPError as e:
+            status, payload = HTTPStatus(e.status), {
+                'ok': False, 'error': str(e)}
+        except Exception as e:
+            # e.g. a model function failing on a row that does not exist
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {
+                'ok': False, 'error': type(e).__name__}
+        await self._respond(writer, status, payload, keep_alive)
+        return keep_alive
+
+    def _issue_token(self, email):
+        now = time.monotonic()
+        for token, (_, expires) in list(self._tokens.items()):
+            if expires <= now:
+                del self._tokens[token]
+        token = secrets.token_urlsafe(32)
+        self._tokens[token] = (email, now + self.token_ttl)
+        return token
+
+    def _identity(self, headers):
+        '''
+        The email of the user whose token authorizes the request.
+        '''
+        scheme, _, token = headers.get('authorization', '').partition(' ')
+        entry = self._tokens.get(token.strip()) \
+            if scheme.lower() == 'bearer' else None
+        if entry is None or entry[1] <= time.monotonic():
+            raise HTTPError(401, 'log in and send the token as '
+                                 '"Authorization: Bearer <token>"')
+        return entry[0]
+
+    @staticmethod
+    def _act_as(kwargs, field, email):
+        if kwargs.setdefault(field, email) != email:
+            raise HTTPError(403, '%s must be the logged in user' % field)
+
+    async def _dispatch(self, method, target, body, headers):
+        url = urlsplit(target)
+        if method == 'GET' and url.path == '/products':
+            func = browse
+            kwargs = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        else:
+            kwargs = self._json_body(body)
+            parts = url.path.rstrip('/').split('/')
+            if len(parts) == 3 and parts[1] == 'products' \
+                    and parts[2].isdigit():
+                if method != 'PUT':
+                    raise HTTPError(405, 'use PUT to update a product')
+                func = update_own_product
+                kwargs['_owner'] = self._identity(headers)
+                kwargs['_id'] = int(parts[2])
+            elif (method, url.path) == ('POST', '/logout'):
+                self._identity(headers)
+                token = headers['authorization'].partition(' ')[2].strip()
+                del self._tokens[token]
+                return HTTPStatus.OK, {'ok': True, 'result': True}
+            elif (method, url.path) in ROUTES:
+                func = ROUTES[method, url.path]
+                if func is create_product:
+                    self._act_as(kwargs, 'owner_email',
+                                 self._identity(headers))
+                    kwargs.setdefault('date', None)
+                elif func is purchase_product:
+                    self._act_as(kwargs, 'email', self._identity(headers))
+                idempotency_key = headers.get('idempotency-key')
+                if func in (create_product, purchase_product) \
+                        and idempotency_key is not None:
+                    kwargs['idempotency_key'] = idempotency_key
+            elif url.path == '/logout' \
+                    or any(path == url.path for _, path in ROUTES):
+                raise HTTPError(405, 'method not allowed')
+            else:
+                raise HTTPError(404, 'no such endpoint')
+
+        # backpressure: refuse instead of queueing without bound
+        if self._pending >= self.workers + self.queue_size:
+            raise HTTPError(503, 'server busy, retry later')
+        self._pending += 1
+        try:
+            ok, result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _call, func, kwargs)
+        except (TypeError, ValueError) as e:
+            raise HTTPError(400, '%s: %s' % (type(e).__name__, e))
+        except exc.SQLAlchemyError as e:
+            raise HTTPError(500, type(e).__name__)
+        finally:
+            self._pending -= 1
+        if func is browse:
+            return HTTPStatus.OK, dict(result, ok=True)
+        payload = {'ok': ok, 'result': result}
+        if ok and func is login:
+            payload['token'] = self._issue_token(result['email'])
+        return (HTTPStatus.OK if ok else HTTPStatus.UNPROCESSABLE_ENTITY,
+                payload)
+
+    @staticmethod
+    def _json_body(body):
+        try:
+            kwargs = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(400, 'body is not JSON')
+        if not isinstance(kwargs, dict):
+            raise HTTPError(400, 'body must be a JSON object')
+        return kwargs
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        head = ['HTTP/1.1 %d %s' % (status, status.phrase),
+                'Content-Type: application/json',
+                'Content-Length: %d' % len(body),
+                'Connection: %s' % ('keep-alive' if keep_alive else 'close')]
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            head.append('Retry-After: 1')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1')
+                     + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+def serve(host='127.0.0.1', port=8080, workers=8, queue_size=256,
+          grace=10):
+    '''
+    Run the API server until SIGINT or SIGTERM, then shut down gracefully.
+    '''
+    async def main():
+        server = QbayServer(host, port, workers, queue_size)
+        await server.start()
+        print('serving on http://%s:%d' % (host, server.port),
+              file=sys.stderr)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        print('shutting down', file=sys.stderr)
+        await server.shutdown(grace)
+
+    asyncio.run(main())
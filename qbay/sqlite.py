@@ -0,0 +1,59 @@
+'''
+SQLite tuning profiles, selected with QBAY_SQLITE_PROFILE.
+
+'default' leaves SQLite as it comes: a rollback journal, synchronous=FULL
+(an fsync on every commit), no memory mapping, a small page cache and
+"database is locked" as soon as two writers meet. 'tuned' sets, on every
+new connection:
+
+    journal_mode=WAL        readers no longer block the writer or each other
+    synchronous=NORMAL      WAL is synced at checkpoints, not every commit;
+                            a power loss may drop the last commits but
+                            never corrupts the database
+    mmap_size=256 MiB       reads come from the page cache of the OS
+    cache_size=64 MiB       per connection page cache
+    busy_timeout=10 s       writers wait for the lock instead of failing
+    temp_store=MEMORY       temporary tables and indexes stay in memory
+
+and the engine keeps its connections in a pool (see qbay/__init__.py), so
+the page cache and memory map outlive a single operation.
+'''
+from sqlalchemy import event
+
+PROFILES = {
+    'default': {},
+    'tuned': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        # negative: size in KiB rather than pages
+        'cache_size': -64 * 1024,
+        'busy_timeout': 10000,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def check_profile(name):
+    if name not in PROFILES:
+        raise ValueError('unknown SQLite profile %r, expected one of %s'
+                         % (name, ', '.join(PROFILES)))
+    return name
+
+
+def apply_profile(engine, name):
+    '''
+    Run the pragmas of profile name on every new connection of engine.
+    '''
+    pragmas = PROFILES[check_profile(name)]
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas.items():
+                cursor.execute('PRAGMA %s = %s' % (pragma, value))
+        finally:
+            cursor.close()
@@ -0,0 +1,268 @@
+'''
+Input rules shared by the model functions.
+
+Every check returns None when the input is valid, otherwise the id of the
+requirement that failed (e.g. 'R1-4'), so callers can either turn it into
+True/False or report it. Patterns are compiled once at import.
+'''
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from email_validator import validate_email, EmailNotValidError
+
+from qbay import app
+from qbay.cache import LRUCache
+
+
+SPECIAL_CHARS = frozenset('!@#$%&*?')
+EMAIL_RE = re.compile(
+    r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+# alphanumeric and spaces, used for user names and product titles
+NAME_RE = re.compile(r'^[ \w]+$')
+POSTAL_CODE_RE = re.compile(r'[A-Za-z][0-9][A-Za-z] [0-9][A-Za-z][0-9]')
+
+MIN_DATE = datetime(2021, 1, 2)
+MAX_DATE = datetime(2025, 1, 2)
+
+
+# Normalized form of each recently checked email, or False if invalid.
+# Shared by login and register.
+email_cache = LRUCache(maxsize=app.config['QBAY_EMAIL_CACHE_SIZE'])
+
+_deliverability_pool = None
+
+
+def _check_deliverability(email):
+    '''
+    Background DNS check for the 'async' mode; caches undeliverable
+    addresses as invalid.
+    '''
+    try:
+        validate_email(email, check_deliverability=True)
+    except EmailNotValidError:
+        email_cache.put(email, False)
+
+
+def check_email(email):
+    '''
+    R1-3: the email follows addr-spec defined in RFC 5322. Whether its
+    domain is also looked up depends on QBAY_EMAIL_DELIVERABILITY.
+      Returns:
+        The normalized email, or None if it is not valid
+    '''
+    global _deliverability_pool
+    cached = email_cache.get(email)
+    if cached is not None:
+        return cached or None
+
+    mode = app.config['QBAY_EMAIL_DELIVERABILITY']
+    try:
+        normalized = validate_email(
+            email, check_deliverability=(mode == 'sync')).normalized
+    except EmailNotValidError:
+        email_cache.put(email, False)
+        return None
+    email_cache.put(email, normalized)
+
+    if mode == 'async':
+        if _deliverability_pool is None:
+            _deliverability_pool = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix='qbay-email')
+        _deliverability_pool.submit(_check_deliverability, email)
+    return normalized
+
+
+def password_ok(password):
+    '''
+    R1-4: at least 6 characters with an upper case letter, a lower case
+    letter, a digit and one of SPECIAL_CHARS. The password is scanned once.
+    '''
+    if len(password) < 6:
+        return False
+    upper = lower = digit = special = False
+    for c in password:
+        if c.isdigit():
+            digit = True
+        elif c.isupper():
+            upper = True
+        elif c.islower():
+            lower = True
+        elif c in SPECIAL_CHARS:
+            special = True
+    return upper and lower and digit and special
+
+
+def name_ok(name):
+    '''
+    Non-empty, alphanumeric-only, and spaces allowed only if they are not
+    the prefix or suffix. Used for user names (R1-5) and titles (R4-1).
+    '''
+    return bool(name) and NAME_RE.match(name) is not None \
+        and name.strip() == name
+
+
+def parse_date(date):
+    '''
+    Turn a 'YYYY-MM-DD' string into a datetime, other values are returned
+    unchanged. Returns None if the string is not a date.
+    '''
+    if isinstance(date, str):
+        try:
+            year, month, day = map(int, date.split('-'))
+            return datetime(year, month, day)
+        except ValueError:
+            return None
+    return date
+
+
+def validate_registration(name, email, password):
+    '''
+    R1-1, R1-3 to R1-6. R1-7 (unique email) needs the database and is
+    checked by the caller.
+    '''
+    # R1-1: Both the email and password cannot be empty
+    if not email or not password:
+        return 'R1-1'
+    # R1-3: The email has to follow addr-spec defined in RFC 5322
+    if EMAIL_RE.fullmatch(email) is None or check_email(email) is None:
+        return 'R1-3'
+    # R1-4: Password has to meet the required complexity
+    if not password_ok(password):
+        return 'R1-4'
+    # R1-5: User name rules
+    if not name_ok(name):
+        return 'R1-5'
+    # R1-6: User name size
+    if len(name) <= 2 or len(name) > 20:
+        return 'R1-6'
+    return None
+
+
+def validate_login(email, password):
+    '''
+    R1-1, R1-3 and R1-4 as applied to a login attempt.
+    '''
+    # R1-1: email and password are not empty
+    if not email or not password:
+        return 'R1-1'
+    # R1-3: email follows addr-spec define in RFC 5322
+    if check_email(email) is None:
+        return 'R1-3'
+    # R1-4: password meets the required complexity
+    if not password_ok(str(password)):
+        return 'R1-4'
+    return None
+
+
+def validate_user_update(new_username, new_shipping_address,
+                         new_postal_code):
+    '''
+    R3-2 to R3-4. A username of the wrong length fails R1-6, the size
+    rule R3-4 refers to.
+    '''
+    # R3-2 Shipping address should be non-empty and alphanumeric-only
+    if not new_shipping_address or any(
+            not c.isalnum() and not c.isspace()
+            for c in new_shipping_address):
+        return 'R3-2'
+    # R3-3 Ensure it's a valid Canadian Postal Code
+    if POSTAL_CODE_RE.fullmatch(new_postal_code) is None:
+        return 'R3-3'
+    # R3-4 Username follows the R1-5 and R1-6 rules
+    if not name_ok(new_username):
+        return 'R3-4'
+    if len(new_username) <= 2 or len(new_username) > 20:
+        return 'R1-6'
+    return None
+
+
+def validate_product(title, description, price, date=None):
+    '''
+    R4-1 to R4-6. date may be a datetime or a 'YYYY-MM-DD' string and is
+    not checked when it is None. R4-7 and R4-8 need the database and are
+    checked by the caller.
+    '''
+    # R4-1: The title of the product has to be alphanumeric-only, and space
+    # allowed only if it is not as prefix and suffix.
+    if not isinstance(title, str) or not name_ok(title):
+        return 'R4-1'
+    # R4-2: The title of the product is no longer than 80 characters.
+    if len(title) > 80:
+        return 'R4-2'
+    # R4-3: The description has a length between 20 and 2000 characters.
+    if not isinstance(description, str) \
+            or not 20 <= len(description) <= 2000:
+        return 'R4-3'
+    # R4-4: Description has to be longer than the product's title.
+    if len(title) >= len(description):
+        return 'R4-4'
+    # R4-5: Price has to be of range [10, 10000].
+    if not isinstance(price, (int, float)) or not 10 < price < 10000:
+        return 'R4-5'
+    # R4-6: last_modified_date must be after 2021-01-02 and before 2025-01-02
+    if date is not None:
+        date = parse_date(date)
+        if date is None or date < MIN_DATE or date > MAX_DATE:
+            return 'R4-6'
+    return None
+
+
+def validate_review(rating, subject, content):
+    '''
+    R6-1 to R6-3. R6-4 (the product and the poster exist) needs the
+    database and is checked by the caller.
+    '''
+    # R6-1: The rating is a whole number from 1 to 5.
+    if not isinstance(rating, int) or isinstance(rating, bool) \
+            or not 1 <= rating <= 5:
+        return 'R6-1'
+    # R6-2: The subject is between 1 and 100 characters.
+    if not isinstance(subject, str) or not subject.strip() \
+            or len(subject) > 100:
+        return 'R6-2'
+    # R6-3: The content is between 1 and 255 characters.
+    if not isinstance(content, str) or not content.strip() \
+            or len(content) > 255:
+        return 'R6-3'
+    return None
+
+
+# Outcome of one record checked by validate_batch. reason is 'ok' when the
+# record passed, otherwise the id of the requirement that failed.
+ValidationResult = namedtuple('ValidationResult', ['index', 'reason'])
+
+_VALIDATORS = {
+    'register': validate_registration,
+    'login': validate_login,
+    'user_update': validate_user_update,
+    'product': validate_product,
+    'review': validate_review,
+}
+
+
+def validate_batch(kind, records):
+    '''
+    Check many records with the same rules in one call
+      Parameters:
+        kind (string):      'register', 'login', 'user_update', 'product'
+                            or 'review'
+        records (iterable): tuples of positional arguments or dicts of
+                            keyword arguments for the matching validator
+      Returns:
+        A list of ValidationResult, one per record and in input order
+    '''
+    try:
+        check = _VALIDATORS[kind]
+    except KeyError:
+        raise ValueError('unknown record kind: %r' % (kind,))
+
+    results = []
+    for index, record in enumerate(records):
+        if isinstance(record, dict):
+            reason = check(**record)
+        else:
+            reason = check(*record)
+        results.append(ValidationResult(index, reason or 'ok'))
+    return results
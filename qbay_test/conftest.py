@@ -1,9 +1,75 @@
 import os
 
+import pytest
+
 '''
 This file defines what to do BEFORE running any test cases:
 '''
 
+# Keep password hashing cheap in tests; the frontend tests' subprocesses
+# inherit it too.
+os.environ.setdefault('QBAY_PASSWORD_ITERATIONS', '1000')
+
+
+# Most SQL statements each model function may execute, with cold caches.
+# Raise a budget only together with the change that needs the extra round
+# trip; a loop of queries (N+1) shows up as a failure here.
+QUERY_BUDGETS = {
+    # email lookup, insert
+    'register': 2,
+    # per chunk: one IN query for existing emails, one executemany insert
+    'register_many': 2,
+    # user lookup, rehash update
+    'login': 2,
+    # user lookup, update
+    'user_update': 2,
+    # owner lookup, title lookup, insert
+    'create_product': 3,
+    # product lookup, new title lookup, update
+    'update_product': 3,
+    # product lookup, product lock, buyer and seller lock, debit, credit,
+    # three rollup upserts, transaction insert
+    'purchase_product': 9,
+    'get_product': 1,
+    # product lookup, poster lookup, insert, rating upsert
+    'create_review': 4,
+}
+
+
+@pytest.fixture
+def query_budget():
+    '''
+    query_budget(func, *args, **kwargs) calls a model function with empty
+    caches, fails the test if it executes more statements than its
+    QUERY_BUDGETS entry, and returns what the function returned.
+    '''
+    from sqlalchemy import event
+    from qbay.models import db, init_db, product_cache
+
+    init_db()
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def call(func, *args, **kwargs):
+        product_cache.clear()
+        db.session.remove()
+        statements.clear()
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        budget = QUERY_BUDGETS[func.__name__]
+        assert len(statements) <= budget, \
+            '%s ran %d statements, its budget is %d:\n%s' % (
+                func.__name__, len(statements), budget,
+                '\n'.join(statements))
+        return result
+
+    return call
+
 
 def pytest_sessionstart():
     '''
@@ -0,0 +1,38 @@
+import io
+import json
+
+from qbay.batch import run_batch
+from qbay.models import User, Product
+
+
+def test_run_batch():
+    '''
+    Testing batch mode: one result line per operation, in order, with the
+    writes committed across chunks.
+    '''
+    operations = [
+        {'op': 'register', 'args': {'name': 'u batch 0',
+                                    'email': 'testbatch0@test.com',
+                                    'password': '123aBc!'}},
+        {'op': 'register', 'args': {'name': 'u batch 0',
+                                    'email': 'testbatch0@test.com',
+                                    'password': '123aBc!'}},
+        {'op': 'create_product', 'args': {
+            'title': 'batch product 0', 'description': 'd' * 30,
+            'price': 50, 'date': '2022-02-02',
+            'owner_email': 'testbatch0@test.com'}},
+        {'op': 'no_such_op'},
+        {'op': 'register', 'args': {'name': 'u batch 1'}},
+    ]
+    lines = [json.dumps(op) for op in operations] + ['', 'not json']
+    out = io.StringIO()
+
+    stats = run_batch(lines, out, chunk_size=2)
+
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r['line'] for r in results] == [1, 2, 3, 4, 5, 7]
+    assert [r['ok'] for r in results] == [True, False, True, False, False,
+                                          False]
+    assert stats == {'operations': 6, 'ok': 2, 'failed': 4}
+    assert User.query.filter_by(email='testbatch0@test.com').count() == 1
+    assert Product.query.filter_by(title='batch product 0').count() == 1
@@ -0,0 +1,27 @@
+import pytest
+
+from qbay.bench import run, parse_mix
+
+
+def test_parse_mix():
+    assert parse_mix('login=3, purchase') == {'login': 3, 'purchase': 1}
+    with pytest.raises(ValueError):
+        parse_mix('delete=1')
+
+
+def test_bench_report():
+    '''
+    Testing a small in-process run: every operation of the mix is reported
+    with its counts and latency percentiles.
+    '''
+    config = {'mix': parse_mix('register=1,login=1,user_update=1,'
+                               'create_product=1,update_product=1,'
+                               'purchase=1'),
+              'ops': 30, 'threads': 2, 'processes': 1, 'users': 4,
+              'products': 2, 'seed': 0, 'database': 'test', 'run': 'test'}
+    result = run(config)
+    assert result['total']['count'] == 60
+    assert set(result['operations']) == set(config['mix'])
+    for stats in result['operations'].values():
+        assert stats['ok'] == stats['count']
+        assert 0 <= stats['p50_ms'] <= stats['p95_ms'] <= stats['p99_ms']
@@ -0,0 +1,111 @@
+import io
+
+import pytest
+from sqlalchemy import event
+
+from qbay import app
+from qbay.bloom import BloomFilter, email_filter, title_filter, filter_stats
+from qbay.models import db, register, create_product, update_product, \
+    Product
+
+
+def test_bloom_filter():
+    '''
+    Testing that a Bloom filter has no false negatives, about its target
+    rate of false positives, and survives a save and load.
+    '''
+    bloom = BloomFilter(1000, 0.01)
+    for i in range(1000):
+        bloom.add('member %d' % i)
+    assert all('member %d' % i in bloom for i in range(1000))
+    false_positives = sum('stranger %d' % i in bloom for i in range(10000))
+    assert false_positives < 300
+    assert 0 < bloom.fill_ratio() ** bloom.hashes < 0.03
+
+    f = io.BytesIO()
+    bloom.save(f, name='test')
+    f.seek(0)
+    loaded, header = BloomFilter.load(f)
+    assert header['name'] == 'test' and loaded.items == 1000
+    assert all('member %d' % i in loaded for i in range(1000))
+
+
+@pytest.fixture
+def filters_on(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'QBAY_BLOOM_FILTERS', 'on')
+    monkeypatch.setitem(app.config, 'QBAY_BLOOM_SNAPSHOT_DIR', str(tmp_path))
+    for existence_filter in (email_filter, title_filter):
+        existence_filter.build(use_snapshot=False)
+        existence_filter.reset_stats()
+
+
+def count_statements(func, *args):
+    statements = []
+
+    def record(*event_args):
+        statements.append(event_args[2])
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        return func(*args), len(statements)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def test_filters_skip_lookups(filters_on):
+    '''
+    Testing that new emails and titles skip the uniqueness query, and that
+    taken ones are still refused (R1-7, R4-8).
+    '''
+    assert count_statements(register, 'u bloom 0', 'testbloom0@test.com',
+                            '123aBc!') == (True, 1)
+    assert count_statements(register, 'u bloom 0', 'testbloom0@test.com',
+                            '123aBc!') == (False, 1)
+    assert create_product('bloom product', 'a product behind a filter', 20,
+                          '2022-01-01', 'testbloom0@test.com') is True
+    assert create_product('bloom product', 'a product behind a filter', 20,
+                          '2022-01-01', 'testbloom0@test.com') is False
+
+    stats = filter_stats()
+    assert stats['email']['lookups_skipped'] == 1
+    assert stats['email']['lookups'] == 1
+    assert stats['email']['false_positives'] == 0
+    assert stats['title']['lookups_skipped'] == 1
+    assert stats['title']['memory_bytes'] > 0
+    assert stats['title']['items'] >= 1
+
+
+def test_filter_snapshot(filters_on, tmp_path):
+    '''
+    Testing that a filter loaded from a snapshot catches up with the
+    products created after it was taken.
+    '''
+    title_filter.snapshot()
+    assert (tmp_path / 'title.bloom').exists()
+    # written by another process: the filter in this one never saw it
+    db.session.add(Product(title='bloom late product', price=20,
+                           desc='created after the snapshot',
+                           owner_email='testbloom0@test.com'))
+    db.session.commit()
+    title_filter.build()
+    assert create_product('bloom late product', 'created after the snapshot',
+                          20, '2022-01-01', 'testbloom0@test.com') is False
+    assert title_filter.stats()['false_positives'] == 0
+
+
+def test_update_title_race(filters_on):
+    '''
+    Testing that renaming a product to a title another process took, which
+    the filter has not seen, returns False (R4-8) and leaves the session
+    usable.
+    '''
+    db.session.add(Product(title='bloom other process', price=20,
+                           desc='inserted behind the filter',
+                           owner_email='testbloom0@test.com'))
+    db.session.commit()
+    product = Product.query.filter_by(title='bloom late product').one()
+    assert update_product(product.id, newTitle='bloom other process',
+                          newDesc='created after the snapshot',
+                          newPrice=20) is False
+    assert create_product('bloom next product', 'the session still works',
+                          20, '2022-01-01', 'testbloom0@test.com') is True
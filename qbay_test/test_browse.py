@@ -0,0 +1,36 @@
+from qbay.models import register, create_product, browse_products
+
+
+def test_browse_products_keyset_pages():
+    '''
+    Testing that browsing yields every matching product exactly once, in
+    order, a page at a time.
+    '''
+    register('u browse 0', 'testbrowse0@test.com', '123aBc!')
+    dates = ['2022-05-03', '2022-05-01', '2022-05-02', '2022-05-01',
+             '2022-05-04']
+    for i, date in enumerate(dates):
+        create_product('browse product %d' % i, 'a product to browse by',
+                       20 + i * 10, date, 'testbrowse0@test.com')
+
+    pages = list(browse_products(page_size=2,
+                                 owner_email='testbrowse0@test.com'))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    ids = [p.id for page in pages for p in page]
+    assert ids == sorted(ids)
+
+    by_date = [p.title[-1] for page in browse_products(
+        page_size=2, order_by='last_modified_date',
+        owner_email='testbrowse0@test.com') for p in page]
+    assert by_date == ['1', '3', '2', '0', '4']
+
+    priced = [p.price for page in browse_products(
+        page_size=10, min_price=30, max_price=50,
+        owner_email='testbrowse0@test.com') for p in page]
+    assert priced == [30, 40, 50]
+
+    pages = browse_products(page_size=2, owner_email='testbrowse0@test.com')
+    first = next(pages)
+    resumed = next(browse_products(page_size=2, after=first[-1],
+                                   owner_email='testbrowse0@test.com'))
+    assert resumed == next(pages)
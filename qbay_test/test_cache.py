@@ -0,0 +1,55 @@
+from qbay.cache import LRUCache
+from qbay.models import register, create_product, update_product, \
+    get_product, product_cache
+
+
+def test_lru_eviction_and_ttl():
+    '''
+    Testing LRUCache: least recently used entries are evicted first and
+    entries expire after ttl seconds.
+    '''
+    now = [0.0]
+    cache = LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)  # evicts b, the least recently used
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    now[0] = 11
+    assert cache.get('a') is None
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 2
+    # pop returns the value and counts neither a hit nor a miss
+    cache.put('d', 4)
+    assert cache.pop('d') == 4
+    assert cache.pop('d') is None
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['misses'] == 2
+
+
+def test_product_cache_invalidation():
+    '''
+    Testing that product lookups are served from the cache and that
+    update_product invalidates both the id and the title entries.
+    '''
+    register('u cache 0', 'testcache0@test.com', '123aBc!')
+    assert create_product('cache product 0', 'd' * 30, 40, '2022-01-01',
+                          'testcache0@test.com') is True
+
+    product = get_product(title='cache product 0')
+    hits = product_cache.hits
+    assert get_product(title='cache product 0') == product
+    assert get_product(product_id=product.id) == product
+    assert product_cache.hits == hits + 2
+
+    hits, misses = product_cache.hits, product_cache.misses
+    assert update_product(product.id, newPrice=50,
+                          newTitle='cache product 1',
+                          newDesc='d' * 30) is True
+    # only the check that the new title is free looked anything up;
+    # invalidating the entries did not count as hits or misses
+    assert (product_cache.hits, product_cache.misses) == (hits, misses + 1)
+    assert get_product(title='cache product 0') is None
+    assert get_product(product_id=product.id).price == 50
+    assert get_product(title='cache product 1').id == product.id
@@ -0,0 +1,49 @@
+from qbay.cli import UserSession, update_user_page, place_order_page
+from qbay.models import register, create_product, User
+
+
+def answer(monkeypatch, *answers):
+    '''
+    Feed the given answers to the CLI's input() calls, in order.
+    '''
+    replies = iter(answers)
+    monkeypatch.setattr('builtins.input', lambda prompt='': next(replies))
+
+
+def test_pages_use_session(monkeypatch):
+    '''
+    Testing that the pages act for the logged in user without asking for
+    a username, and that the session is refreshed after a write.
+    '''
+    register('u cli 0', 'testcli0@test.com', '123aBc!')
+    register('u cli 1', 'testcli1@test.com', '123aBc!')
+    create_product('cli product 0', 'a product for the cli test', 20,
+                   '2022-01-01', 'testcli1@test.com')
+    session = UserSession(
+        User.query.filter_by(email='testcli0@test.com').first())
+
+    answer(monkeypatch, '1', 'u cli 2')
+    update_user_page(session)
+    assert session.username == 'u cli 2'
+    assert session.shipping_addr == '104 Park St'
+
+    answer(monkeypatch, 'cli product 0', '1', '')
+    place_order_page(session)
+    assert session.balance == 80
+
+
+def test_update_page_uses_session_email(monkeypatch):
+    '''
+    Testing that the update page changes the logged in user even when
+    another user has the same username.
+    '''
+    register('u cli same', 'testclisame0@test.com', '123aBc!')
+    register('u cli same', 'testclisame1@test.com', '123aBc!')
+    session = UserSession(
+        User.query.filter_by(email='testclisame1@test.com').first())
+
+    answer(monkeypatch, '2', '9 Second St')
+    update_user_page(session)
+    assert session.shipping_addr == '9 Second St'
+    assert User.query.filter_by(
+        email='testclisame0@test.com').first().shipping_addr != '9 Second St'
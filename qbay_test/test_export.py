@@ -0,0 +1,136 @@
+import csv
+import gzip
+import json
+import os
+from datetime import datetime
+
+from qbay.export import export_transactions, iter_transactions
+from qbay.models import register, create_product, purchase_product
+
+
+def make_transactions():
+    register('u export 0', 'testexport0@test.com', '123aBc!')
+    register('u export 1', 'testexport1@test.com', '123aBc!')
+    create_product('export product', 'a product to export sales of', 11,
+                   '2022-01-01', 'testexport0@test.com')
+    for _ in range(5):
+        assert purchase_product('export product',
+                                'testexport1@test.com') is True
+
+
+def test_export_csv_and_resume(tmp_path):
+    '''
+    Testing CSV export, and that a resumed export continues after the
+    checkpointed id without repeating the header or any row.
+    '''
+    make_transactions()
+    out = str(tmp_path / 'tx.csv')
+    ids = [row[0] for rows in iter_transactions() for row in rows]
+
+    stats = export_transactions(out, 'csv', chunk_size=2)
+    assert stats == {'rows': len(ids), 'last_id': ids[-1]}
+    with open(out) as f:
+        rows = list(csv.reader(f))
+    assert rows[0][0] == 'id'
+    assert [int(r[0]) for r in rows[1:]] == ids
+
+    # pretend the export stopped after the first two rows
+    with open(out, 'w', newline='') as f:
+        csv.writer(f).writerows(rows[:3])
+    with open(out + '.checkpoint', 'w') as f:
+        f.write(str(ids[1]))
+    stats = export_transactions(out, 'csv', resume=True, chunk_size=2)
+    assert stats['rows'] == len(ids) - 2
+    with open(out) as f:
+        assert list(csv.reader(f)) == rows
+
+
+def test_export_jsonl_gzip_filters(tmp_path):
+    '''
+    Testing gzipped JSONL export with a time window that excludes
+    everything.
+    '''
+    out = str(tmp_path / 'tx.jsonl.gz')
+    export_transactions(out, 'jsonl', compress=True)
+    with gzip.open(out, 'rt') as f:
+        records = [json.loads(line) for line in f]
+    assert records and records[0]['buyer']
+    assert records[0]['timestamp'] is not None
+
+    stats = export_transactions(str(tmp_path / 'none.jsonl'), 'jsonl',
+                                until=datetime(2000, 1, 1))
+    assert stats['rows'] == 0
+
+
+def test_export_resume_after_crash(tmp_path, monkeypatch):
+    '''
+    Testing that resuming cuts off what a crashed run wrote after its last
+    checkpoint, for plain and gzipped output.
+    '''
+    from qbay import export
+
+    write_checkpoint = export._write_checkpoint
+    for name, fmt, compress in (('crash.csv', 'csv', False),
+                                ('crash.jsonl.gz', 'jsonl', True)):
+        out = str(tmp_path / name)
+        opener = gzip.open if compress else open
+        export_transactions(out, fmt, compress=compress, chunk_size=2)
+        with opener(out, 'rt') as f:
+            complete = f.read()
+
+        # the run dies after writing its third chunk, before checkpointing
+        # it, leaving part of a row (or gzip member) behind
+        calls = []
+
+        def dying_checkpoint(path, last_id, offset):
+            calls.append(last_id)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            write_checkpoint(path, last_id, offset)
+
+        monkeypatch.setattr(export, '_write_checkpoint', dying_checkpoint)
+        try:
+            export_transactions(out, fmt, compress=compress, chunk_size=2)
+        except KeyboardInterrupt:
+            pass
+        monkeypatch.setattr(export, '_write_checkpoint', write_checkpoint)
+        with open(out, 'ab') as f:
+            f.write(b'\x1f\x8b\x08\x00torn' if compress else b'9,half a ro')
+
+        export_transactions(out, fmt, compress=compress, resume=True,
+                            chunk_size=2)
+        with opener(out, 'rt') as f:
+            assert f.read() == complete
+
+
+def test_export_resume_after_id(tmp_path):
+    '''
+    Testing that --resume with an --after-id past the checkpoint, or with
+    no checkpoint, appends to the output instead of cutting it back.
+    '''
+    from qbay.export import _write_checkpoint
+
+    out = str(tmp_path / 'after.csv')
+    ids = [row[0] for rows in iter_transactions() for row in rows]
+    export_transactions(out, 'csv', chunk_size=2)
+    with open(out) as f:
+        rows = list(csv.reader(f))
+
+    # no checkpoint
+    os.remove(out + '.checkpoint')
+    with open(out, 'w', newline='') as f:
+        csv.writer(f).writerows(rows[:3])
+    stats = export_transactions(out, 'csv', resume=True, after_id=ids[1],
+                                chunk_size=2)
+    assert stats['rows'] == len(ids) - 2
+    with open(out) as f:
+        assert list(csv.reader(f)) == rows
+
+    # a checkpoint older than after_id
+    with open(out, 'w', newline='') as f:
+        csv.writer(f).writerows(rows[:4])
+    _write_checkpoint(out + '.checkpoint', ids[0], 10)
+    export_transactions(out, 'csv', resume=True, after_id=ids[2],
+                        chunk_size=2)
+    with open(out) as f:
+        assert list(csv.reader(f)) == rows
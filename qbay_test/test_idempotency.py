@@ -0,0 +1,178 @@
+import threading
+from datetime import datetime, timedelta
+
+from qbay.models import db, register, create_product, purchase_product, \
+    purge_idempotency_keys, User, Product, Transactions, IdempotencyKeys, \
+    KEY_REUSED
+
+
+def setup_users():
+    register('u idem 0', 'testidem0@test.com', '123aBc!')
+    register('u idem 1', 'testidem1@test.com', '123aBc!')
+    User.query.filter_by(email='testidem1@test.com') \
+        .update({User.balance: 10 ** 6})
+    db.session.commit()
+
+
+def orders(buyer='testidem1@test.com'):
+    return Transactions.query.filter_by(buyer=buyer).count()
+
+
+def test_repeated_keys():
+    '''
+    Testing that a retried purchase or product creation returns the first
+    result without repeating its writes.
+    '''
+    setup_users()
+    assert create_product('idempotent product', 'a product made only once',
+                          20, '2022-01-01', 'testidem0@test.com',
+                          idempotency_key='create-1') is True
+    # the retry finds the key, not the duplicate title
+    assert create_product('idempotent product', 'a product made only once',
+                          20, '2022-01-01', 'testidem0@test.com',
+                          idempotency_key='create-1') is True
+    assert Product.query.filter_by(title='idempotent product').count() == 1
+
+    for _ in range(3):
+        assert purchase_product('idempotent product', 'testidem1@test.com',
+                                idempotency_key='order-1') is True
+    assert orders() == 1
+    assert purchase_product('idempotent product', 'testidem1@test.com',
+                            idempotency_key='order-2') is True
+    assert orders() == 2
+    # keys are per operation
+    assert create_product('idempotent product 2', 'another product made once',
+                          20, '2022-01-01', 'testidem0@test.com',
+                          idempotency_key='order-1') is True
+
+
+def test_failures_not_remembered():
+    '''
+    Testing that a refused purchase keeps no key, so its retry can succeed.
+    '''
+    register('u idem 2', 'testidem2@test.com', '123aBc!')
+    assert create_product('pricey idempotent product',
+                          'costs more than a new balance', 500,
+                          '2022-01-01', 'testidem0@test.com')
+    assert isinstance(purchase_product('pricey idempotent product',
+                                       'testidem2@test.com',
+                                       idempotency_key='poor-1'), str)
+    User.query.filter_by(email='testidem2@test.com') \
+        .update({User.balance: 1000})
+    db.session.commit()
+    assert purchase_product('pricey idempotent product',
+                            'testidem2@test.com',
+                            idempotency_key='poor-1') is True
+    assert orders('testidem2@test.com') == 1
+
+
+def test_concurrent_retries():
+    '''
+    Testing that the same purchase sent from many threads at once is placed
+    once and every caller is told it succeeded.
+    '''
+    before = orders()
+    results = []
+
+    def retry():
+        try:
+            results.append(purchase_product(
+                'idempotent product', 'testidem1@test.com',
+                idempotency_key='order-race'))
+        finally:
+            db.session.remove()
+
+    threads = [threading.Thread(target=retry) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [True] * 8
+    assert orders() == before + 1
+
+
+def test_expired_keys():
+    '''
+    Testing that an expired key can be used again and is purged.
+    '''
+    IdempotencyKeys.query.filter_by(operation='purchase_product',
+                                    key='order-1') \
+        .update({IdempotencyKeys.expires: datetime.now() - timedelta(1)})
+    db.session.commit()
+    before = orders()
+    assert purchase_product('idempotent product', 'testidem1@test.com',
+                            idempotency_key='order-1') is True
+    assert orders() == before + 1
+
+    IdempotencyKeys.query.filter_by(key='order-2') \
+        .update({IdempotencyKeys.expires: datetime.now() - timedelta(1)})
+    db.session.commit()
+    assert purge_idempotency_keys(chunk_size=1) == 1
+    assert IdempotencyKeys.query.filter_by(key='order-2').count() == 0
+    assert IdempotencyKeys.query.filter_by(key='order-1').count() == 2
+
+
+def test_title_race():
+    '''
+    Testing that losing the race for a title returns False (R4-8) rather
+    than a database error.
+    '''
+    db.session.add(Product(title='raced product', desc='taken by a racer',
+                           price=20, last_modified_date=datetime.now(),
+                           owner_email='testidem0@test.com'))
+    db.session.commit()
+    # as if the other writer committed after our title check
+    from qbay import models
+    real = models.get_product
+    models.get_product = lambda title: None
+    try:
+        assert create_product('raced product', 'lost the race for it', 20,
+                              '2022-01-01', 'testidem0@test.com') is False
+    finally:
+        models.get_product = real
+
+
+def test_key_reused():
+    '''
+    Testing that a key repeated with other arguments is refused rather
+    than answered with the first call's result.
+    '''
+    before = orders(), orders('testidem2@test.com')
+    # same key, another product
+    assert purchase_product('pricey idempotent product',
+                            'testidem1@test.com',
+                            idempotency_key='order-1') == KEY_REUSED
+    # same key, another buyer
+    assert purchase_product('idempotent product', 'testidem2@test.com',
+                            idempotency_key='order-1') == KEY_REUSED
+    assert (orders(), orders('testidem2@test.com')) == before
+    # the original call is still answered from the key
+    assert purchase_product('idempotent product', 'testidem1@test.com',
+                            idempotency_key='order-1') is True
+    assert orders() == before[0]
+
+    assert create_product('reused key product', 'not made under create-1',
+                          20, '2022-01-01', 'testidem0@test.com',
+                          idempotency_key='create-1') == KEY_REUSED
+    assert Product.query.filter_by(title='reused key product').count() == 0
+
+
+def test_expired_key_kept_on_refusal():
+    '''
+    Testing that a call refused before writing anything leaves an expired
+    key alone; only the call that reuses it deletes it.
+    '''
+    IdempotencyKeys.query.filter_by(operation='purchase_product',
+                                    key='order-race') \
+        .update({IdempotencyKeys.expires: datetime.now() - timedelta(1)})
+    db.session.commit()
+    assert purchase_product('no such product', 'testidem1@test.com',
+                            idempotency_key='order-race') is False
+    assert IdempotencyKeys.query.filter_by(key='order-race').count() == 1
+
+    before = orders()
+    assert purchase_product('idempotent product', 'testidem1@test.com',
+                            idempotency_key='order-race') is True
+    assert orders() == before + 1
+    row = IdempotencyKeys.query.filter_by(key='order-race').one()
+    assert row.expires > datetime.now()
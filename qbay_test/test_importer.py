@@ -0,0 +1,102 @@
+import io
+import json
+
+from sqlalchemy import event
+
+from qbay.__main__ import main
+from qbay.importer import import_products
+from qbay.models import db, register, create_product, Product
+from qbay.search import search_products
+
+HEADER = 'title,description,price,owner_email,date\n'
+
+
+def test_import_csv(tmp_path):
+    '''
+    Testing that valid rows are imported and every other row is rejected
+    with the requirement it failed.
+    '''
+    register('u import 0', 'testimport0@test.com', '123aBc!')
+    create_product('imported taken', 'a product that was there first', 20,
+                   '2022-01-01', 'testimport0@test.com')
+    source = io.StringIO(
+        HEADER
+        + 'imported one,the first imported product,20,'
+          'testimport0@test.com,2022-01-01\n'
+        + 'imported two,the second imported product,20.5,'
+          'testimport0@test.com,2022-02-01\n'
+        + 'imported one,the first product once more,30,'
+          'testimport0@test.com,2022-01-01\n'
+        + 'imported taken,a product that was there first,20,'
+          'testimport0@test.com,2022-01-01\n'
+        + 'imported stray,nobody owns this product,20,'
+          'testimport9@test.com,2022-01-01\n'
+        + ' imported badly,a title with a leading space,20,'
+          'testimport0@test.com,2022-01-01\n'
+        + 'imported cheap,a product that costs too little,abc,'
+          'testimport0@test.com,2022-01-01\n'
+        + 'imported short\n')
+    rejects = io.StringIO()
+    # build the search index now, so it has to learn of the imports
+    search_products('product')
+    stats = import_products(source, 'csv', rejects, chunk_size=3)
+    assert stats == {'rows': 8, 'imported': 2, 'rejected': 6}
+    reasons = sorted((r['line'], r['reason'])
+                     for r in map(json.loads, rejects.getvalue().splitlines()))
+    assert reasons == [(4, 'duplicate'), (5, 'R4-8'), (6, 'R4-7'),
+                       (7, 'R4-1'), (8, 'R4-5'), (9, 'malformed')]
+
+    product = Product.query.filter_by(title='imported two').one()
+    assert product.price == 20.5 and product.desc == \
+        'the second imported product'
+    # product_listeners heard about the imported products
+    assert 'imported two' in [p.title for p in search_products('second')]
+
+
+def test_import_jsonl_round_trips(tmp_path):
+    '''
+    Testing that a chunk costs a fixed number of statements however many
+    rows it has, and the command line entry point.
+    '''
+    path = tmp_path / 'products.jsonl'
+    with open(path, 'w') as f:
+        for i in range(50):
+            f.write(json.dumps({
+                'title': 'bulk import %d' % i, 'price': 15,
+                'description': 'one of many imported products',
+                'owner_email': 'testimport0@test.com',
+                'date': '2023-03-03'}) + '\n')
+        f.write('not json\n')
+        # the right keys with the wrong types
+        for bad in ({'owner_email': ['testimport0@test.com']},
+                    {'date': 20230303}, {'price': True}, {'price': '15'},
+                    {'title': None}):
+            f.write(json.dumps(dict({
+                'title': 'badly typed import', 'price': 15,
+                'description': 'a product with a wrong type',
+                'owner_email': 'testimport0@test.com',
+                'date': '2023-03-03'}, **bad)) + '\n')
+
+    statements = []
+
+    def count(*args):
+        statements.append(args[2])
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        main(['import', 'products', str(path), '--chunk-size', '50',
+              '--rejects', str(tmp_path / 'rejects.jsonl')])
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    # owners, titles, insert, new product ids; the commit is not a statement
+    assert len(statements) == 4
+    assert Product.query.filter(
+        Product.title.like('bulk import %')).count() == 50
+    with open(tmp_path / 'rejects.jsonl') as f:
+        rejects = [json.loads(line) for line in f]
+    assert rejects[0] == {'line': 51, 'reason': 'malformed',
+                          'record': 'not json'}
+    assert [(r['line'], r['reason']) for r in rejects[1:]] == \
+        [(line, 'malformed') for line in range(52, 57)]
+    assert Product.query.filter_by(title='badly typed import').count() == 0
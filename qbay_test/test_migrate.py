@@ -0,0 +1,51 @@
+from sqlalchemy import create_engine, inspect, text
+
+from qbay.models import db
+from qbay.migrate import migrate_indexes, missing_indexes, \
+    add_missing_columns
+
+
+def test_migrate_indexes(tmp_path):
+    '''
+    Testing migrate-indexes on a database created before the indexes were
+    declared: the hot lookup columns get indexed, and a second run is a
+    no-op.
+    '''
+    engine = create_engine('sqlite:///' + str(tmp_path / 'old.sqlite'))
+    db.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(text('DROP INDEX %s' % index.name))
+
+    lines = []
+    created = migrate_indexes(engine, out=lines.append)
+    assert set(created) >= {'ix_user_username', 'ix_product_owner_email',
+                            'ix_transactions_buyer', 'ix_transactions_seller',
+                            'ix_transactions_product_id'}
+    assert missing_indexes(engine) == []
+    assert migrate_indexes(engine, out=lines.append) == []
+    assert lines[-1] == 'all indexes are present'
+
+    plan = inspect(engine)
+    assert 'ix_user_username' in {
+        i['name'] for i in plan.get_indexes('user')}
+
+
+def test_add_missing_columns(tmp_path):
+    '''
+    Testing that init_db's column migration adds the review columns to a
+    reviews table created before reviews belonged to a product.
+    '''
+    engine = create_engine('sqlite:///' + str(tmp_path / 'reviews.sqlite'))
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE reviews (id INTEGER PRIMARY KEY, '
+            'content VARCHAR(255) NOT NULL, subject VARCHAR(100) NOT NULL, '
+            'poster VARCHAR(100) NOT NULL, timestamp TIMESTAMP)'))
+    with engine.begin() as connection:
+        assert add_missing_columns(connection) == ['reviews.product_id',
+                                                   'reviews.rating']
+        assert add_missing_columns(connection) == []
+    columns = {c['name'] for c in inspect(engine).get_columns('reviews')}
+    assert {'product_id', 'rating'} <= columns
@@ -1,5 +1,5 @@
 from qbay.models import register, login, create_product, update_product
-from qbay.models import user_update, purchase_product
+from qbay.models import user_update, purchase_product, register_many
 
 
 def test_r1_1_non_empty():
@@ -105,6 +105,31 @@ def test_r1_10_balance_100():
     assert newu.balance == 100
 
 
+def test_register_many():
+    '''
+    Testing register_many: every row gets the reason code of the R1 rule
+    that rejected it, or 'ok', in input order.
+    '''
+    register('u rm 0', 'testrm-0@test.com', '123aBc!')
+    results = register_many([
+        ('u rm 1', 'testrm-1@test.com', '123aBc!'),
+        {'name': 'u rm 2', 'email': 'testrm-2@test.com',
+         'password': '123aBc!'},
+        ('u rm 3', 'testrm-0@test.com', '123aBc!'),
+        ('u rm 4', 'testrm-1@test.com', '123aBc!'),
+        ('u rm 5', '', '123aBc!'),
+        ('u rm 6', 'testrm6.com', '123aBc!'),
+        ('u rm 7', 'testrm-7@test.com', '123abc!'),
+        ('u-rm-8', 'testrm-8@test.com', '123aBc!'),
+        ('u9', 'testrm-9@test.com', '123aBc!'),
+    ], chunk_size=2)
+    assert [r.index for r in results] == list(range(9))
+    assert [r.reason for r in results] == [
+        'ok', 'ok', 'R1-7', 'R1-7', 'R1-1', 'R1-3', 'R1-4', 'R1-5', 'R1-6']
+    assert register('u rm 1', 'testrm-1@test.com', '123aBc!') is False
+    assert register('u rm 2', 'testrm-2@test.com', '123aBc!') is False
+
+
 def test_r2_1_login_possible():
     '''
     Testing R2-1: A user can log in using her/his email address
@@ -223,7 +248,7 @@ def test_r3_3_postal_code():
                        new_postal_code='K7@ 1J5') is False
 
 
-def test_r3_4_username_requirement():
+def test_r3_4_username_requirement(capsys):
     '''
     Testing R3-4: Username follows the requirements from the
     registration.
@@ -238,13 +263,16 @@ def test_r3_4_username_requirement():
                        new_shipping_address='51 Colborne St',
                        new_postal_code='K7K 1J5') is False
     # Has to be longer than 2 characters.
+    capsys.readouterr()
     assert user_update('u0 r3 4', new_username='u1',
                        new_shipping_address='51 Colborne St',
                        new_postal_code='K7K 1J5') is False
+    assert capsys.readouterr().out == "Length of username failure\n"
     # Alphanumeric only.
     assert user_update('u0 r3 4', new_username='u1!@#',
                        new_shipping_address='51 Colborne St',
                        new_postal_code='K7K 1J5') is False
+    assert capsys.readouterr().out == "Username requirement failure.\n"
 
 
 def test_r4_1_alphanumeric_only():
@@ -0,0 +1,75 @@
+import threading
+
+from qbay.models import db, register, create_product, purchase_product, \
+    User, Transactions, OrderTransitions
+from qbay.orders import run_worker, advance_batch, order_history
+
+
+def make_orders(count):
+    register('u orders 0', 'testorders0@test.com', '123aBc!')
+    register('u orders 1', 'testorders1@test.com', '123aBc!')
+    User.query.filter_by(email='testorders1@test.com') \
+        .update({User.balance: 10 ** 6})
+    db.session.commit()
+    create_product('ordered product', 'a product that gets shipped', 11,
+                   '2022-01-01', 'testorders0@test.com')
+    for _ in range(count):
+        assert purchase_product('ordered product',
+                                'testorders1@test.com') is True
+    return [t.id for t in Transactions.query.filter_by(
+        seller='testorders0@test.com')]
+
+
+def test_advance_orders():
+    '''
+    Testing that orders move one status per batch and every move is
+    recorded.
+    '''
+    ids = make_orders(5)
+    # nothing has been processed yet, so nothing can ship
+    assert advance_batch('shipped') == 0
+    assert advance_batch('processed', chunk_size=3) == 3
+
+    batches = []
+    totals = run_worker(chunk_size=2, out=batches.append)
+    assert totals['delivered'] >= 5
+    assert all(b.orders <= 2 and b.orders_per_s > 0 for b in batches)
+
+    statuses = {t.status for t in Transactions.query.filter(
+        Transactions.id.in_(ids))}
+    assert statuses == {'delivered'}
+    assert [status for status, _ in order_history(ids[0])] == \
+        ['processed', 'shipped', 'delivered']
+
+
+def test_parallel_workers():
+    '''
+    Testing that workers running at the same time never move an order
+    twice.
+    '''
+    register('u orders 2', 'testorders2@test.com', '123aBc!')
+    User.query.filter_by(email='testorders2@test.com') \
+        .update({User.balance: 10 ** 6})
+    db.session.commit()
+    for _ in range(200):
+        purchase_product('ordered product', 'testorders2@test.com')
+    ids = [t.id for t in Transactions.query.filter_by(
+        buyer='testorders2@test.com')]
+
+    def worker():
+        try:
+            run_worker(chunk_size=7)
+        finally:
+            db.session.remove()
+
+    workers = [threading.Thread(target=worker) for _ in range(4)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    assert {t.status for t in Transactions.query.filter(
+        Transactions.id.in_(ids))} == {'delivered'}
+    moves = OrderTransitions.query.filter(
+        OrderTransitions.transaction_id.in_(ids)).count()
+    assert moves == 3 * len(ids)
@@ -0,0 +1,72 @@
+from qbay import app
+from qbay.models import db, register, register_many, login, User
+from qbay.passwords import hash_password, hash_passwords, verify_password, \
+    needs_rehash
+
+
+def test_hash_and_verify():
+    '''
+    Testing that hashes verify, fit the password column, and that plaintext
+    or old work factor hashes are flagged for rehashing.
+    '''
+    stored = hash_password('123aBc!', iterations=1500)
+    assert stored.startswith('pbkdf2$1500$')
+    assert len(stored) <= User.password.type.length
+    assert verify_password('123aBc!', stored) is True
+    assert verify_password('123aBc?', stored) is False
+    assert needs_rehash(stored) is True
+    assert needs_rehash(hash_password('123aBc!')) is False
+
+    assert verify_password('123aBc!', '123aBc!') is True
+    assert needs_rehash('123aBc!') is True
+
+
+def test_register_stores_hash():
+    '''
+    Testing that register never stores the plaintext password.
+    '''
+    register('u pw 0', 'testpw0@test.com', '123aBc!')
+    stored = User.query.filter_by(email='testpw0@test.com').first().password
+    assert stored != '123aBc!'
+    assert verify_password('123aBc!', stored)
+
+
+def test_login_rehashes(monkeypatch):
+    '''
+    Testing that login upgrades plaintext passwords and hashes made with
+    another work factor.
+    '''
+    monkeypatch.setattr('qbay.models.validate_login', lambda e, p: None)
+    register('u pw 1', 'testpw1@test.com', '123aBc!')
+    user = User.query.filter_by(email='testpw1@test.com').first()
+    user.password = '123aBc!'  # as stored before passwords were hashed
+    db.session.commit()
+
+    assert login('testpw1@test.com', '123aBc!').email == 'testpw1@test.com'
+    upgraded = User.query.filter_by(email='testpw1@test.com').first().password
+    assert upgraded.startswith(
+        'pbkdf2$%d$' % app.config['QBAY_PASSWORD_ITERATIONS'])
+
+    assert login('testpw1@test.com', '123aBc?') is None
+    assert login('nobody@test.com', '123aBc!') is None
+
+
+def test_bulk_hashing(monkeypatch):
+    '''
+    Testing that passwords hashed on the thread pool verify, and that users
+    imported at a cheaper work factor are rehashed when they log in.
+    '''
+    monkeypatch.setitem(app.config, 'QBAY_PASSWORD_HASH_WORKERS', 4)
+    passwords = ['123aBc!%d' % i for i in range(8)]
+    hashes = hash_passwords(passwords, iterations=1200)
+    assert all(verify_password(p, h) for p, h in zip(passwords, hashes))
+    assert len(set(hashes)) == 8
+
+    results = register_many([('u bulk hash', 'testbulkhash%d@test.com' % i,
+                              '123aBc!') for i in range(3)], iterations=500)
+    assert {r.reason for r in results} == {'ok'}
+    user = User.query.filter_by(email='testbulkhash0@test.com').first()
+    assert user.password.startswith('pbkdf2$500$')
+    assert login('testbulkhash0@test.com', '123aBc!')
+    db.session.refresh(user)
+    assert not needs_rehash(user.password)
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from qbay.pool import TimedQueuePool, pool_stats, pool_status
+
+
+def test_pool_stats(tmp_path):
+    '''
+    Testing checkout, wait and timeout counting on a one connection pool.
+    '''
+    engine = create_engine('sqlite:///%s' % (tmp_path / 'pool.sqlite'),
+                           poolclass=TimedQueuePool, pool_size=1,
+                           max_overflow=0, pool_timeout=0.05,
+                           pool_pre_ping=True)
+    pool_stats.reset()
+
+    with engine.connect() as connection:
+        connection.execute(text('select 1'))
+        # the only connection is taken
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+    with engine.connect() as connection:
+        connection.execute(text('select 1'))
+
+    stats = pool_stats.snapshot(engine.pool)
+    assert stats['checkouts'] == 2
+    assert stats['connects'] == 1
+    assert stats['timeouts'] == 1
+    assert stats['max_wait'] >= 0.05
+    assert stats['size'] == 1 and stats['checked_out'] == 0
+
+    engine.dispose()
+
+
+def test_pool_wait(tmp_path):
+    '''
+    Testing that a checkout blocked on a busy pool is measured as a wait.
+    '''
+    engine = create_engine('sqlite:///%s' % (tmp_path / 'pool.sqlite'),
+                           poolclass=TimedQueuePool, pool_size=1,
+                           max_overflow=0, pool_timeout=5)
+    pool_stats.reset()
+    busy = engine.connect()
+    # another thread returns the only connection after 0.1 seconds
+    threading.Timer(0.1, busy.close).start()
+    with engine.connect() as connection:
+        connection.execute(text('select 1'))
+    stats = pool_stats.snapshot()
+    assert stats['checkouts'] == 2
+    assert 0.05 <= stats['max_wait'] < 5
+    assert stats['timeouts'] == 0
+    engine.dispose()
+
+
+def test_pool_status():
+    '''
+    Testing that the application's pool can be inspected whatever its class.
+    '''
+    assert pool_status()['timeouts'] >= 0
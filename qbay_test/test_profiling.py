@@ -0,0 +1,32 @@
+from qbay import profiling
+from qbay.models import register, create_product, get_product
+
+
+def test_profiling():
+    '''
+    Testing that profiled functions are timed and charged with their SQL,
+    including the SQL of the profiled functions they call, and that nothing
+    is collected once profiling is disabled.
+    '''
+    register('u profile 0', 'testprofile0@test.com', '123aBc!')
+    profiling.reset()
+    profiling.enable()
+    try:
+        assert create_product('profiled product', 'a product being profiled',
+                              20, '2022-01-01', 'testprofile0@test.com')
+        get_product(title='no such profiled product')
+    finally:
+        profiling.disable()
+
+    stats = profiling.snapshot()
+    assert stats['create_product']['calls'] == 1
+    assert stats['create_product']['total_ms'] > 0
+    # owner lookup, title lookup, insert
+    assert stats['create_product']['statements'] >= 3
+    assert stats['create_product']['rows'] >= 1
+    assert stats['get_product']['calls'] == 2
+    assert stats['get_product']['statements'] == 2
+    assert 'create_product' in profiling.format_snapshot(stats)
+
+    get_product(title='no such profiled product')
+    assert profiling.snapshot() == stats
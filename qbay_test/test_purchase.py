@@ -0,0 +1,109 @@
+import threading
+
+from sqlalchemy import event
+
+from qbay.models import db, register, create_product, purchase_product, \
+    update_product, get_product, User, Product, Transactions
+
+
+def balance(email):
+    return User.query.filter_by(email=email).first().balance
+
+
+def test_purchase_moves_balance():
+    '''
+    Testing that an order debits the buyer and credits the seller.
+    '''
+    register('u buy 0', 'testbuy0@test.com', '123aBc!')
+    register('u buy 1', 'testbuy1@test.com', '123aBc!')
+    create_product('buy product 0', 'a product to test purchases', 30,
+                   '2022-01-01', 'testbuy0@test.com')
+
+    assert purchase_product('buy product 0', 'testbuy1@test.com') is True
+    assert balance('testbuy1@test.com') == 70
+    assert balance('testbuy0@test.com') == 130
+
+    assert purchase_product('buy product 0', 'testbuy0@test.com') == \
+        "Cannot make an order on your own products"
+    assert purchase_product('no such product', 'testbuy1@test.com') is False
+    assert purchase_product('buy product 0', 'nobody@test.com') is False
+    # the seller row locked for the order was released
+    assert not db.session().in_transaction()
+
+
+def test_concurrent_purchases():
+    '''
+    Stress test: many threads buying at once never overspend a balance or
+    lose a debit/credit. Runs against whatever database db_string points
+    at, so the same test covers SQLite and MySQL.
+    '''
+    buyers = ['testbuyer%d@test.com' % i for i in range(8)]
+    register('u seller', 'testseller@test.com', '123aBc!')
+    for i, email in enumerate(buyers):
+        register('u buyer %d' % i, email, '123aBc!')
+    create_product('stress product', 'a product to stress purchases', 15,
+                   '2022-01-01', 'testseller@test.com')
+
+    outcomes = []
+
+    def buy(email):
+        try:
+            for _ in range(10):
+                outcomes.append(purchase_product('stress product', email))
+        finally:
+            db.session.remove()
+
+    # two threads per buyer, each trying to buy 10 times
+    threads = [threading.Thread(target=buy, args=(email,))
+               for email in buyers * 2]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 100 // 15: every buyer affords exactly 6 orders
+    assert outcomes.count(True) == 6 * len(buyers)
+    db.session.expire_all()
+    for email in buyers:
+        assert balance(email) == 100 - 6 * 15
+    assert balance('testseller@test.com') == 100 + 6 * 15 * len(buyers)
+    assert Transactions.query.filter_by(
+        seller='testseller@test.com').count() == 6 * len(buyers)
+
+
+def test_purchase_charges_current_price():
+    '''
+    Testing that an update committed while another thread reads the product
+    does not leave the old price cached, and that an order charges the
+    price in the database even when the cached one is stale.
+    '''
+    register('u buy 2', 'testbuy2@test.com', '123aBc!')
+    register('u buy 3', 'testbuy3@test.com', '123aBc!')
+    create_product('buy product 2', 'a product whose price goes up', 20,
+                   '2022-01-01', 'testbuy2@test.com')
+    product = get_product(title='buy product 2')
+
+    def read_before_commit(session):
+        # another thread caches the row still committed in the database
+        reader = threading.Thread(target=get_product,
+                                  kwargs={'title': 'buy product 2'})
+        reader.start()
+        reader.join()
+
+    event.listen(db.session, 'before_commit', read_before_commit)
+    try:
+        assert update_product(product.id, newTitle='buy product 2',
+                              newDesc='a product whose price goes up',
+                              newPrice=50) is True
+    finally:
+        event.remove(db.session, 'before_commit', read_before_commit)
+    assert get_product(title='buy product 2').price == 50
+
+    # a price change the cache cannot know about
+    get_product(title='buy product 2')
+    Product.query.filter_by(id=product.id).update({Product.price: 60})
+    db.session.commit()
+    assert purchase_product('buy product 2', 'testbuy3@test.com') is True
+    assert balance('testbuy3@test.com') == 40
+    assert Transactions.query.filter_by(
+        buyer='testbuy3@test.com').one().price == 60
@@ -0,0 +1,38 @@
+from qbay.models import register, register_many, login, user_update, \
+    create_product, update_product, purchase_product, get_product
+
+
+def test_user_query_budgets(query_budget):
+    '''
+    Testing the statement budgets of the user operations.
+    '''
+    assert query_budget(register, 'u budget 0', 'testbudget0@test.com',
+                        '123aBc!') is True
+    assert query_budget(register, 'u budget 1', 'testbudget1@test.com',
+                        '123aBc!') is True
+    # the cost of register_many does not grow with the number of users
+    results = query_budget(register_many, [
+        ('u budget many', 'testbudgetmany%d@test.com' % i, '123aBc!')
+        for i in range(50)])
+    assert {r.reason for r in results} == {'ok'}
+    assert query_budget(login, 'testbudget0@test.com', '123aBc!')
+    assert query_budget(user_update, 'u budget 0',
+                        new_username='u budget 0',
+                        new_shipping_address='1 Main St',
+                        new_postal_code='K7L 3N6') is True
+
+
+def test_product_query_budgets(query_budget):
+    '''
+    Testing the statement budgets of the product operations.
+    '''
+    assert query_budget(create_product, 'budget product',
+                        'a product with a query budget', 20, '2022-01-01',
+                        'testbudget0@test.com') is True
+    product = query_budget(get_product, title='budget product')
+    assert query_budget(update_product, product.id,
+                        newTitle='budget product renamed',
+                        newDesc='a product with a query budget',
+                        newPrice=21) is True
+    assert query_budget(purchase_product, 'budget product renamed',
+                        'testbudget1@test.com') is True
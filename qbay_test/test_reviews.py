@@ -0,0 +1,62 @@
+from qbay.models import register, create_product, get_product, \
+    create_review, product_reviews, poster_reviews, product_rating, \
+    RatingInfo
+
+
+def test_create_review(query_budget):
+    '''
+    Testing posting reviews, the rules they have to follow and the rating
+    kept for their product.
+    '''
+    register('u review 0', 'testreview0@test.com', '123aBc!')
+    register('u review 1', 'testreview1@test.com', '123aBc!')
+    create_product('reviewed product', 'a product people review', 20,
+                   '2022-01-01', 'testreview0@test.com')
+    product = get_product(title='reviewed product')
+    assert product_rating(product.id) == RatingInfo(0, None)
+
+    assert query_budget(create_review, product.id, 'testreview1@test.com',
+                        4, 'good', 'does what it says') is True
+    assert create_review(product.id, 'testreview0@test.com', 1, 'bad',
+                         'broke on day one') is True
+    assert product_rating(product.id) == RatingInfo(2, 2.5)
+
+    # R6-1 to R6-4
+    assert create_review(product.id, 'testreview1@test.com', 6, 'x',
+                         'y') is False
+    assert create_review(product.id, 'testreview1@test.com', 3, '',
+                         'y') is False
+    assert create_review(product.id, 'testreview1@test.com', 3, 'x',
+                         'y' * 256) is False
+    assert create_review(999999, 'testreview1@test.com', 3, 'x',
+                         'y') is False
+    assert create_review(product.id, 'nobody@test.com', 3, 'x',
+                         'y') is False
+    assert product_rating(product.id) == RatingInfo(2, 2.5)
+
+
+def test_list_reviews():
+    '''
+    Testing newest first listings by product and by poster, page by page.
+    '''
+    product = get_product(title='reviewed product')
+    for i in range(5):
+        create_review(product.id, 'testreview1@test.com', 5,
+                      'review %d' % i, 'more to say')
+
+    pages = list(product_reviews(product.id, page_size=3))
+    assert [len(page) for page in pages] == [3, 3, 1]
+    reviews = [r for page in pages for r in page]
+    assert [r.subject for r in reviews[:5]] == \
+        ['review %d' % i for i in range(4, -1, -1)]
+    assert reviews[-1].subject == 'good'
+
+    # resuming after a review continues where the first page stopped
+    rest = next(product_reviews(product.id, page_size=3,
+                                before=pages[0][-1]))
+    assert rest == pages[1]
+
+    mine = [r for page in poster_reviews('testreview1@test.com')
+            for r in page]
+    assert len(mine) == 6
+    assert product_rating(product.id) == RatingInfo(7, 30 / 7)
@@ -0,0 +1,63 @@
+from datetime import date
+
+from qbay.models import db, register, create_product, purchase_product, \
+    get_product, Transactions
+from qbay.rollups import seller_totals, product_totals, daily_sales, \
+    sales_between, rebuild_rollups, SalesTotals
+
+
+def grouped(column, value):
+    '''
+    The totals the rollups replace, computed the slow way.
+    '''
+    rows = Transactions.query.filter(column == value).all()
+    return SalesTotals(len(rows), sum(r.price for r in rows))
+
+
+def test_purchase_updates_rollups():
+    '''
+    Testing that every order is added to the seller, product and daily
+    totals, and that a refused order changes nothing.
+    '''
+    register('u rollup 0', 'testrollup0@test.com', '123aBc!')
+    register('u rollup 1', 'testrollup1@test.com', '123aBc!')
+    create_product('rollup product', 'a product to total the sales of', 30,
+                   '2022-01-01', 'testrollup0@test.com')
+    product = get_product(title='rollup product')
+    today = date.today()
+    before = daily_sales(today)
+
+    assert seller_totals('testrollup0@test.com') == SalesTotals(0, 0)
+    for _ in range(3):
+        assert purchase_product('rollup product',
+                                'testrollup1@test.com') is True
+
+    assert seller_totals('testrollup0@test.com') == SalesTotals(3, 90)
+    assert product_totals(product.id) == SalesTotals(3, 90)
+    assert daily_sales(today) == SalesTotals(before.units + 3,
+                                             before.revenue + 90)
+    assert sales_between(today, today) == [(today, daily_sales(today))]
+
+    # the buyer only has 10 left
+    assert purchase_product('rollup product',
+                            'testrollup1@test.com') is not True
+    assert seller_totals('testrollup0@test.com') == SalesTotals(3, 90)
+
+
+def test_rebuild_rollups():
+    '''
+    Testing that a rebuild, in small chunks, reproduces the GROUP BY totals.
+    '''
+    product = get_product(title='rollup product')
+    expected_seller = grouped(Transactions.seller, 'testrollup0@test.com')
+    expected_product = grouped(Transactions.product_id, product.id)
+    expected_day = daily_sales(date.today())
+
+    db.session.execute(db.text('DELETE FROM seller_totals'))
+    db.session.commit()
+    assert seller_totals('testrollup0@test.com') == SalesTotals(0, 0)
+
+    assert rebuild_rollups(chunk_size=2) == Transactions.query.count()
+    assert seller_totals('testrollup0@test.com') == expected_seller
+    assert product_totals(product.id) == expected_product
+    assert daily_sales(date.today()) == expected_day
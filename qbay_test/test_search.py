@@ -0,0 +1,49 @@
+from qbay.models import register, create_product, update_product, \
+    get_product
+from qbay.search import SearchIndex, search_products
+
+
+def test_index_ranking():
+    '''
+    Testing that every query word must match and that title matches rank
+    above description matches.
+    '''
+    index = SearchIndex()
+    index.built = True
+    index.add(1, 'red kettle', 'an electric kettle for tea')
+    index.add(2, 'blue mug', 'a mug that goes well with a red kettle')
+    index.add(3, 'red mug', 'a plain mug')
+
+    assert [hit.id for hit in index.search('red kettle')] == [1, 2]
+    assert [hit.id for hit in index.search('MUG')][-1] == 2
+    assert index.search('red teapot') == []
+
+    index.add(1, 'green kettle', 'an electric kettle for tea')
+    assert [hit.id for hit in index.search('red kettle')] == [2]
+    index.remove(2)
+    assert index.search('red kettle') == []
+    assert len(index) == 2
+
+
+def test_search_products_follows_writes():
+    '''
+    Testing that created and updated products are searchable once
+    committed.
+    '''
+    register('u search 0', 'testsearch0@test.com', '123aBc!')
+    create_product('search lamp', 'a desk lamp with a flexible neck', 25,
+                   '2022-01-01', 'testsearch0@test.com')
+    assert [h.title for h in search_products('flexible lamp')] == \
+        ['search lamp']
+
+    create_product('search chair', 'an office chair with a flexible back',
+                   50, '2022-01-01', 'testsearch0@test.com')
+    assert {h.title for h in search_products('flexible')} == \
+        {'search lamp', 'search chair'}
+
+    product = get_product(title='search chair')
+    update_product(product.id, newPrice=60, newTitle='search stool',
+                   newDesc='a tall stool for the kitchen counter')
+    assert search_products('chair') == []
+    assert [h.title for h in search_products('kitchen stool')] == \
+        ['search stool']
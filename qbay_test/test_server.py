@@ -0,0 +1,138 @@
+import asyncio
+import json
+import threading
+
+from qbay import server as api
+from qbay.server import QbayServer
+
+
+async def request(port, method, path, body=None, token=None):
+    '''
+    Send one HTTP request on a new connection, returning (status, JSON).
+    '''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = b'' if body is None else json.dumps(body).encode()
+    auth = '' if token is None else 'Authorization: Bearer %s\r\n' % token
+    writer.write(('%s %s HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n'
+                  '%sConnection: close\r\n\r\n'
+                  % (method, path, len(data), auth)).encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(payload)
+
+
+def run(scenario, **options):
+    async def main():
+        server = QbayServer(port=0, **options)
+        port = await server.start()
+        try:
+            return await scenario(port)
+        finally:
+            await server.shutdown(grace=5)
+    return asyncio.run(main())
+
+
+def test_server_operations():
+    '''
+    Testing register, login, product create/update/browse and purchase over
+    HTTP.
+    '''
+    async def scenario(port):
+        seller = {'name': 'u server 0', 'email': 'testserver0@test.com',
+                  'password': '123aBc!'}
+        buyer = dict(seller, name='u server 1',
+                     email='testserver1@test.com')
+        assert await request(port, 'POST', '/register', seller) \
+            == (200, {'ok': True, 'result': True})
+        await request(port, 'POST', '/register', buyer)
+        # R1-7: the email is taken
+        assert await request(port, 'POST', '/register', seller) \
+            == (422, {'ok': False, 'result': False})
+
+        status, body = await request(port, 'POST', '/login', {
+            'email': 'testserver1@test.com', 'password': '123aBc!'})
+        assert status == 200 and body['result']['balance'] == 100
+        buyer_token = body['token']
+        status, body = await request(port, 'POST', '/login', {
+            'email': 'testserver0@test.com', 'password': '123aBc!'})
+        seller_token = body['token']
+
+        product = {'title': 'server product', 'price': 20,
+                   'description': 'a product sold over http',
+                   'date': '2022-01-01'}
+        assert (await request(port, 'POST', '/products', product))[0] \
+            == 401
+        # a user cannot list products for someone else
+        assert (await request(port, 'POST', '/products',
+                              dict(product,
+                                   owner_email='testserver0@test.com'),
+                              buyer_token))[0] == 403
+        status, body = await request(port, 'POST', '/products', product,
+                                     seller_token)
+        assert (status, body['ok']) == (200, True)
+
+        status, body = await request(
+            port, 'GET', '/products?owner_email=testserver0@test.com')
+        assert status == 200
+        product = body['products'][0]
+        assert product['title'] == 'server product'
+        assert body['next'] is None
+
+        update = {'newTitle': 'server product',
+                  'newDesc': 'a product sold over http', 'newPrice': 30}
+        path = '/products/%d' % product['id']
+        assert (await request(port, 'PUT', path, update,
+                              buyer_token))[0] == 403
+        status, body = await request(port, 'PUT', path, update,
+                                     seller_token)
+        assert (status, body['ok']) == (200, True)
+
+        # the buyer is the logged in user, whatever the body says
+        assert (await request(port, 'POST', '/purchase', {
+            'productTitle': 'server product',
+            'email': 'testserver0@test.com'}, buyer_token))[0] == 403
+        assert await request(port, 'POST', '/purchase', {
+            'productTitle': 'server product'}, buyer_token) \
+            == (200, {'ok': True, 'result': True})
+
+        assert await request(port, 'POST', '/logout', None, buyer_token) \
+            == (200, {'ok': True, 'result': True})
+        assert (await request(port, 'POST', '/purchase', {
+            'productTitle': 'server product'}, buyer_token))[0] == 401
+
+        assert (await request(port, 'PUT', '/products/999999', update,
+                              seller_token))[0] == 404
+        assert (await request(port, 'GET', '/nowhere'))[0] == 404
+        assert (await request(port, 'GET', '/login'))[0] == 405
+        status, body = await request(port, 'POST', '/login', {'x': 1})
+        assert status == 400 and 'TypeError' in body['error']
+
+    run(scenario)
+
+
+def test_server_backpressure(monkeypatch):
+    '''
+    Testing that calls beyond the workers and queue are refused with 503,
+    and that shutdown lets the calls in progress finish.
+    '''
+    release = threading.Event()
+
+    def slow_login(**kwargs):
+        release.wait(5)
+        return None
+
+    monkeypatch.setitem(api.ROUTES, ('POST', '/login'), slow_login)
+
+    async def scenario(port):
+        busy = [asyncio.ensure_future(request(port, 'POST', '/login', {}))
+                for _ in range(2)]
+        await asyncio.sleep(0.2)
+        # one worker, one queued call: the third call is refused
+        status, body = await request(port, 'POST', '/login', {})
+        assert status == 503 and body['ok'] is False
+        release.set()
+        assert [s for s, _ in await asyncio.gather(*busy)] == [422, 422]
+
+    run(scenario, workers=1, queue_size=1)
@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from qbay.sqlite import apply_profile, check_profile
+
+
+def test_tuned_profile(tmp_path):
+    '''
+    Testing that the tuned profile's pragmas are set on new connections.
+    '''
+    engine = create_engine('sqlite:///%s' % (tmp_path / 'tuned.sqlite'))
+    apply_profile(engine, 'tuned')
+    with engine.connect() as connection:
+        def pragma(name):
+            return connection.execute(text('PRAGMA ' + name)).scalar()
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1    # NORMAL
+        assert pragma('busy_timeout') == 10000
+        assert pragma('temp_store') == 2     # MEMORY
+        assert pragma('cache_size') == -64 * 1024
+    engine.dispose()
+
+
+def test_default_profile(tmp_path):
+    engine = create_engine('sqlite:///%s' % (tmp_path / 'stock.sqlite'))
+    apply_profile(engine, 'default')
+    with engine.connect() as connection:
+        assert connection.execute(
+            text('PRAGMA journal_mode')).scalar() == 'delete'
+    engine.dispose()
+    with pytest.raises(ValueError):
+        check_profile('fast')
@@ -0,0 +1,75 @@
+from qbay.validation import validate_registration, validate_user_update, \
+    validate_product, validate_batch, password_ok, check_email, email_cache
+
+
+def test_password_single_pass():
+    '''
+    Testing R1-4 password complexity in password_ok.
+    '''
+    assert password_ok('123aBc!') is True
+    assert password_ok('12aB!') is False
+    assert password_ok('123abc!') is False
+    assert password_ok('123ABC!') is False
+    assert password_ok('abcDEF!') is False
+    assert password_ok('123aBc') is False
+
+
+def test_reason_codes():
+    '''
+    Testing that each validator reports the id of the failed rule.
+    '''
+    assert validate_registration('u v 0', 'v0@test.com', '123aBc!') is None
+    assert validate_registration('u v 0', '', '123aBc!') == 'R1-1'
+    assert validate_registration('u v 0', 'v0@com', '123aBc!') == 'R1-3'
+    assert validate_registration(' u v 0', 'v0@test.com', '123aBc!') == 'R1-5'
+    assert validate_registration('uv', 'v0@test.com', '123aBc!') == 'R1-6'
+
+    assert validate_user_update('u v 1', '1 Main St', 'K7K 1J5') is None
+    assert validate_user_update('u v 1', '1 Main St!', 'K7K 1J5') == 'R3-2'
+    assert validate_user_update('u v 1', '1 Main St', 'K7K 1J55') == 'R3-3'
+    assert validate_user_update('u-v-1', '1 Main St', 'K7K 1J5') == 'R3-4'
+    assert validate_user_update('uv', '1 Main St', 'K7K 1J5') == 'R1-6'
+
+    assert validate_product('t v', 'd' * 20, 20, '2022-01-01') is None
+    assert validate_product('t-v', 'd' * 20, 20) == 'R4-1'
+    assert validate_product('t' * 81, 'd' * 100, 20) == 'R4-2'
+    assert validate_product('t v', 'd' * 19, 20) == 'R4-3'
+    assert validate_product('t' * 30, 'd' * 25, 20) == 'R4-4'
+    assert validate_product('t v', 'd' * 20, 10) == 'R4-5'
+    assert validate_product('t v', 'd' * 20, '20') == 'R4-5'
+    assert validate_product('t v', 'd' * 20, 20, '2030-01-01') == 'R4-6'
+    assert validate_product('t v', 'd' * 20, 20, 'not a date') == 'R4-6'
+
+
+def test_validate_batch():
+    '''
+    Testing validate_batch with positional and keyword records.
+    '''
+    results = validate_batch('register', [
+        ('u v 2', 'v2@test.com', '123aBc!'),
+        {'name': 'u v 3', 'email': 'v3@test.com', 'password': 'abc'},
+    ])
+    assert [(r.index, r.reason) for r in results] == [(0, 'ok'), (1, 'R1-4')]
+
+
+def test_check_email_offline_and_cached(monkeypatch):
+    '''
+    Testing that emails are checked without DNS by default and that
+    repeated checks are answered from the cache.
+    '''
+    calls = []
+
+    def no_dns(email, check_deliverability=True):
+        calls.append(check_deliverability)
+        return real_validate(email, check_deliverability=False)
+
+    from qbay import validation
+    real_validate = validation.validate_email
+    monkeypatch.setattr(validation, 'validate_email', no_dns)
+
+    assert check_email('Cached@Example.com') == 'Cached@example.com'
+    assert check_email('Cached@Example.com') == 'Cached@example.com'
+    assert check_email('not an email') is None
+    assert check_email('not an email') is None
+    assert calls == [False, False]
+    assert email_cache.stats()['hits'] >= 2